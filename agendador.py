@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+from telemetria import medir, contar, registrar_erro, perfil_thread
+
+# --- AGENDADOR DE ETAPAS COM PRAZO ---
+# Cada etapa roda na sua própria thread assim que as etapas de que depende
+# terminam. Uma etapa que passa do prazo é dada como perdida: quem depende dela
+# segue com o que houver e o script não espera por ela (threads daemon).
+
+class Etapa:
+    def __init__(self, nome, funcao, prazo, depende=()):
+        self.nome = nome
+        self.funcao = funcao      # recebe {dependência: valor} e devolve o resultado da etapa
+        self.prazo = prazo        # segundos a partir do início da própria etapa
+        self.depende = tuple(depende)
+
+def executar_etapas(etapas):
+    """
+    Roda as etapas em paralelo respeitando dependências e prazos.
+    Retorna {nome: {'status', 'valor', 'segundos', 'erro'}} com status 'ok', 'erro' ou
+    'prazo'; o valor de etapas com erro ou fora do prazo é None.
+    """
+    fila = queue.Queue()
+    pendentes = {e.nome: e for e in etapas}
+    rodando = {}
+    resultados = {}
+
+    def _rodar(etapa, entradas):
+        t0 = time.perf_counter()
+        try:
+            with perfil_thread(), medir(f"etapa.{etapa.nome}"):
+                valor = etapa.funcao(entradas)
+            fila.put((etapa.nome, 'ok', valor, None, time.perf_counter() - t0))
+        except Exception as e:
+            registrar_erro(f"etapa.{etapa.nome}", e)
+            fila.put((etapa.nome, 'erro', None, e, time.perf_counter() - t0))
+
+    while pendentes or rodando:
+        for nome, etapa in list(pendentes.items()):
+            if all(d in resultados for d in etapa.depende):
+                entradas = {d: resultados[d]['valor'] for d in etapa.depende}
+                threading.Thread(target=_rodar, args=(etapa, entradas), daemon=True, name=f"etapa-{nome}").start()
+                rodando[nome] = (etapa, time.perf_counter())
+                del pendentes[nome]
+        if not rodando:
+            # Dependência que não existe: nada mais pode começar
+            for nome in pendentes:
+                resultados[nome] = {'status': 'erro', 'valor': None, 'segundos': 0.0, 'erro': 'dependência ausente'}
+            break
+
+        limite = min(t0 + e.prazo for e, t0 in rodando.values())
+        try:
+            nome, status, valor, erro, segundos = fila.get(timeout=max(0.0, limite - time.perf_counter()))
+        except queue.Empty:
+            agora = time.perf_counter()
+            for nome, (etapa, t0) in list(rodando.items()):
+                if agora >= t0 + etapa.prazo:
+                    del rodando[nome]
+                    resultados[nome] = {'status': 'prazo', 'valor': None, 'segundos': agora - t0, 'erro': None}
+                    contar(f"etapa.{nome}.prazo")
+            continue
+        # Resultado de etapa que já estourou o prazo é descartado
+        if nome in rodando:
+            del rodando[nome]
+            resultados[nome] = {'status': status, 'valor': valor, 'segundos': segundos, 'erro': erro}
+    # Na ordem em que as etapas foram declaradas (para o relatório)
+    return {e.nome: resultados[e.nome] for e in etapas}
+
+def relatorio_etapas(resultados, total, itens=None):
+    """Imprime status e tempo de cada etapa; 'itens' pode trazer {etapa: quantidade encontrada}."""
+    itens = itens or {}
+    icones = {'ok': '✅', 'erro': '❌', 'prazo': '⏰'}
+    print("--- ⏱️ Tempo por etapa (em paralelo) ---")
+    for nome, r in resultados.items():
+        extra = f"{itens[nome]} itens" if nome in itens and r['status'] == 'ok' else (str(r['erro']) if r['erro'] else "")
+        print(f"   {icones.get(r['status'], '•')} {nome:8s} {r['status']:5s} {r['segundos']:6.1f}s  {extra}")
+    soma = sum(r['segundos'] for r in resultados.values())
+    print(f"   Total: {total:.1f}s de relógio (soma das etapas: {soma:.1f}s)")
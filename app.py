@@ -1,90 +1,213 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 import os
 import json
 import datetime
-import plotly.graph_objects as go
+import time
+import threading
+from carteira import numeros_ptbr, avaliar_carteira
+from cambio import TAXAS_PADRAO, taxas_spot, historico_taxas
+from fluxo_caixa import RESOLUCOES, eventos_caixa, linha_do_tempo
+from snapshots import valores_para_df, versao_snapshot, publicar_snapshot, ler_snapshot
+from historico_precos import versao_precos, ler_precos, matriz_precos
+from patrimonio import curva_patrimonio
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(page_title="SGP - Sistema de Gestão de Patrimônio", layout="wide")
 
 # --- UTILITÁRIOS ---
-def clean_num(val):
-    if val is None or val == "" or val == "-": return 0.0
-    s = str(val).strip()
-    if "," in s: s = s.replace(".", "").replace(",", ".")
-    try: return float(s)
-    except: return 0.0
-
-@st.cache_data(ttl=600)
-def load_data():
+# Chave no dicionário de dados -> nome da aba na planilha
+ABAS = {
+    "assets": "assets",
+    "trans": "transactions",
+    "market": "market_data",
+    "calendar": "dividend_calendar",
+    "history": "dividend_history",
+}
+
+# --- CACHE POR ABA COM DETECÇÃO DE MUDANÇA ---
+# Cada aba fica em cache até o seu "sinal" mudar. O sinal é uma célula barata que os
+# scripts de atualização reescrevem a cada execução (ex: Atualizado em da market_data,
+# carimbado por planilhas.Sessao.gravar). Abas editadas à mão (assets, transactions)
+# não têm sinal e expiram por tempo; as com sinal também, no máximo a cada TTL_ABAS
+# (edição manual não muda o sinal).
+SINAIS = {
+    "market": "'market_data'!D2",        # Atualizado em (toda gravação da Sessao)
+    "calendar": "'dividend_calendar'!F2", # Atualizado em (update_dividends)
+    "history": "'dividend_history'!H2",   # Atualizado em (update_dividend_history)
+}
+TTL_SINAIS = 30   # segundos entre verificações dos sinais
+TTL_ABAS = 600    # teto de defasagem de qualquer aba
+
+# Abas publicadas pelos scripts de atualização como snapshot local (ver snapshots.py).
+# O snapshot só é usado se a sua própria célula-sinal bate com o sinal lido no
+# Sheets e ele tem menos de TTL_ABAS (ou se o Sheets não respondeu): snapshot velho
+# nunca esconde uma atualização da planilha. Aba lida do Sheets vira o snapshot seguinte.
+# As abas editadas à mão também viram snapshot, mas gravado pelo próprio app e
+# válido só dentro da janela TTL_ABAS (acelera reinícios sem servir dado velho).
+ABAS_SNAPSHOT = ("market", "calendar", "history")
+
+@st.cache_resource
+def abrir_planilha():
+    # gspread e google-auth só carregam quando alguma aba não veio do snapshot local
+    import gspread
+    from google.oauth2.service_account import Credentials
+    # Tenta carregar dos secrets (Local ou Streamlit Cloud)
+    if "GOOGLE_SHEETS_CREDS" in st.secrets:
+        creds_json = json.loads(st.secrets["GOOGLE_SHEETS_CREDS"])
+    else:
+        # Fallback para arquivo local (se estiver rodando na máquina)
+        with open("credentials.json") as f:
+            creds_json = json.load(f)
+            
+    creds = Credentials.from_service_account_info(creds_json, scopes=['https://www.googleapis.com/auth/spreadsheets'])
+    client = gspread.authorize(creds)
+    ID_PLANILHA = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8" # Seu ID
+    return client.open_by_key(ID_PLANILHA)
+
+@st.cache_data(ttl=TTL_SINAIS)
+def ler_sinais():
+    """Lê as células-sinal de todas as abas numa única chamada (vazio se falhar)."""
     try:
-        # Tenta carregar dos secrets (Local ou Streamlit Cloud)
-        if "GOOGLE_SHEETS_CREDS" in st.secrets:
-            creds_json = json.loads(st.secrets["GOOGLE_SHEETS_CREDS"])
+        resp = abrir_planilha().values_batch_get(list(SINAIS.values()))
+    except Exception:
+        return {}
+    sinais = {}
+    for chave, faixa in zip(SINAIS, resp.get('valueRanges', [])):
+        valores = faixa.get('values') or [[""]]
+        sinais[chave] = str(valores[0][0]) if valores[0] else ""
+    return sinais
+
+@st.cache_resource
+def _cache_abas():
+    # Compartilhado entre todos os usuários do app: {chave: {"versao", "df", "tempos"}}
+    return {"abas": {}, "lock": threading.Lock(), "sem_snapshot": set()}
+
+def _sinal_no_df(chave, df):
+    """Valor da célula-sinal de 'chave' (ex: 'market_data'!C2) dentro do DataFrame da aba."""
+    ref = SINAIS[chave].split('!')[-1]
+    letras = ref.rstrip('0123456789')
+    coluna = 0
+    for letra in letras: coluna = coluna * 26 + ord(letra.upper()) - 64
+    try:
+        # Linha 1 da planilha é o cabeçalho do DataFrame
+        return str(df.iat[int(ref[len(letras):]) - 2, coluna - 1])
+    except (IndexError, ValueError):
+        return ""
+
+def _idade_snapshot(chave):
+    """Segundos desde a publicação do snapshot mais recente da aba (infinito se não der para saber)."""
+    try:
+        publicado = datetime.datetime.strptime(versao_snapshot(ABAS[chave]) or "", '%Y%m%dT%H%M%S%f')
+    except ValueError:
+        return float('inf')
+    return time.time() - publicado.timestamp()
+
+def _versoes_atuais():
+    # Sinal do Sheets sempre que houver (uma chamada a cada TTL_SINAIS para todas as abas),
+    # mais a janela de TTL_ABAS como teto; sem resposta do Sheets, vale o snapshot local
+    sinais = ler_sinais()
+    janela = int(time.time() // TTL_ABAS)
+    versoes = {}
+    for k in ABAS:
+        if sinais.get(k):
+            versoes[k] = f"{sinais[k]}|{janela}"
+        elif k in ABAS_SNAPSHOT and not sinais and versao_snapshot(ABAS[k]):
+            versoes[k] = f"snapshot-{versao_snapshot(ABAS[k])}"
         else:
-            # Fallback para arquivo local (se estiver rodando na máquina)
-            with open("credentials.json") as f:
-                creds_json = json.load(f)
-                
-        creds = Credentials.from_service_account_info(creds_json, scopes=['https://www.googleapis.com/auth/spreadsheets'])
-        client = gspread.authorize(creds)
-        ID_PLANILHA = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8" # Seu ID
-        sh = client.open_by_key(ID_PLANILHA)
-        
-        return {
-            "assets": pd.DataFrame(sh.worksheet("assets").get_all_records()),
-            "trans": pd.DataFrame(sh.worksheet("transactions").get_all_records()),
-            "market": pd.DataFrame(sh.worksheet("market_data").get_all_records()),
-            "calendar": pd.DataFrame(sh.worksheet("dividend_calendar").get_all_records()),
-            "history": pd.DataFrame(sh.worksheet("dividend_history").get_all_records())
-        }
+            versoes[k] = f"ttl-{janela}"
+    return versoes
+
+def invalidar_aba(chave):
+    """Descarta a aba do cache e força a próxima leitura no Sheets (sem passar pelo snapshot)."""
+    ler_sinais.clear()
+    cache = _cache_abas()
+    with cache["lock"]:
+        cache["abas"].pop(chave, None)
+        cache["sem_snapshot"].add(chave)
+
+def load_data():
+    try:
+        versoes = _versoes_atuais()
+        cache = _cache_abas()
+        with cache["lock"]:
+            velhas = [k for k in ABAS if cache["abas"].get(k, {}).get("versao") != versoes[k]]
+            agora = datetime.datetime.now().strftime('%H:%M:%S')
+            for chave in list(velhas):
+                if chave in cache["sem_snapshot"]: continue
+                # Snapshot local na versão certa: leitura via memory-map, sem rede
+                t0 = time.perf_counter()
+                if chave in ABAS_SNAPSHOT:
+                    df = ler_snapshot(ABAS[chave])
+                    sinal = versoes[chave].rsplit("|", 1)[0]
+                    atual = df is not None and (versoes[chave].startswith("snapshot-") or
+                                                (_sinal_no_df(chave, df) == sinal and _idade_snapshot(chave) < TTL_ABAS))
+                else:
+                    df = ler_snapshot(ABAS[chave], versoes[chave]) if versao_snapshot(ABAS[chave]) == versoes[chave] else None
+                    atual = df is not None
+                if not atual: continue
+                velhas.remove(chave)
+                cache["abas"][chave] = {
+                    "versao": versoes[chave],
+                    "df": df,
+                    "tempos": {"etapa": ABAS[chave], "origem": "snapshot", "linhas": len(df),
+                               "fetch_ms": (time.perf_counter() - t0) * 1000, "parse_ms": 0.0, "carregada_em": agora},
+                }
+        if velhas:
+            # Só as abas desatualizadas, todas numa única chamada à API e fora da trava:
+            # as outras sessões seguem servindo o cache enquanto a rede responde
+            t0 = time.perf_counter()
+            resp = abrir_planilha().values_batch_get([ABAS[k] for k in velhas])
+            t_fetch = (time.perf_counter() - t0) * 1000
+            lidas = {}
+            for chave, faixa in zip(velhas, resp.get('valueRanges', [])):
+                t0 = time.perf_counter()
+                df = valores_para_df(faixa.get('values', []))
+                lidas[chave] = {
+                    "versao": versoes[chave],
+                    "df": df,
+                    "tempos": {"etapa": ABAS[chave], "origem": "sheets", "linhas": len(df), "fetch_ms": t_fetch,
+                               "parse_ms": (time.perf_counter() - t0) * 1000, "carregada_em": agora},
+                }
+                # Abas dos scripts: snapshot com versão própria (vale enquanto o sinal bater)
+                publicar_snapshot(ABAS[chave], df, versao=None if chave in ABAS_SNAPSHOT else versoes[chave])
+            with cache["lock"]:
+                cache["abas"].update(lidas)
+                cache["sem_snapshot"].difference_update(lidas)
+        with cache["lock"]:
+            # Cópias: main() altera os DataFrames e o cache é compartilhado
+            data = {k: cache["abas"][k]["df"].copy() for k in ABAS}
+            data["tempos"] = pd.DataFrame([cache["abas"][k]["tempos"] for k in ABAS])
+            data["versoes"] = {k: cache["abas"][k]["versao"] for k in ABAS}
+        return data
     except Exception as e:
         st.error(f"Erro de Conexão: {e}")
         return None
 
-def render_cash_flow(df_tr, df_hist):
-    st.subheader("💰 Fluxo de Caixa (Entradas vs Saídas)")
-    
-    # 1. Processar Movimentações (Aportes e Retiradas)
-    df_flow = df_tr.copy()
-    df_flow['date'] = pd.to_datetime(df_flow['date'], dayfirst=True, errors='coerce')
-    
-    # Calcular valor financeiro da transação
-    # COMPRA = Saída de caixa (Negativo)
-    # VENDA = Entrada de caixa (Positivo)
-    def get_flow(row):
-        val = row['quantity'] * row['price']
-        if str(row['type']).upper() == 'COMPRA': return -val
-        if str(row['type']).upper() == 'VENDA': return val
-        return 0.0
-
-    df_flow['fluxo'] = df_flow.apply(get_flow, axis=1)
-    df_flow['mes'] = df_flow['date'].dt.to_period('M')
-    
-    # Agrupar Aportes por Mês
-    aportes = df_flow.groupby('mes')['fluxo'].sum()
+# Cache por versão dos dados: trocar de página ou de resolução não recalcula nada.
+# Parâmetros com "_" não entram no hash do Streamlit (a versão já identifica os dados).
+@st.cache_data(max_entries=2)
+def _eventos_caixa(versao, _df_tr, _df_hist, _taxas, _historico):
+    return eventos_caixa(_df_tr, _df_hist, _taxas, _historico)
 
-    # 2. Processar Dividendos (Entradas)
-    df_divs = df_hist.copy()
-    # Limpar nomes das colunas (remover espaços extras e minúsculas)
-    df_divs.columns = [c.lower().strip() for c in df_divs.columns]
-    
-    # Usar 'data ex' como referência de recebimento aproximado (ou data pagamento se tiver)
-    df_divs['data'] = pd.to_datetime(df_divs['data ex'], dayfirst=True, errors='coerce')
-    df_divs['total recebido'] = df_divs['total recebido'].apply(clean_num)
-    df_divs['mes'] = df_divs['data'].dt.to_period('M')
-    
-    proventos = df_divs.groupby('mes')['total recebido'].sum()
+@st.cache_data(max_entries=8)
+def _timeline_caixa(versao, freq, _df_tr, _df_hist, _taxas, _historico):
+    return linha_do_tempo(_eventos_caixa(versao, _df_tr, _df_hist, _taxas, _historico), freq)
 
-    # 3. Consolidar
-    timeline = pd.DataFrame({'Movimentação': aportes, 'Proventos': proventos}).fillna(0)
-    timeline['Liquido'] = timeline['Movimentação'] + timeline['Proventos']
-    timeline.index = timeline.index.astype(str)
+# Câmbio diário (XXXBRL=X) do histórico de preços, usado por custo, fluxo de caixa e patrimônio
+@st.cache_data(max_entries=1)
+def _historico_cambio(versao_hist):
+    return historico_taxas(ler_precos()) if versao_hist else None
 
-    # 4. Gráfico
+def render_cash_flow(df_tr, df_hist, versao, taxas, historico):
+    st.subheader("💰 Fluxo de Caixa (Entradas vs Saídas)")
+    resolucao = st.radio("Resolução", list(RESOLUCOES), index=1, horizontal=True)
+    
+    # 1. Movimentações (COMPRA = saída, VENDA = entrada) + 2. Dividendos + 3. Consolidação
+    timeline = _timeline_caixa(versao, RESOLUCOES[resolucao], df_tr, df_hist, taxas, historico)
+
+    # 4. Gráfico (plotly só carrega nas páginas com gráfico)
+    import plotly.graph_objects as go
     fig = go.Figure()
     fig.add_trace(go.Bar(x=timeline.index, y=timeline['Movimentação'], name='Aportes/Vendas', marker_color='indianred'))
     fig.add_trace(go.Bar(x=timeline.index, y=timeline['Proventos'], name='Dividendos', marker_color='mediumseagreen'))
@@ -99,6 +222,41 @@ def render_cash_flow(df_tr, df_hist):
     k2.metric("Total Dividendos Recebidos", f"R$ {timeline['Proventos'].sum():,.2f}")
     k3.metric("Fluxo Acumulado", f"R$ {timeline['Liquido'].sum():,.2f}")
 
+# Curva de patrimônio: recalculada só quando muda o histórico de preços, as transações ou o cadastro
+@st.cache_data(max_entries=2)
+def _curva_patrimonio(versao, taxas, _df_tr, _moedas):
+    precos = matriz_precos(ler_precos())
+    return curva_patrimonio(_df_tr, precos, _moedas, taxas)
+
+def render_patrimonio(df_tr, df_as, taxas, versoes, versao_hist):
+    st.title("📈 Evolução do Patrimônio")
+    if versao_hist is None:
+        st.info("Histórico de preços vazio. Rode `python -m sgp run prices --backfill AAAA-MM-DD` na máquina do app para preencher o passado.")
+        return
+
+    moedas = dict(zip(df_as['ticker'].astype(str).str.strip(), df_as['currency'].astype(str))) if 'currency' in df_as.columns else {}
+    curva = _curva_patrimonio((versao_hist, versoes["trans"], versoes["assets"]), taxas, df_tr, moedas)
+    curva = curva[curva['patrimonio'] > 0]
+    if curva.empty:
+        st.info("Nenhuma posição com preço no período do histórico.")
+        return
+
+    k1, k2, k3 = st.columns(3)
+    k1.metric("Patrimônio (último dia)", f"R$ {curva['patrimonio'].iloc[-1]:,.2f}")
+    k2.metric("Aportes Líquidos no Período", f"R$ {curva['aporte'].sum():,.2f}")
+    k3.metric("Retorno Acumulado (TWR)", f"{curva['retorno_acum'].iloc[-1] * 100:,.2f}%")
+
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=curva.index, y=curva['patrimonio'], name='Patrimônio', mode='lines', line=dict(color='royalblue')))
+    fig.update_layout(title="Patrimônio Diário (BRL)", height=400)
+    st.plotly_chart(fig, use_container_width=True)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=curva.index, y=curva['retorno_acum'] * 100, name='Retorno Acumulado', mode='lines', line=dict(color='seagreen')))
+    fig.update_layout(title="Retorno Acumulado Ponderado no Tempo (%)", height=400)
+    st.plotly_chart(fig, use_container_width=True)
+
 def main():
     data = load_data()
     if not data: return
@@ -110,61 +268,58 @@ def main():
     df_cl = data["calendar"]; df_cl.columns = [c.lower().strip() for c in df_cl.columns]
     df_hi = data["history"]; 
     
-    # Processamento Numérico
-    df_tr['quantity'] = df_tr['quantity'].apply(clean_num)
-    df_tr['price'] = df_tr['price'].apply(clean_num)
-    df_mk['close_price'] = df_mk['close_price'].apply(clean_num)
+    # Processamento Numérico (vetorizado)
+    df_tr['quantity'] = numeros_ptbr(df_tr['quantity'])
+    df_tr['price'] = numeros_ptbr(df_tr['price'])
+    df_mk['close_price'] = numeros_ptbr(df_mk['close_price'])
     
-    # Taxa USD (Fallback seguro)
+    # Câmbio: spot da market_data (fallback seguro) + histórico diário para datas passadas
     try:
-        usd_val = df_mk.loc[df_mk['ticker'] == 'USDBRL=X', 'close_price'].values[0]
+        taxas = taxas_spot(df_mk)
     except:
-        usd_val = 5.00
+        taxas = dict(TAXAS_PADRAO)
+    usd_val = taxas.get('USD', TAXAS_PADRAO['USD'])
+    versao_hist = versao_precos()
+    historico_fx = _historico_cambio(versao_hist)
 
     # --- MENU LATERAL ---
     st.sidebar.title("SGP 📈")
-    page = st.sidebar.radio("Navegação", ["Carteira Atual", "Fluxo de Caixa", "Agenda Dividendos"])
+    # O histórico de preços só existe onde o update_market_data grava (ver historico_precos.py):
+    # sem ele, a página Evolução nem aparece
+    paginas = ["Carteira Atual", "Evolução", "Fluxo de Caixa", "Agenda Dividendos"]
+    if versao_hist is None:
+        paginas.remove("Evolução")
+    page = st.sidebar.radio("Navegação", paginas)
+    if versao_hist is None:
+        st.sidebar.caption("Evolução do patrimônio indisponível: histórico de preços local vazio (SGP_PRECOS).")
+
+    if st.sidebar.button("🔄 Atualizar só preços"):
+        invalidar_aba("market")
+        st.rerun()
+
+    with st.sidebar.expander("🛠️ Debug: carga de dados"):
+        st.caption("fetch_ms é o tempo da chamada em lote (sheets) ou da leitura do arquivo (snapshot)")
+        st.dataframe(data["tempos"], use_container_width=True, hide_index=True)
 
     if page == "Carteira Atual":
         st.title("🚀 Performance da Carteira")
         
-        # Lógica de Posição Atual (Saldo acumulado)
-        df_tr['custo_total'] = df_tr.apply(lambda r: r['quantity'] * r['price'] * (usd_val if str(r.get('currency','')).upper() == 'USD' else 1.0), axis=1)
-        
-        # Ajuste para VENDA diminuir quantidade
-        def get_qty_signed(row):
-            return row['quantity'] if str(row['type']).upper() != 'VENDA' else -row['quantity']
-            
-        def get_cost_signed(row):
-            # Para custo médio simples, venda reduz custo proporcionalmente (simplificação)
-            val = row['quantity'] * row['price'] * (usd_val if str(r.get('currency','')).upper() == 'USD' else 1.0)
-            return val if str(row['type']).upper() != 'VENDA' else -val
-
-        df_tr['qtd_ajustada'] = df_tr.apply(get_qty_signed, axis=1)
-        # Nota: Cálculo de custo médio fiscal é complexo. Aqui usamos custo histórico simples.
-        
-        resumo = df_tr.groupby('ticker').agg({'qtd_ajustada': 'sum'}).reset_index()
-        resumo = resumo[resumo['qtd_ajustada'] > 0] # Apenas carteira atual
-        
-        # Merge com Cotações
-        resumo = resumo.merge(df_mk[['ticker', 'close_price']], on='ticker', how='left')
-        # Merge com Cadastro (para saber moeda e tipo)
-        resumo = resumo.merge(df_as[['ticker', 'type', 'currency']], on='ticker', how='left')
-        
-        # Valor Atual
-        resumo['valor_atual_brl'] = resumo.apply(
-            lambda r: (r['qtd_ajustada'] * r['close_price']) * (usd_val if str(r.get('currency')).upper() == 'USD' else 1.0), axis=1
-        )
+        # Lógica de Posição Atual (Saldo acumulado), câmbio e valor atual
+        resumo = avaliar_carteira(df_tr, df_mk, df_as, taxas, historico_fx)
         
         # Exibição
         c1, c2 = st.columns(2)
         c1.metric("Patrimônio Bruto", f"R$ {resumo['valor_atual_brl'].sum():,.2f}")
         c2.metric("Dólar PTAX", f"R$ {usd_val:.2f}")
         
-        st.dataframe(resumo[['ticker', 'qtd_ajustada', 'close_price', 'valor_atual_brl']].sort_values('valor_atual_brl', ascending=False), use_container_width=True)
+        st.dataframe(resumo[['ticker', 'qtd_ajustada', 'preco_medio', 'close_price', 'valor_atual_brl']].sort_values('valor_atual_brl', ascending=False), use_container_width=True)
+
+    elif page == "Evolução":
+        render_patrimonio(df_tr, df_as, taxas, data["versoes"], versao_hist)
 
     elif page == "Fluxo de Caixa":
-        render_cash_flow(df_tr, df_hi)
+        versao = (data["versoes"]["trans"], data["versoes"]["history"], data["versoes"]["market"], versao_hist)
+        render_cash_flow(df_tr, df_hi, versao, taxas, historico_fx)
 
     elif page == "Agenda Dividendos":
         st.title("📅 Próximos Dividendos")
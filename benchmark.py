@@ -0,0 +1,1815 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from posicoes import construir_posicoes, quantidades_nas_datas, TIPOS_ENTRADA, TIPOS_SAIDA
+
+# --- RESULTADOS (COMPARAÇÃO ENTRE COMMITS) ---
+# Cada benchmark registra os tempos do caminho atual; python benchmark.py grava
+# tudo em BENCH_DIR/<commit>.json e compara com a execução anterior gravada.
+# Uso: python benchmark.py [nomes...] [--comparar COMMIT] [--estrito] [--nao-salvar]
+BENCH_DIR = os.environ.get("SGP_BENCH", os.path.join("cache", "benchmark"))
+TOLERANCIA = 1.25  # mais lento que isso vs. a referência: marcado como regressão
+RESULTADOS = {}
+
+def registrar(bench, **tempos):
+    for metrica, segundos in tempos.items():
+        RESULTADOS[f"{bench}.{metrica}"] = round(float(segundos), 6)
+
+# --- BENCHMARK: MOTOR DE POSIÇÃO ---
+# Gera um livro de transações sintético e compara o motor vetorizado com a
+# abordagem antiga (filtrar + iterrows a cada provento).
+
+def gerar_transacoes(n=100_000, n_tickers=150, anos=10, seed=42):
+    rng = np.random.default_rng(seed)
+    tickers = [f"TCK{i:03d}3" for i in range(n_tickers)]
+    inicio = pd.Timestamp('2015-01-01')
+    tipos = TIPOS_ENTRADA + TIPOS_SAIDA
+    # Compras dominam para que a carteira não fique zerada
+    pesos = np.array([8, 1, 1, 2, 1, 3, 1, 1, 1], dtype=float)
+    return pd.DataFrame({
+        'ticker': rng.choice(tickers, n),
+        'date': inicio + pd.to_timedelta(rng.integers(0, anos * 365, n), unit='D'),
+        'type': rng.choice(tipos, n, p=pesos / pesos.sum()),
+        'quantity': rng.integers(1, 500, n).astype(float),
+    })
+
+def gerar_datas_com(n_por_ticker=40, anos=10, seed=7):
+    rng = np.random.default_rng(seed)
+    inicio = pd.Timestamp('2015-01-01')
+    return pd.DatetimeIndex(sorted(inicio + pd.to_timedelta(rng.integers(0, anos * 365, n_por_ticker), unit='D')))
+
+def _posicao_iterrows(df, ticker, data_corte):
+    # Implementação antiga, mantida aqui apenas como referência de resultado
+    transacoes = df[(df['ticker'] == ticker) & (df['date'] <= data_corte)]
+    qtd = 0.0
+    for _, row in transacoes.iterrows():
+        t = str(row['type']).upper()
+        if t in TIPOS_ENTRADA: qtd += float(row['quantity'])
+        elif t in TIPOS_SAIDA: qtd -= float(row['quantity'])
+    return max(0.0, qtd)
+
+def bench_posicoes(n=100_000, tickers_referencia=5):
+    df = gerar_transacoes(n)
+    datas = gerar_datas_com()
+    tickers = df['ticker'].unique()
+
+    t0 = time.perf_counter()
+    posicoes = construir_posicoes(df)
+    t_build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    resultado = {t: quantidades_nas_datas(posicoes, t, datas) for t in tickers}
+    t_query = time.perf_counter() - t0
+
+    # Referência (amostra de tickers, o loop antigo é lento demais para todos)
+    amostra = tickers[:tickers_referencia]
+    t0 = time.perf_counter()
+    for t in amostra:
+        esperado = [_posicao_iterrows(df, t, d) for d in datas]
+        if not np.allclose(resultado[t], esperado):
+            raise AssertionError(f"Divergência de posição em {t}")
+    t_antigo = (time.perf_counter() - t0) / len(amostra) * len(tickers)
+
+    registrar('posicoes', montagem=t_build, consultas=t_query)
+    print(f"--- ⏱️ Posições ({n:,} transações, {len(tickers)} ativos, {len(datas)} datas-com cada) ---")
+    print(f"   Montagem do motor: {t_build * 1000:8.1f} ms")
+    print(f"   Consultas:         {t_query * 1000:8.1f} ms")
+    print(f"   iterrows (estim.): {t_antigo * 1000:8.1f} ms")
+    print(f"   ✅ Resultados idênticos à implementação antiga ({len(amostra)} ativos conferidos)")
+
+# --- BENCHMARK: LIVRO DE POSIÇÕES (CUSTO MÉDIO + EVENTOS CORPORATIVOS) ---
+def _custo_medio_loop(df):
+    # Referência: percorre as transações do ticker em ordem, linha a linha
+    q = c = r = 0.0
+    for _, row in df.sort_values('date', kind='mergesort').iterrows():
+        d = row['quantity']
+        if row['type'] in ('COMPRA', 'BUY', 'ENTRADA', 'BONIFICACAO'):
+            q += d; c += d * row['price']
+        elif row['type'] == 'DESDOBRAMENTO':
+            q += d
+        elif row['type'] == 'AGRUPAMENTO':
+            q -= d
+        else:
+            medio = c / q if q > 0 else 0.0
+            c -= medio * d
+            if row['type'] in ('VENDA', 'SELL'): r += d * (row['price'] - medio)
+            q -= d
+        if q <= 1e-9: c = 0.0
+    return q, c, r
+
+def bench_livro(n=100_000, tickers_referencia=5):
+    from posicoes import Livro
+
+    rng = np.random.default_rng(21)
+    df = gerar_transacoes(n)
+    df['price'] = np.round(rng.random(n) * 100, 2)
+    t0 = time.perf_counter()
+    livro = Livro(df)
+    foto = livro.fotografia()
+    t_foto = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    fotos = [livro.fotografia(d) for d in pd.date_range('2016-01-01', periods=10, freq='YS')]
+    t_asof = (time.perf_counter() - t0) / len(fotos)
+    for t in foto['ticker'][:tickers_referencia]:
+        q, c, r = _custo_medio_loop(df[df['ticker'] == t])
+        linha = foto[foto['ticker'] == t].iloc[0]
+        if not np.allclose([max(q, 0), c, r], [linha['quantidade'], linha['custo_total'], linha['realizado']]):
+            raise AssertionError(f"Custo médio divergente em {t}")
+
+    # Desdobramento, troca de ticker (BTOW3 -> AMER3), grupamento, bonificação e venda
+    eventos = pd.DataFrame([
+        ['BTOW3', '02/01/2020', 'COMPRA', '100', '10,00'],
+        ['BTOW3', '01/06/2020', 'DESDOBRAMENTO', '100', '0'],
+        ['AMER3', '04/01/2021', 'COMPRA', '50', '6,00'],
+        ['AMER3', '01/06/2021', 'AGRUPAMENTO', '125', '0'],
+        ['AMER3', '03/01/2022', 'BONIFICACAO', '5', '0'],
+        ['AMER3', '01/06/2022', 'VENDA', '30', '12,00'],
+    ], columns=['ticker', 'date', 'type', 'quantity', 'price'])
+    caso = Livro(eventos)
+    final = caso.estado('BTOW3', '2023-01-01')
+    meio = caso.estado('AMER3', '2020-12-31')
+    matriz = caso.matriz(pd.to_datetime(['2020-12-31', '2022-12-31']), ['BTOW3', 'AMER3'])
+    if not (np.allclose([final[k] for k in ('quantidade', 'custo_total', 'preco_medio', 'realizado')], [100, 1000, 10, 60])
+            and np.allclose([meio['quantidade'], meio['preco_medio']], [200, 5])
+            and matriz['AMER3'].tolist() == [200, 100] and matriz['BTOW3'].tolist() == [0, 0]):
+        raise AssertionError(f"Eventos corporativos/renomeação: {final} | {meio} | {matriz.values.tolist()}")
+
+    registrar('livro', fotografia=t_foto, as_of=t_asof)
+    print(f"--- ⏱️ Livro de posições ({n:,} transações, {len(foto)} ativos) ---")
+    print(f"   replay + fotografia atual (custo médio): {t_foto * 1000:8.1f} ms")
+    print(f"   fotografia numa data passada:            {t_asof * 1000:8.1f} ms")
+    print(f"   ✅ Custo médio igual ao loop linha a linha; desdobramento, grupamento, bonificação e troca de ticker conferidos")
+
+# --- BENCHMARK: AVALIAÇÃO DA CARTEIRA (CAMINHO DE RENDER DO APP) ---
+def gerar_cadastro(tickers, frac_usd=0.1, seed=11):
+    rng = np.random.default_rng(seed)
+    usd = rng.random(len(tickers)) < frac_usd
+    return pd.DataFrame({
+        'ticker': tickers,
+        'type': np.where(usd, 'ETF_US', 'ACAO_BR'),
+        'currency': np.where(usd, 'USD', 'BRL'),
+    })
+
+def _ptbr(valores):
+    # Números como chegam do Sheets em PT-BR: "1.234,56"
+    return pd.Series(valores).map(lambda x: f"{x:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'))
+
+def _avaliacao_apply(df_tr, df_mk, df_as, usd_val, clean_num):
+    # Caminho antigo do app (apply por célula/linha), mantido como referência
+    df_tr = df_tr.copy(); df_mk = df_mk.copy()
+    df_tr['quantity'] = df_tr['quantity'].apply(clean_num)
+    df_tr['price'] = df_tr['price'].apply(clean_num)
+    df_mk['close_price'] = df_mk['close_price'].apply(clean_num)
+    df_tr['custo_total'] = df_tr.apply(lambda r: r['quantity'] * r['price'] * (usd_val if str(r.get('currency','')).upper() == 'USD' else 1.0), axis=1)
+    df_tr['qtd_ajustada'] = df_tr.apply(lambda r: r['quantity'] if str(r['type']).upper() != 'VENDA' else -r['quantity'], axis=1)
+    resumo = df_tr.groupby('ticker').agg({'qtd_ajustada': 'sum'}).reset_index()
+    resumo = resumo[resumo['qtd_ajustada'] > 0]
+    resumo = resumo.merge(df_mk[['ticker', 'close_price']], on='ticker', how='left')
+    resumo = resumo.merge(df_as[['ticker', 'type', 'currency']], on='ticker', how='left')
+    resumo['valor_atual_brl'] = resumo.apply(lambda r: (r['qtd_ajustada'] * r['close_price']) * (usd_val if str(r.get('currency')).upper() == 'USD' else 1.0), axis=1)
+    return resumo
+
+def bench_carteira(n=200_000):
+    from carteira import numeros_ptbr, avaliar_carteira
+
+    def clean_num(val):
+        if val is None or val == "" or val == "-": return 0.0
+        s = str(val).strip()
+        if "," in s: s = s.replace(".", "").replace(",", ".")
+        try: return float(s)
+        except: return 0.0
+
+    rng = np.random.default_rng(5)
+    df_tr = gerar_transacoes(n)
+    df_tr['type'] = np.where(rng.random(n) < 0.2, 'VENDA', 'COMPRA')
+    df_tr['quantity'] = _ptbr(df_tr['quantity'])
+    df_tr['price'] = _ptbr(rng.random(n) * 2000)
+    tickers = sorted(df_tr['ticker'].unique())
+    df_as = gerar_cadastro(tickers)
+    df_mk = pd.DataFrame({'ticker': tickers + ['USDBRL=X'], 'close_price': _ptbr(np.append(rng.random(len(tickers)) * 100, 5.4))})
+
+    t0 = time.perf_counter()
+    antigo = _avaliacao_apply(df_tr, df_mk, df_as, 5.4, clean_num)
+    t_antigo = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    tr, mk = df_tr.copy(), df_mk.copy()
+    tr['quantity'] = numeros_ptbr(tr['quantity'])
+    tr['price'] = numeros_ptbr(tr['price'])
+    mk['close_price'] = numeros_ptbr(mk['close_price'])
+    novo = avaliar_carteira(tr, mk, df_as, {'USD': 5.4})
+    t_novo = time.perf_counter() - t0
+
+    # O resumo ganhou custo médio; as colunas antigas continuam idênticas
+    pd.testing.assert_frame_equal(antigo.reset_index(drop=True), novo[antigo.columns].reset_index(drop=True))
+    registrar('carteira', vetorizado=t_novo)
+    print(f"--- ⏱️ Avaliação da carteira ({n:,} transações) ---")
+    print(f"   apply por linha: {t_antigo * 1000:8.1f} ms")
+    print(f"   vetorizado:      {t_novo * 1000:8.1f} ms")
+    print(f"   ✅ Resumo idêntico ao caminho antigo")
+
+# --- BENCHMARK: FLUXO DE CAIXA ---
+def _fluxo_apply(df_tr, df_hist, clean_num):
+    # Caminho antigo do render_cash_flow (apply por linha + parse de datas a cada render)
+    df_flow = df_tr.copy()
+    df_flow['date'] = pd.to_datetime(df_flow['date'], dayfirst=True, errors='coerce')
+    def get_flow(row):
+        val = row['quantity'] * row['price']
+        if str(row['type']).upper() == 'COMPRA': return -val
+        if str(row['type']).upper() == 'VENDA': return val
+        return 0.0
+    df_flow['fluxo'] = df_flow.apply(get_flow, axis=1)
+    aportes = df_flow.groupby(df_flow['date'].dt.to_period('M'))['fluxo'].sum()
+    df_divs = df_hist.copy()
+    df_divs.columns = [c.lower().strip() for c in df_divs.columns]
+    df_divs['data'] = pd.to_datetime(df_divs['data ex'], dayfirst=True, errors='coerce')
+    df_divs['total recebido'] = df_divs['total recebido'].apply(clean_num)
+    proventos = df_divs.groupby(df_divs['data'].dt.to_period('M'))['total recebido'].sum()
+    timeline = pd.DataFrame({'Movimentação': aportes, 'Proventos': proventos}).fillna(0)
+    timeline['Liquido'] = timeline['Movimentação'] + timeline['Proventos']
+    timeline.index = timeline.index.astype(str)
+    return timeline
+
+def gerar_proventos(tickers, n_divs, rng, anos=10):
+    # dividend_history como chega do Sheets (datas e valores em PT-BR)
+    return pd.DataFrame({
+        'Ticker': rng.choice(tickers, n_divs),
+        'Data Ex': (pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, anos * 365, n_divs), unit='D')).strftime('%d/%m/%Y'),
+        'Total Recebido': _ptbr(rng.random(n_divs) * 500),
+    })
+
+def bench_fluxo_caixa(n=200_000, n_divs=20_000):
+    from fluxo_caixa import eventos_caixa, linha_do_tempo, RESOLUCOES
+
+    def clean_num(val):
+        if val is None or val == "" or val == "-": return 0.0
+        s = str(val).strip()
+        if "," in s: s = s.replace(".", "").replace(",", ".")
+        try: return float(s)
+        except: return 0.0
+
+    rng = np.random.default_rng(9)
+    df_tr = gerar_transacoes(n)
+    df_tr['date'] = df_tr['date'].dt.strftime('%d/%m/%Y')
+    df_tr['price'] = rng.random(n) * 100
+    df_hist = gerar_proventos(df_tr['ticker'].unique(), n_divs, rng)
+
+    t0 = time.perf_counter()
+    antigo = _fluxo_apply(df_tr, df_hist, clean_num)
+    t_antigo = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    eventos = eventos_caixa(df_tr, df_hist)
+    t_eventos = time.perf_counter() - t0
+    tempos = {}
+    for nome, freq in RESOLUCOES.items():
+        t0 = time.perf_counter()
+        timeline = linha_do_tempo(eventos, freq)
+        tempos[nome] = time.perf_counter() - t0
+        if freq == "M":
+            pd.testing.assert_frame_equal(antigo, timeline, check_names=False)
+
+    registrar('fluxo_caixa', eventos=t_eventos, **{f"linha_{nome.lower()}": dt for nome, dt in tempos.items()})
+    print(f"--- ⏱️ Fluxo de caixa ({n:,} transações, {n_divs:,} proventos) ---")
+    print(f"   render antigo (mensal):    {t_antigo * 1000:8.1f} ms")
+    print(f"   eventos (parse único):     {t_eventos * 1000:8.1f} ms")
+    for nome, dt in tempos.items():
+        print(f"   linha do tempo {nome:11s} {dt * 1000:8.1f} ms")
+    print(f"   ✅ Linha do tempo mensal idêntica ao render antigo")
+
+# --- BENCHMARK: ESCALA (1k A 1M TRANSAÇÕES) ---
+TAMANHOS = (1_000, 10_000, 100_000, 1_000_000)
+
+def _rotulo(n):
+    return f"{n // 1_000_000}M" if n >= 1_000_000 else f"{n // 1_000}k"
+
+def bench_escala(tamanhos=TAMANHOS):
+    from carteira import numeros_ptbr, avaliar_carteira
+    from fluxo_caixa import eventos_caixa, linha_do_tempo
+
+    datas_com = gerar_datas_com()
+    print(f"--- ⏱️ Escala dos caminhos quentes ({', '.join(_rotulo(n) for n in tamanhos)} transações) ---")
+    print(f"   {'transações':>10s} {'posições':>10s} {'carteira':>10s} {'fluxo caixa':>12s}")
+    for n in tamanhos:
+        rng = np.random.default_rng(n)
+        # Livro como chega do Sheets: datas e números em PT-BR
+        df_tr = gerar_transacoes(n, n_tickers=min(300, max(20, n // 100)))
+        df_tr['price'] = rng.random(n) * 100
+        tickers = sorted(df_tr['ticker'].unique())
+        df_as = gerar_cadastro(tickers)
+        df_mk = pd.DataFrame({'ticker': tickers + ['USDBRL=X'], 'close_price': np.append(rng.random(len(tickers)) * 100, 5.4)})
+        df_hist = gerar_proventos(tickers, max(100, n // 10), rng)
+        df_sheets = df_tr.assign(date=df_tr['date'].dt.strftime('%d/%m/%Y'))
+
+        t0 = time.perf_counter()
+        posicoes = construir_posicoes(df_tr)
+        for t in tickers:
+            quantidades_nas_datas(posicoes, t, datas_com)
+        t_posicoes = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        tr = df_sheets.assign(quantity=numeros_ptbr(df_sheets['quantity']), price=numeros_ptbr(df_sheets['price']))
+        avaliar_carteira(tr, df_mk, df_as, {'USD': 5.4})
+        t_carteira = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        linha_do_tempo(eventos_caixa(df_sheets, df_hist), "M")
+        t_fluxo = time.perf_counter() - t0
+
+        registrar(f"escala_{_rotulo(n)}", posicoes=t_posicoes, carteira=t_carteira, fluxo_caixa=t_fluxo)
+        print(f"   {n:>10,} {t_posicoes * 1000:8.1f}ms {t_carteira * 1000:8.1f}ms {t_fluxo * 1000:10.1f}ms")
+    print(f"   ✅ Todos os tamanhos processados")
+
+# --- SERVIDOR HTTP LOCAL (STUB DA BRAPI) ---
+class _StubBrapi(BaseHTTPRequestHandler):
+    # {SYMBOL: [(lastDatePrior, rate), ...]}; símbolos ausentes devolvem 404
+    proventos = {}
+    latencia = 0.2
+    chamadas = []
+
+    def do_GET(self):
+        _StubBrapi.chamadas.append(time.monotonic())
+        time.sleep(self.latencia)
+        symbol = self.path.split('?')[0].rstrip('/').split('/')[-1].upper()
+        if symbol not in self.proventos:
+            self.send_response(404); self.end_headers()
+            return
+        cash = [{'lastDatePrior': f"{d}T00:00:00.000Z", 'rate': r} for d, r in self.proventos[symbol]]
+        corpo = json.dumps({'results': [{'symbol': symbol, 'dividendsData': {'cashDividends': cash}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args): pass
+
+def iniciar_stub(handler):
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+def bench_dividendos_concorrente(n_tickers=24, workers=8):
+    import update_dividend_history as udh
+    from provedores import LIMITADORES
+    from simbolos import Resolvedor
+
+    df = gerar_transacoes(5_000, n_tickers=n_tickers)
+    tickers = list(df['ticker'].unique())
+    resolvedor = Resolvedor(pd.DataFrame({'ticker': tickers, 'type': 'ACAO_BR'}))
+    datas = gerar_datas_com(12)
+    # Metade dos ativos existe na BRAPI; a outra metade cai no Yahoo (simulado localmente)
+    _StubBrapi.proventos = {t: [(d.strftime('%Y-%m-%d'), 0.5 + i) for i, d in enumerate(datas)] for t in tickers[::2]}
+
+    def yahoo_falso(ticker, desde=None, resolvedor=None):
+        LIMITADORES["YAHOO"].aguardar()
+        time.sleep(_StubBrapi.latencia)
+        return pd.Series([0.25] * len(datas), index=datas)
+
+    servidor, url = iniciar_stub(_StubBrapi)
+    os.environ.setdefault("BRAPI_TOKEN", "stub")
+    udh.BRAPI_URL, yahoo_original = url, udh.get_dividends_yahoo
+    udh.get_dividends_yahoo = yahoo_falso
+    try:
+        posicoes = construir_posicoes(df)
+        alvos = [(t, t) for t in tickers]
+        saidas, tempos = {}, {}
+        for w in (1, workers):
+            _StubBrapi.chamadas = []
+            t0 = time.perf_counter()
+            resultados = udh.buscar_dividendos(tickers, workers=w, resolvedor=resolvedor)
+            tempos[w] = time.perf_counter() - t0
+            with contextlib.redirect_stdout(io.StringIO()):
+                saidas[w] = json.dumps(udh.montar_historico(df, posicoes, alvos, resultados)).encode()
+            # Em qualquer janela de 1s, no máximo 1/intervalo (+1 de folga) requisições
+            chamadas = np.sort(_StubBrapi.chamadas)
+            por_janela = np.searchsorted(chamadas, chamadas + 1.0) - np.arange(len(chamadas))
+            limite = int(1 / LIMITADORES["BRAPI"].intervalo) + LIMITADORES["BRAPI"].rajada
+            if len(chamadas) and por_janela.max() > limite:
+                raise AssertionError(f"Rate limit BRAPI violado: {por_janela.max()} req/s > {limite}")
+    finally:
+        udh.get_dividends_yahoo = yahoo_original
+        servidor.shutdown()
+
+    if saidas[1] != saidas[workers]:
+        raise AssertionError("Saída concorrente difere da sequencial")
+    registrar('dividendos', sequencial=tempos[1], concorrente=tempos[workers])
+    print(f"--- ⏱️ Dividendos via stub local ({len(tickers)} ativos, latência {_StubBrapi.latencia * 1000:.0f} ms) ---")
+    print(f"   Sequencial (1 worker): {tempos[1] * 1000:8.1f} ms")
+    print(f"   Concorrente ({workers} workers): {tempos[workers] * 1000:8.1f} ms")
+    print(f"   ✅ Saída byte a byte idêntica e intervalo mínimo da BRAPI respeitado")
+
+def bench_historico_incremental(n=50_000, n_tickers=150, n_divs=40):
+    import datetime
+    import update_dividend_history as udh
+    from historico_dividendos import EstadoHistorico
+
+    df = gerar_transacoes(n, n_tickers=n_tickers)
+    tickers = list(df['ticker'].unique())
+    alvos = [(t, t) for t in tickers]
+    datas = gerar_datas_com(n_divs)
+    resultados = {t: (pd.Series(0.1 + np.arange(len(datas)) * 0.01, index=datas), "BRAPI" if i % 3 else "YAHOO")
+                  for i, t in enumerate(tickers)}
+
+    def rodar(df, resultados, estado, completo):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            linhas, recalculados = udh.atualizar_historico(df, construir_posicoes(df), alvos, resultados, estado, completo)
+        return linhas, recalculados, time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as pasta:
+        estado = EstadoHistorico(os.path.join(pasta, 'incremental.sqlite'))
+        _, _, t_completo = rodar(df, resultados, estado, True)
+        _, parados, t_parado = rodar(df, resultados, estado, False)
+
+        # Semana seguinte: 3 tickers com transações novas/editadas e 2 com provento novo
+        df2 = df.copy()
+        df2.loc[df2.index[df2['ticker'] == tickers[0]][:1], 'quantity'] += 10
+        novas = pd.DataFrame({'ticker': tickers[1:3], 'date': pd.Timestamp('2024-06-03'), 'type': 'COMPRA', 'quantity': 100.0})
+        df2 = pd.concat([df2, novas], ignore_index=True)
+        resultados2 = dict(resultados)
+        for t in tickers[3:5]:
+            divs, fonte = resultados[t]
+            resultados2[t] = (pd.concat([divs, pd.Series([0.9], index=[pd.Timestamp('2025-03-10')])]), fonte)
+
+        incremental, recalculados, t_incremental = rodar(df2, resultados2, estado, False)
+        # Provedores sem resposta para um ticker (BRAPI e Yahoo fora): as linhas guardadas ficam
+        sem_resposta = dict(resultados2, **{tickers[5]: (None, "YAHOO")})
+        mantido, _, _ = rodar(df2, sem_resposta, estado, False)
+        estado.fechar()
+        # O --full de comparação roda "dias depois": as linhas não podem depender da data da execução
+        class _DiasDepois(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None): return datetime.datetime.now(tz) + datetime.timedelta(days=9)
+        datetime_original, udh.datetime = udh.datetime, _DiasDepois
+        try:
+            estado = EstadoHistorico(os.path.join(pasta, 'completo.sqlite'))
+            completo, _, _ = rodar(df2, resultados2, estado, True)
+            estado.fechar()
+        finally:
+            udh.datetime = datetime_original
+
+    if parados:
+        raise AssertionError(f"Sem mudanças, {len(parados)} tickers recalculados")
+    if sorted(recalculados) != sorted(tickers[:5]):
+        raise AssertionError(f"Recalculados inesperados: {recalculados}")
+    if incremental != completo:
+        raise AssertionError("Histórico incremental difere do recálculo completo")
+    if mantido != incremental:
+        raise AssertionError("Falha temporária dos provedores apagou linhas do histórico")
+    registrar('historico_incremental', completo=t_completo, sem_mudancas=t_parado, incremental=t_incremental)
+    print(f"--- ⏱️ dividend_history incremental ({n:,} transações, {len(tickers)} ativos, {n_divs} proventos cada) ---")
+    print(f"   Recálculo completo (--full):     {t_completo * 1000:8.1f} ms")
+    print(f"   Incremental sem mudanças:        {t_parado * 1000:8.1f} ms")
+    print(f"   Incremental (5 ativos mudaram):  {t_incremental * 1000:8.1f} ms")
+    print(f"   ✅ {len(completo):,} linhas idênticas ao recálculo completo de outro dia; só os ativos alterados recalculados; provedor sem resposta mantém as linhas")
+
+# --- CACHE DE PROVENTOS: CAUDA, TTL, DESPEJO, --refresh E --offline ---
+class _YahooFalso:
+    """Provedor de proventos com histórico fixo; conta as consultas e o 'desde' pedido."""
+    def __init__(self, historicos):
+        self.historicos = historicos  # {símbolo: série completa}
+        self.consultas = []
+
+    def __call__(self, simbolo, desde=None):
+        self.consultas.append((simbolo, desde))
+        serie = self.historicos.get(simbolo)
+        if serie is None: return None
+        return serie[serie.index >= desde] if desde is not None else serie.copy()
+
+def _envelhecer(cache, simbolo, dias):
+    # Recua a última consulta do símbolo no SQLite (simula execuções em dias anteriores)
+    from datetime import datetime, timedelta
+    quando = (datetime.now() - timedelta(days=dias)).isoformat(timespec='seconds')
+    with cache._conn:
+        cache._conn.execute("UPDATE consultas SET consultado_em = ? WHERE simbolo = ?", (quando, simbolo))
+
+def bench_cache_dividendos(n_tickers=40, n_divs=60):
+    import calcular_dividendos_historicos as cdh
+    from cache_dividendos import CacheDividendos
+
+    datas = pd.date_range('2015-01-15', periods=n_divs, freq='MS') + pd.Timedelta(days=14)
+    historicos = {f"TK{chr(65 + i // 26)}{chr(65 + i % 26)}3.SA": pd.Series(np.round(np.linspace(0.1, 1.0, n_divs) + i / 100, 4), index=datas)
+                  for i in range(n_tickers)}
+    yahoo = _YahooFalso(historicos)
+    simbolos = list(historicos)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        cache = CacheDividendos(os.path.join(pasta, "dividendos.sqlite"))
+
+        # 1ª execução: histórico completo de todos (miss); 2ª: tudo dentro do TTL
+        t0 = time.perf_counter()
+        for s in simbolos:
+            cache.obter("YAHOO", s, lambda desde, s=s: yahoo(s, desde))
+        t_miss = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for s in simbolos:
+            if not cache.obter("YAHOO", s, lambda desde, s=s: yahoo(s, desde)).equals(historicos[s]):
+                raise AssertionError(f"Série lida do cache difere da original em {s}")
+        t_hit = time.perf_counter() - t0
+        if len(yahoo.consultas) != n_tickers or any(d is not None for _, d in yahoo.consultas):
+            raise AssertionError("Miss deveria baixar o histórico completo uma vez por símbolo")
+
+        # TTL vencido: só a cauda (desde o último provento guardado) e a série nova mesclada
+        alvo = simbolos[0]
+        novo = pd.Series([2.5], index=[datas[-1] + pd.DateOffset(months=1)])
+        historicos[alvo] = pd.concat([historicos[alvo], novo])
+        _envelhecer(cache, alvo, 2)
+        yahoo.consultas.clear()
+        serie = cache.obter("YAHOO", alvo, lambda desde: yahoo(alvo, desde))
+        if yahoo.consultas != [(alvo, datas[-1])] or not serie.equals(historicos[alvo]):
+            raise AssertionError("TTL vencido deveria pedir só a cauda e mesclar o provento novo")
+        if not cache.ler("YAHOO", alvo)[0].equals(historicos[alvo]):
+            raise AssertionError("Cauda não gravada no cache")
+
+        # Despejo: só o símbolo sem consulta há mais de um ano sai do cache
+        velho = simbolos[1]
+        _envelhecer(cache, velho, 400)
+        if cache.despejar() != 1 or cache.ler("YAHOO", velho) != (None, None) or cache.ler("YAHOO", simbolos[2])[0] is None:
+            raise AssertionError("despejar() deveria remover apenas o símbolo antigo")
+
+        # calcular_dividendos_historicos ponta a ponta com o cache e o Yahoo falsos
+        transacoes = os.path.join(pasta, "transacoes.csv")
+        pd.DataFrame({
+            'date': ['2014-06-01', '2014-06-01', '2014-06-01'],
+            'ticker': ['TKAC3', 'TKAD3', 'TKAE3'],
+            'type': ['COMPRA'] * 3,
+            'quantity': ['100', '100', '100'],
+            'price': ['10,00'] * 3,
+            'total': ['1000,00'] * 3,
+        }).to_csv(transacoes, index=False)
+        # TKAE3 nunca foi consultado no Yahoo: offline usa a série da BRAPI (Data Com, +1 dia)
+        with cache._conn:
+            cache._conn.execute("DELETE FROM proventos WHERE simbolo = 'TKAE3.SA'")
+            cache._conn.execute("DELETE FROM consultas WHERE simbolo = 'TKAE3.SA'")
+        cache.gravar("BRAPI", "TKAE3", pd.Series(historicos["TKAE3.SA"].values, index=datas - pd.Timedelta(days=1)))
+        # Dividendo do TKAC3 corrigido na fonte: só --refresh enxerga a mudança
+        historicos["TKAC3.SA"] = historicos["TKAC3.SA"] * 2
+
+        def _rodar(**opcoes):
+            saida = os.path.join(pasta, "saida.csv")
+            if os.path.exists(saida): os.remove(saida)
+            with contextlib.redirect_stdout(io.StringIO()):
+                cdh.main(**opcoes)
+            return pd.read_csv(saida).groupby('Ticker')['Total Recebido'].sum()
+
+        originais = (cdh.ARQUIVO_TRANSACOES, cdh.ARQUIVO_SAIDA, cdh.CacheDividendos, cdh.dividendos_yahoo)
+        cdh.ARQUIVO_TRANSACOES, cdh.ARQUIVO_SAIDA = transacoes, os.path.join(pasta, "saida.csv")
+        cdh.CacheDividendos = lambda: cache
+        cdh.dividendos_yahoo = yahoo
+        try:
+            yahoo.consultas.clear()
+            t0 = time.perf_counter()
+            offline = _rodar(offline=True)
+            t_offline = time.perf_counter() - t0
+            if yahoo.consultas:
+                raise AssertionError("--offline consultou o provedor")
+            refresh = _rodar(refresh=True)
+            if [d for _, d in yahoo.consultas] != [None] * 3:
+                raise AssertionError("--refresh deveria baixar o histórico completo de cada ativo")
+        finally:
+            cdh.ARQUIVO_TRANSACOES, cdh.ARQUIVO_SAIDA, cdh.CacheDividendos, cdh.dividendos_yahoo = originais
+        cache._conn.close()
+
+    esperado = {t: historicos[f"{t}.SA"].sum() * 100 for t in ('TKAC3', 'TKAD3', 'TKAE3')}
+    if set(offline.index) != set(esperado) or not np.isclose(offline['TKAC3'], esperado['TKAC3'] / 2) \
+            or not np.isclose(offline['TKAE3'], esperado['TKAE3']):
+        raise AssertionError("--offline deveria usar o cache (e a BRAPI onde o Yahoo nunca foi consultado)")
+    if not all(np.isclose(refresh[t], v) for t, v in esperado.items()):
+        raise AssertionError("--refresh não substituiu as séries do cache")
+    registrar('cache_dividendos', miss=t_miss, hit=t_hit, offline=t_offline)
+    print(f"--- ⏱️ Cache de proventos ({n_tickers} ativos, {n_divs} proventos cada) ---")
+    print(f"   1ª execução (histórico completo): {t_miss * 1000:8.1f} ms")
+    print(f"   2ª execução (dentro do TTL):      {t_hit * 1000:8.1f} ms")
+    print(f"   Cálculo --offline (3 ativos):     {t_offline * 1000:8.1f} ms")
+    print(f"   ✅ Cauda mesclada, despejo, --refresh e --offline conferidos")
+
+# --- CVM: ZIP SINTÉTICO SERVIDO COM ETAG ---
+def gerar_zip_cvm(caminho, n_fundos=20_000, dias=20, seed=3):
+    rng = np.random.default_rng(seed)
+    cnpjs_fmt = pd.Series([f"{i:014d}" for i in range(n_fundos)]).str.replace(
+        r'(\d{2})(\d{3})(\d{3})(\d{4})(\d{2})', r'\1.\2.\3/\4-\5', regex=True).values
+    datas = pd.date_range('2026-01-01', periods=dias, freq='B').strftime('%Y-%m-%d')
+    df = pd.DataFrame({
+        'TP_FUNDO_CLASSE': 'FI',
+        'CNPJ_FUNDO_CLASSE': np.repeat(cnpjs_fmt, dias),
+        'ID_SUBCLASSE': '',
+        'DT_COMPTC': np.tile(datas, n_fundos),
+        'VL_TOTAL': rng.random(n_fundos * dias) * 1e8,
+        'VL_QUOTA': np.round(rng.random(n_fundos * dias) * 10, 9),
+        'VL_PATRIM_LIQ': rng.random(n_fundos * dias) * 1e8,
+        'CAPTC_DIA': 0.0, 'RESG_DIA': 0.0, 'NR_COTST': 100,
+    })
+    with zipfile.ZipFile(caminho, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('inf_diario_fi_202601.csv', df.to_csv(sep=';', index=False))
+    return df
+
+class _StubArquivo(BaseHTTPRequestHandler):
+    conteudo = b''
+    etag = '"v1"'
+    ultima_modificacao = None  # sem ETag quando definido (como o servidor do Tesouro)
+    downloads = 0
+    requisicoes = 0
+
+    def do_GET(self):
+        _StubArquivo.requisicoes += 1
+        if self.ultima_modificacao:
+            if self.headers.get('If-Modified-Since') == self.ultima_modificacao:
+                self.send_response(304); self.end_headers()
+                return
+        elif self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304); self.end_headers()
+            return
+        _StubArquivo.downloads += 1
+        self.send_response(200)
+        if self.ultima_modificacao:
+            self.send_header('Last-Modified', self.ultima_modificacao)
+        else:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.conteudo)))
+        self.end_headers()
+        self.wfile.write(self.conteudo)
+
+    def log_message(self, *args): pass
+
+def bench_cvm(n_fundos=20_000, carteira=15):
+    from cvm import cotas_cvm, ultimas_cotas
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_zip = os.path.join(pasta, 'inf_diario_fi_202601.zip')
+        df = gerar_zip_cvm(caminho_zip, n_fundos)
+        with open(caminho_zip, 'rb') as f:
+            _StubArquivo.conteudo = f.read()
+        _StubArquivo.downloads = 0
+        wanted = {f"{i:014d}" for i in range(0, n_fundos, n_fundos // carteira)}
+        indice = os.path.join(pasta, 'cvm.sqlite')
+
+        servidor, url = iniciar_stub(_StubArquivo)
+        try:
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                frio = cotas_cvm(f"{url}/inf_diario_fi_202601.zip", wanted, caminho_indice=indice)
+            t_frio = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                quente = cotas_cvm(f"{url}/inf_diario_fi_202601.zip", wanted, caminho_indice=indice)
+            t_quente = time.perf_counter() - t0
+        finally:
+            servidor.shutdown()
+
+        ultimo = df.assign(cnpj=df['CNPJ_FUNDO_CLASSE'].str.replace(r'\D', '', regex=True)).drop_duplicates('cnpj', keep='last')
+        esperado = ultimo[ultimo['cnpj'].isin(wanted)].set_index('cnpj')['VL_QUOTA'].to_dict()
+        if ultimas_cotas(frio) != esperado or ultimas_cotas(quente) != esperado:
+            raise AssertionError("Cotas CVM divergentes")
+        if _StubArquivo.downloads != 1:
+            raise AssertionError(f"Esperado 1 download, houve {_StubArquivo.downloads}")
+
+    registrar('cvm', frio=t_frio, quente=t_quente)
+    print(f"--- ⏱️ CVM ({n_fundos:,} fundos x {len(df) // n_fundos} dias, zip {len(_StubArquivo.conteudo) / 1e6:.1f} MB) ---")
+    print(f"   1ª execução (download + streaming): {t_frio * 1000:8.1f} ms")
+    print(f"   2ª execução (304 + índice local):   {t_quente * 1000:8.1f} ms")
+    print(f"   ✅ Cotas idênticas e download pulado na repetição")
+
+# --- BENCHMARK: TESOURO DIRETO ---
+def gerar_csv_tesouro(anos=20, seed=23):
+    rng = np.random.default_rng(seed)
+    titulos = [('Tesouro IPCA+', a) for a in range(2026, 2061, 5)] + \
+              [('Tesouro IPCA+ com Juros Semestrais', a) for a in range(2026, 2061, 5)] + \
+              [('Tesouro Selic', a) for a in range(2025, 2032)] + \
+              [('Tesouro Prefixado', a) for a in range(2025, 2033)] + \
+              [('Tesouro Prefixado com Juros Semestrais', a) for a in range(2027, 2036, 2)] + \
+              [('Tesouro Renda+ Aposentadoria Extra', a) for a in range(2030, 2065, 5)]
+    datas = pd.bdate_range(end='2026-10-16', periods=anos * 252)
+    partes = []
+    for nome, ano in titulos:
+        partes.append(pd.DataFrame({
+            'Tipo Titulo': nome,
+            'Data Vencimento': f"15/05/{ano}",
+            'Data Base': datas.strftime('%d/%m/%Y'),
+            'Taxa Compra Manha': '6,12', 'Taxa Venda Manha': '6,24',
+            'PU Compra Manha': '1000,00', 'PU Venda Manha': '990,00',
+            'PU Base Manha': [f"{v:.2f}".replace('.', ',') for v in 800 + np.cumsum(rng.normal(0.3, 2, len(datas)))],
+        }))
+    df = pd.concat(partes, ignore_index=True).sample(frac=1.0, random_state=seed)  # ordem do arquivo não é cronológica
+    return df.to_csv(sep=';', index=False).encode('latin1')
+
+def _tesouro_antigo(conteudo, tickers):
+    # Caminho antigo: CSV inteiro + Data Vencimento convertida de novo a cada ativo
+    df_td = pd.read_csv(io.BytesIO(conteudo), sep=';', decimal=',', encoding='latin1')
+    df_td['Data Base'] = pd.to_datetime(df_td['Data Base'], dayfirst=True)
+    df_hoje = df_td[df_td['Data Base'] == df_td['Data Base'].max()]
+    precos = {}
+    for t_td in tickers:
+        ano = "".join(filter(str.isdigit, t_td))
+        if len(ano) == 2: ano = "20" + ano
+        tipo = "IPCA" if "IPCA" in t_td else "SELIC" if "SELIC" in t_td else "PREFIXADO"
+        mask = (df_hoje['Tipo Titulo'].str.upper().str.contains(tipo)) & (pd.to_datetime(df_hoje['Data Vencimento'], dayfirst=True).dt.year == int(ano))
+        if not df_hoje[mask].empty: precos[t_td] = float(df_hoje[mask].iloc[0]['PU Base Manha'])
+    return precos
+
+def bench_tesouro():
+    import requests
+    from tesouro import atualizar_indice, ultimos_pus, historico_pu
+
+    conteudo = gerar_csv_tesouro()
+    tickers = ['IPCA35', 'IPCA2045', 'SELIC29', 'SELIC27', 'PRE31', 'PREFIXADO2027', 'IPCA99']
+    _StubArquivo.conteudo, _StubArquivo.downloads = conteudo, 0
+    _StubArquivo.ultima_modificacao = 'Fri, 16 Oct 2026 18:00:00 GMT'
+    servidor, url = iniciar_stub(_StubArquivo)
+    try:
+        with tempfile.TemporaryDirectory() as pasta:
+            indice = os.path.join(pasta, 'tesouro.sqlite')
+            t0 = time.perf_counter()
+            antigo = _tesouro_antigo(requests.get(f"{url}/precotaxa.csv", timeout=30).content, tickers)
+            t_antigo = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            atualizar_indice(f"{url}/precotaxa.csv", caminho=indice)
+            frio = ultimos_pus(tickers, caminho=indice)
+            t_frio = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            situacao = atualizar_indice(f"{url}/precotaxa.csv", caminho=indice)
+            quente = ultimos_pus(tickers, caminho=indice)
+            t_quente = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            hist = historico_pu(tickers, inicio='2025-01-01', caminho=indice)
+            t_hist = time.perf_counter() - t0
+    finally:
+        servidor.shutdown()
+        _StubArquivo.ultima_modificacao = None
+
+    for df in (frio, quente):
+        if dict(zip(df['ticker'], df['pu'])) != antigo:
+            raise AssertionError("PU do Tesouro divergente do caminho antigo")
+    if situacao != 'inalterado' or _StubArquivo.downloads != 2:
+        raise AssertionError("Download repetido apesar do If-Modified-Since")
+    if hist.groupby('ticker')['close'].last().to_dict() != antigo:
+        raise AssertionError("Histórico de PU não termina no PU atual")
+
+    registrar('tesouro', frio=t_frio, quente=t_quente, historico=t_hist)
+    print(f"--- ⏱️ Tesouro Direto (CSV {len(conteudo) / 1e6:.1f} MB, {len(tickers)} ativos) ---")
+    print(f"   caminho antigo (download + loop):   {t_antigo * 1000:8.1f} ms")
+    print(f"   1ª execução (download + índice):    {t_frio * 1000:8.1f} ms")
+    print(f"   2ª execução (304 + merge):          {t_quente * 1000:8.1f} ms")
+    print(f"   histórico de PU desde 2025:         {t_hist * 1000:8.1f} ms ({len(hist):,} linhas)")
+    print(f"   ✅ PU idêntico ao caminho antigo; download pulado na repetição")
+
+# --- PROVEDORES: INJEÇÃO DE FALHAS ---
+class _StubInstavel(BaseHTTPRequestHandler):
+    # HTTP/1.1 para permitir keep-alive; a cada 'falha_a_cada' requisições devolve 503
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1  # cabeçalho + corpo num único envio (evita atraso de ACK com keep-alive)
+    falha_a_cada = 4
+    latencia = 0.02
+    requisicoes = 0
+    conexoes = set()
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        with _StubInstavel._lock:
+            _StubInstavel.requisicoes += 1
+            n = _StubInstavel.requisicoes
+            _StubInstavel.conexoes.add(self.client_address)
+        time.sleep(self.latencia)
+        status = 503 if n % self.falha_a_cada == 0 else 200
+        corpo = b'{"results": []}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args): pass
+
+def bench_provedores(n=60):
+    import requests
+    from provedores import ClienteHTTP
+
+    servidor, url = iniciar_stub(_StubInstavel)
+    try:
+        resultados = {}
+        for nome, get in [("requests.get avulso", lambda u: requests.get(u, timeout=5)),
+                          ("ClienteHTTP (pool + retry)", ClienteHTTP("STUB", timeout=5, backoff=0.01).get)]:
+            _StubInstavel.requisicoes, _StubInstavel.conexoes = 0, set()
+            t0 = time.perf_counter()
+            ok = sum(get(f"{url}/quote/TCK{i}").status_code == 200 for i in range(n))
+            resultados[nome] = (ok, _StubInstavel.requisicoes, len(_StubInstavel.conexoes), time.perf_counter() - t0)
+    finally:
+        servidor.shutdown()
+
+    ok_cliente = resultados["ClienteHTTP (pool + retry)"][0]
+    if ok_cliente != n:
+        raise AssertionError(f"Retry não recuperou as falhas: {ok_cliente}/{n}")
+    registrar('provedores', cliente=resultados["ClienteHTTP (pool + retry)"][3])
+    print(f"--- ⏱️ Provedores com falhas injetadas (503 a cada {_StubInstavel.falha_a_cada} req., {n} consultas) ---")
+    for nome, (ok, reqs, conexoes, dt) in resultados.items():
+        print(f"   {nome:28s} sucesso {ok:3d}/{n}  requisições {reqs:3d}  conexões {conexoes:3d}  {dt * 1000:8.1f} ms")
+    print(f"   ✅ Todas as consultas recuperadas pelo retry")
+
+# --- TELEMETRIA: CUSTO DOS TRECHOS E RELATÓRIO ---
+def _consulta_em_thread(cliente, url):
+    # Nome próprio para achar no perfil as chamadas feitas nas threads do pool
+    return cliente.get(url)
+
+def bench_telemetria(n=100_000, threads=8, consultas=40):
+    import pstats
+    import telemetria
+    from concurrent.futures import ThreadPoolExecutor
+    from provedores import ClienteHTTP
+    from agendador import Etapa, executar_etapas
+
+    antes = dict(telemetria.coletor().contadores)
+    def _trabalho(_):
+        for _ in range(n // threads):
+            with telemetria.medir("bench.trecho"):
+                telemetria.contar("bench.contador")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(_trabalho, range(threads)))
+    t_trechos = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as pasta:
+        perfil_antigo, telemetria.PERFIL = telemetria.PERFIL, "cprofile"
+        servidor, url = iniciar_stub(_StubInstavel)
+        _StubInstavel.requisicoes = 0
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                with telemetria.execucao("bench", resumo=True, pasta=pasta):
+                    cliente = ClienteHTTP("STUB", timeout=5, backoff=0.01)
+                    # Metade das consultas em etapas do agendador, cada uma com seu pool
+                    def _etapa(_):
+                        with ThreadPoolExecutor(4) as pool:
+                            list(pool.map(lambda i: _consulta_em_thread(cliente, f"{url}/quote/TCK{i}"), range(consultas // 2)))
+                    executar_etapas([Etapa("consultas", _etapa, 60)])
+                    for i in range(consultas // 2, consultas):
+                        cliente.get(f"{url}/quote/TCK{i}")
+        finally:
+            servidor.shutdown()
+            telemetria.PERFIL = perfil_antigo
+        with open(os.path.join(pasta, "ultimo-bench.json"), encoding="utf-8") as f:
+            dados = json.load(f)
+        perfil_gravado = dados['perfil'] and os.path.exists(dados['perfil'])
+        funcoes = {f[2] for f in pstats.Stats(dados['perfil']).stats} if perfil_gravado else set()
+
+    contadores = dados['contadores']
+    if contadores['bench.contador'] - antes.get('bench.contador', 0) != n // threads * threads:
+        raise AssertionError("Contador perdeu incrementos entre threads")
+    retries = contadores.get('STUB.retry', 0) - antes.get('STUB.retry', 0)
+    if retries != _StubInstavel.requisicoes - consultas or dados['trechos']['http.STUB']['n'] < _StubInstavel.requisicoes:
+        raise AssertionError("Retries/trechos HTTP não batem com as requisições do stub")
+    if not perfil_gravado:
+        raise AssertionError("Perfil cProfile não gravado")
+    if '_consulta_em_thread' not in funcoes:
+        raise AssertionError("Perfil não inclui as threads das etapas e dos pools")
+    registrar('telemetria', trechos=t_trechos)
+    print(f"--- ⏱️ Telemetria ({n:,} trechos em {threads} threads) ---")
+    print(f"   custo por trecho + contador:        {t_trechos / n * 1e6:8.2f} µs")
+    print(f"   requisições ao stub: {_StubInstavel.requisicoes}, retries contados: {retries}")
+    print(f"   ✅ Contagens exatas; relatório JSON e perfil cProfile (todas as threads) gravados")
+
+# --- GOOGLE SHEETS FALSO (CONTA CHAMADAS À API) ---
+class FakeWorksheet:
+    def __init__(self, planilha, title, id, rows=1000, cols=26):
+        self.planilha, self.title, self.id = planilha, title, id
+        self.row_count, self.col_count = rows, cols
+        self.valores = []
+
+    @property
+    def index(self):
+        return list(self.planilha.abas).index(self.title)
+
+    def _escrever(self, linha, col, valores):
+        for i, registro in enumerate(valores):
+            while len(self.valores) < linha + i: self.valores.append([])
+            atual = self.valores[linha + i - 1]
+            for j, v in enumerate(registro):
+                while len(atual) < col + j: atual.append('')
+                atual[col + j - 1] = v
+
+    def get_values(self, **kwargs):
+        self.planilha.chamadas['get_values'] += 1
+        return [list(r) for r in self.valores]
+
+    def get_all_records(self):
+        self.planilha.chamadas['get_all_records'] += 1
+        cab, *linhas = self.valores or [[]]
+        return [dict(zip(cab, r)) for r in linhas]
+
+    def clear(self):
+        self.planilha.chamadas['clear'] += 1
+        self.valores = []
+
+    def update(self, values, range_name='A1', **kwargs):
+        from gspread.utils import a1_to_rowcol
+        self.planilha.chamadas['update'] += 1
+        self.planilha.celulas += sum(len(r) for r in values)
+        self._escrever(*a1_to_rowcol(range_name.split(':')[0]), values)
+
+    def batch_update(self, data, **kwargs):
+        from gspread.utils import a1_to_rowcol
+        self.planilha.chamadas['batch_update'] += 1
+        for bloco in data:
+            self.planilha.celulas += sum(len(r) for r in bloco['values'])
+            self._escrever(*a1_to_rowcol(bloco['range'].split(':')[0]), bloco['values'])
+
+    def resize(self, rows=None, cols=None):
+        self.planilha.chamadas['resize'] += 1
+        self.row_count, self.col_count = rows or self.row_count, cols or self.col_count
+
+class FakePlanilha:
+    def __init__(self, abas=None):
+        from collections import Counter
+        self.chamadas, self.celulas, self._ids = Counter(), 0, 0
+        self.abas = {}
+        for titulo, valores in (abas or {}).items():
+            self._criar(titulo).valores = [list(r) for r in valores]
+
+    def _criar(self, titulo, rows=1000, cols=26):
+        self._ids += 1
+        self.abas[titulo] = FakeWorksheet(self, titulo, self._ids, rows, cols)
+        return self.abas[titulo]
+
+    def worksheet(self, titulo):
+        import gspread
+        self.chamadas['worksheet'] += 1
+        if titulo not in self.abas: raise gspread.WorksheetNotFound(titulo)
+        return self.abas[titulo]
+
+    def worksheets(self):
+        self.chamadas['worksheets'] += 1
+        return list(self.abas.values())
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        self.chamadas['add_worksheet'] += 1
+        return self._criar(title, rows, cols)
+
+    def del_worksheet(self, ws):
+        self.chamadas['del_worksheet'] += 1
+        del self.abas[ws.title]
+
+    def batch_update(self, body):
+        self.chamadas['spreadsheet_batch_update'] += 1
+        por_id = {ws.id: ws for ws in self.abas.values()}
+        for req in body['requests']:
+            if 'deleteSheet' in req:
+                del self.abas[por_id[req['deleteSheet']['sheetId']].title]
+            elif 'updateSheetProperties' in req:
+                props = req['updateSheetProperties']['properties']
+                ws = por_id[props['sheetId']]
+                del self.abas[ws.title]
+                ws.title = props.get('title', ws.title)
+                self.abas[ws.title] = ws
+
+def _aparar(valores):
+    # Sem as células e linhas vazias do fim (o que a reescrita no lugar deixa como '')
+    linhas = [list(r) for r in valores]
+    for r in linhas:
+        while r and r[-1] == '': r.pop()
+    while linhas and not linhas[-1]: linhas.pop()
+    return linhas
+
+def bench_planilhas(n=150):
+    from planilhas import sincronizar_aba, _igual
+
+    base = [['ticker', 'close_price', 'last_update']] + [[f"TCK{i:03d}3", 10.0 + i, '18/10/2026 10:00:00'] for i in range(n)]
+    poucas = [list(r) for r in base]
+    for r in poucas[1:6]: r[1] += 0.5
+    # Dia normal: 80% dos preços mexem e o last_update muda em todas as linhas
+    dia = [r if i == 0 else [r[0], r[1] + (0.5 if i % 5 else 0.0), '19/10/2026 10:00:00'] for i, r in enumerate(base)]
+    todas = [[f"NOV{i:03d}3", 1.0 + i, '19/10/2026 10:00:00'] if i else r for i, r in enumerate(base)]
+    menor = [list(r) for r in base[:n // 2]]
+
+    # Chamadas de escrita esperadas em cada cenário (o resto deve ser zero)
+    cenarios = [
+        ("sem mudanças", base, 'nenhum', {}),
+        ("5 preços mudaram", poucas, 'delta', {'batch_update': 1}),
+        ("dia normal de preços", dia, 'completa', {'update': 1}),
+        ("tabela inteira nova", todas, 'completa', {'update': 1}),
+        ("metade das linhas", menor, 'completa', {'update': 1}),
+        ("aba nova", base, 'nova', {'add_worksheet': 1, 'update': 1, 'spreadsheet_batch_update': 1}),
+    ]
+    leituras = ('worksheet', 'worksheets', 'get_values', 'get_all_records')
+    print(f"--- ⏱️ Escrita no Sheets ({n} linhas, API falsa) ---")
+    for nome, nova, modo_esperado, esperadas in cenarios:
+        # Referência: clear() + reescrita completa
+        antigo = FakePlanilha({'market_data': base})
+        ws = antigo.worksheet('market_data'); ws.clear(); ws.update(nova, 'A1')
+        sh = FakePlanilha({} if nome == "aba nova" else {'market_data': base})
+        gid = sh.abas['market_data'].id if 'market_data' in sh.abas else None
+        modo, _ = sincronizar_aba(sh, 'market_data', nova)
+        final = _aparar(sh.abas['market_data'].valores)
+        if len(final) != len(nova) or not all(_igual(a, b) for ra, rb in zip(final, nova) for a, b in zip(ra, rb)):
+            raise AssertionError(f"Conteúdo divergente após sincronizar ({nome})")
+        escritas = {k: v for k, v in sh.chamadas.items() if k not in leituras and v}
+        if modo != modo_esperado or escritas != esperadas:
+            raise AssertionError(f"Chamadas inesperadas ({nome}): modo {modo}, {escritas} (esperado {modo_esperado}, {esperadas})")
+        if gid is not None and sh.abas['market_data'].id != gid:
+            raise AssertionError(f"A aba foi recriada ({nome}): fórmulas que apontam para ela quebrariam")
+        print(f"   {nome:20s} clear+update: 2 escritas/{antigo.celulas:4d} células | sync ({modo:8s}): "
+              f"{sum(escritas.values())} escritas/{sh.celulas:4d} células")
+
+    # Falha no meio da criação de uma aba: a temporária não pode ficar para trás
+    sh = FakePlanilha({})
+    def falhar(*args, **kwargs): raise RuntimeError("queda da API")
+    update_original, FakeWorksheet.update = FakeWorksheet.update, falhar
+    try:
+        sincronizar_aba(sh, 'market_data', base)
+        raise AssertionError("Falha na escrita não foi propagada")
+    except RuntimeError:
+        pass
+    finally:
+        FakeWorksheet.update = update_original
+    if sh.abas:
+        raise AssertionError(f"Aba temporária órfã após falha: {list(sh.abas)}")
+    print(f"   ✅ Conteúdo final idêntico e chamadas conferidas em todos os cenários; mesma aba (gid) e nenhuma temporária órfã")
+
+# --- PONTA A PONTA: update_market_data COM PROVEDORES FALSOS ---
+# Sheets falso + stubs HTTP locais para BRAPI, CVM e Tesouro; o Yahoo (yfinance
+# não aceita outro endpoint) é simulado com a mesma latência por lote.
+def _preco_sintetico(simbolo):
+    import zlib
+    return 10.0 + zlib.crc32(simbolo.encode()) % 9000 / 100
+
+class _StubCotacoes(BaseHTTPRequestHandler):
+    # /quote/A,B,C -> results só com os símbolos conhecidos; como a BRAPI, um símbolo
+    # inválido no lote derruba a requisição inteira (404). 'status' força a mesma
+    # resposta para todas as requisições (ex: 503 fora do ar, 401 token inválido)
+    conhecidos = set()
+    invalidos = set()
+    status = None
+    latencia = 0.05
+    por_simbolo = 0.0
+    requisicoes = 0
+
+    def do_GET(self):
+        _StubCotacoes.requisicoes += 1
+        simbolos = self.path.split('?')[0].rstrip('/').split('/')[-1].upper().split(',')
+        time.sleep(self.latencia + self.por_simbolo * len(simbolos))
+        if self.status:
+            self.send_response(self.status); self.end_headers()
+            return
+        if self.invalidos.intersection(simbolos):
+            self.send_response(404); self.end_headers()
+            return
+        resultados = [{'symbol': s, 'regularMarketPrice': _preco_sintetico(s)} for s in simbolos if s in self.conhecidos]
+        corpo = json.dumps({'results': resultados}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args): pass
+
+def _brapi_lotes_fixos(url, simbolos, tamanho=20):
+    # Caminho antigo: lotes fixos em sequência; lote com erro perde todos os símbolos
+    from provedores import cliente
+    precos = {}
+    for i in range(0, len(simbolos), tamanho):
+        resp = cliente("BRAPI").get(f"{url}/quote/{','.join(simbolos[i:i + tamanho])}", params={'token': 'stub'})
+        if resp.status_code == 200:
+            precos.update({r['symbol']: r['regularMarketPrice'] for r in resp.json()['results']})
+    return precos
+
+def bench_brapi(n=600, n_invalidos=6, latencia=0.08, por_simbolo=0.004):
+    from provedores import cotar_brapi
+
+    simbolos = [f"BRP{i:03d}3" for i in range(n)]
+    _StubCotacoes.conhecidos = set(simbolos)
+    _StubCotacoes.latencia, _StubCotacoes.por_simbolo = latencia, por_simbolo
+    servidor, url = iniciar_stub(_StubCotacoes)
+    linhas, tempos = [], {}
+    try:
+        # Sem símbolos inválidos (vazão) e com alguns inválidos espalhados (cobertura)
+        for cenario, invalidos in (('validos', set()), ('invalidos', set(simbolos[n // (2 * n_invalidos)::n // n_invalidos][:n_invalidos]))):
+            _StubCotacoes.invalidos = invalidos
+            esperado = {s: _preco_sintetico(s) for s in simbolos if s not in invalidos}
+            _StubCotacoes.requisicoes = 0
+            t0 = time.perf_counter()
+            antigo = _brapi_lotes_fixos(url, simbolos)
+            t_antigo = time.perf_counter() - t0
+            req_antigo, _StubCotacoes.requisicoes = _StubCotacoes.requisicoes, 0
+            itens, rel = cotar_brapi(simbolos, {'token': 'stub'}, url=url)
+            novo = {s: item['regularMarketPrice'] for s, item in itens.items()}
+            if novo != esperado:
+                raise AssertionError(f"Cotações BRAPI divergentes ({cenario}): {len(novo)} x {len(esperado)}")
+            if sorted(rel['falhas']) != sorted(invalidos):
+                raise AssertionError(f"Símbolos recusados inesperados ({cenario}): {rel['falhas']}")
+            tempos[f"{cenario}_fixos"], tempos[f"{cenario}_adaptativo"] = t_antigo, rel['segundos']
+            linhas.append(f"   {len(invalidos)} inválidos, lotes fixos de 20:  {t_antigo * 1000:8.1f} ms  {req_antigo:3d} req  "
+                          f"{n / t_antigo:5.0f} símbolos/s  ({len(esperado) - len(antigo)} válidos perdidos)")
+            linhas.append(f"   {len(invalidos)} inválidos, adaptativo:         {rel['segundos'] * 1000:8.1f} ms  {_StubCotacoes.requisicoes:3d} req  "
+                          f"{rel['simbolos_por_s']:5.0f} símbolos/s  (lote final {rel['tamanho_final']})")
+
+        # Falha que não é de símbolo: nada de bissecção (lote inteiro volta uma vez ou para tudo)
+        from provedores import cliente, BRAPI_LOTE, BRAPI_REENVIOS, BRAPI_WORKERS
+        http = cliente("BRAPI")
+        backoff, http.backoff = http.backoff, 0.01
+        amostra = simbolos[:100]
+        n_lotes = -(-len(amostra) // BRAPI_LOTE)
+        limites = {503: n_lotes * http.tentativas * (1 + BRAPI_REENVIOS), 401: BRAPI_WORKERS}
+        try:
+            for status, limite in limites.items():
+                _StubCotacoes.status, _StubCotacoes.requisicoes = status, 0
+                itens, rel = cotar_brapi(amostra, {'token': 'stub'}, url=url)
+                if itens or rel['falhas'] or sorted(rel['sem_resposta']) != sorted(amostra) or rel['negado'] != (status == 401):
+                    raise AssertionError(f"BRAPI {status}: relatório inesperado ({len(rel['sem_resposta'])} sem resposta, falhas {rel['falhas'][:3]})")
+                if _StubCotacoes.requisicoes > limite:
+                    raise AssertionError(f"BRAPI {status}: {_StubCotacoes.requisicoes} requisições para {len(amostra)} símbolos (limite {limite})")
+                linhas.append(f"   HTTP {status} em tudo ({len(amostra)} símbolos):    {_StubCotacoes.requisicoes:3d} req (limite {limite}), "
+                              f"{'consulta interrompida' if rel['negado'] else 'lotes reenviados inteiros uma vez'}")
+        finally:
+            http.backoff = backoff
+    finally:
+        _StubCotacoes.invalidos, _StubCotacoes.por_simbolo, _StubCotacoes.status = set(), 0.0, None
+        servidor.shutdown()
+
+    registrar('brapi', **tempos)
+    print(f"--- ⏱️ BRAPI em lotes ({n} símbolos, {latencia * 1000:.0f} ms + {por_simbolo * 1000:.0f} ms/símbolo por requisição) ---")
+    print("\n".join(linhas))
+    print(f"   ✅ Todos os símbolos válidos cotados nos dois cenários; bissecção isolou os {n_invalidos} inválidos")
+
+# --- BENCHMARK: RESOLVEDOR DE SÍMBOLOS E MEMÓRIA DE AUSENTES ---
+# A tabela de símbolos sai do cadastro uma vez por execução; símbolos que a BRAPI
+# recusa em MIN_FALHAS execuções seguidas deixam de ser pedidos (sem bissecção).
+def bench_simbolos(n_assets=3_000, n_brapi=300, n_invalidos=6, latencia=0.03):
+    import update_market_data as umd
+    from simbolos import Resolvedor, Ausentes, MIN_FALHAS, TIPOS_BR
+
+    tipos = ['ACAO_BR', 'FII', 'BDR', 'ETF_US', 'FUNDO', 'TESOURO']
+    assets = pd.DataFrame({
+        'ticker': [f"RSV{i:04d}3" if tipos[i % 6] != 'ETF_US' else f"U{i:04d}" for i in range(n_assets)],
+        'type': [tipos[i % 6] for i in range(n_assets)],
+        'isin_cnpj': [f"{i:014d}" if tipos[i % 6] == 'FUNDO' else '' for i in range(n_assets)],
+    })
+    t0 = time.perf_counter()
+    resolvedor = Resolvedor(assets)
+    tabela = resolvedor.tabela()
+    t_tabela = time.perf_counter() - t0
+    if len(resolvedor.cadastrados(TIPOS_BR)) != tabela['brapi'].notna().sum():
+        raise AssertionError("Símbolo BRAPI fora dos tipos da B3")
+    # Regras que antes divergiam entre os scripts
+    casos = {'CESP6': ('AURE3', 'AURE3', 'AURE3.SA'), 'aapl34': ('AAPL34', 'AAPL34', 'AAPL34.SA'),
+             'PETR4.SA': ('PETR4', 'PETR4', 'PETR4.SA'), 'BRK-B': ('BRK-B', None, 'BRK-B'), 'LCA BB 2027': ('LCA BB 2027', None, None),
+             'LCID': ('LCID', None, 'LCID'), 'NANR': ('NANR', None, 'NANR'), 'CDB2027': ('CDB2027', None, None),
+             'PREVIDENCIA XP': ('PREVIDENCIA XP', None, None), 'TD_IPCA35': ('TD_IPCA35', None, None), 'NONE': ('NONE', None, None)}
+    for ticker, esperado in casos.items():
+        obtido = (resolvedor.atual(ticker), resolvedor.brapi(ticker), resolvedor.yahoo(ticker))
+        if obtido != esperado:
+            raise AssertionError(f"Resolvedor: {ticker} -> {obtido}, esperado {esperado}")
+    # Padrão 1.0 do update_prices: só o que a tabela classifica como sem cotação
+    if [resolvedor.sem_cotacao(t) for t in ('LCA BB 2027', 'FGTS', 'PREVIDENCIA XP', 'LCID', 'PETR4', 'NANR')] != [True] * 3 + [False] * 3:
+        raise AssertionError("Classificação sem cotação divergente")
+    titulos = Resolvedor(pd.DataFrame({'ticker': ['IPCA35', 'SELIC29', 'PRE2031'], 'type': 'TESOURO'}))
+    if [titulos.tesouro(t) for t in ('IPCA35', 'SELIC29', 'PRE2031')] != ['IPCA:2035', 'SELIC:2029', 'PREFIXADO:2031']:
+        raise AssertionError("Chave do Tesouro no Resolvedor divergente")
+
+    simbolos = [f"AUS{i:03d}3" for i in range(n_brapi)]
+    invalidos = set(simbolos[n_brapi // (2 * n_invalidos)::n_brapi // n_invalidos][:n_invalidos])
+    _StubCotacoes.conhecidos, _StubCotacoes.invalidos = set(simbolos), invalidos
+    _StubCotacoes.latencia, _StubCotacoes.por_simbolo = latencia, 0.0
+    servidor, url = iniciar_stub(_StubCotacoes)
+    env, url_original = os.environ.get('BRAPI_TOKEN'), umd.BRAPI_URL
+    requisicoes, tempos = [], []
+    try:
+        os.environ['BRAPI_TOKEN'] = 'stub'
+        umd.BRAPI_URL = url
+        with tempfile.TemporaryDirectory() as pasta:
+            # Uma execução por rodada: a memória é lida e gravada como no update_market_data
+            for _ in range(MIN_FALHAS + 1):
+                ausentes = Ausentes(os.path.join(pasta, 'ausentes.json'))
+                _StubCotacoes.requisicoes = 0
+                t0 = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    precos = umd.etapa_brapi(simbolos, ausentes=ausentes)
+                tempos.append(time.perf_counter() - t0)
+                requisicoes.append(_StubCotacoes.requisicoes)
+                ausentes.salvar()
+                if set(precos) != set(simbolos) - invalidos:
+                    raise AssertionError(f"Cotações BRAPI divergentes: {len(precos)} x {len(simbolos) - len(invalidos)}")
+            mortos = Ausentes(os.path.join(pasta, 'ausentes.json')).mortos('BRAPI')
+    finally:
+        _StubCotacoes.invalidos = set()
+        umd.BRAPI_URL = url_original
+        if env is None: os.environ.pop('BRAPI_TOKEN', None)
+        else: os.environ['BRAPI_TOKEN'] = env
+        servidor.shutdown()
+    if mortos != invalidos:
+        raise AssertionError(f"Memória de ausentes: {sorted(mortos)} x {sorted(invalidos)}")
+    if requisicoes[-1] >= requisicoes[0]:
+        raise AssertionError(f"Símbolos mortos continuam sendo consultados: {requisicoes}")
+
+    registrar('simbolos', tabela=t_tabela, com_invalidos=tempos[0], memorizado=tempos[-1])
+    print(f"--- ⏱️ Resolvedor de símbolos ({n_assets} ativos) e memória de ausentes ({n_brapi} símbolos BRAPI, {n_invalidos} inválidos) ---")
+    print(f"   Tabela de símbolos:                   {t_tabela * 1000:8.1f} ms")
+    print(f"   BRAPI com inválidos (bissecção):      {tempos[0] * 1000:8.1f} ms  {requisicoes[0]:3d} req")
+    print(f"   BRAPI após {MIN_FALHAS} execuções (memorizados): {tempos[-1] * 1000:8.1f} ms  {requisicoes[-1]:3d} req")
+    print(f"   ✅ Mesmas cotações; os {n_invalidos} inválidos deixam de ser pedidos")
+
+def gerar_planilha_carteira(n_acoes=250, n_us=30, n_fundos=15, seed=17):
+    """Planilha falsa com assets (todos os tipos de ativo) e a market_data da execução anterior."""
+    rng = np.random.default_rng(seed)
+    acoes = [f"ACO{i:03d}3" for i in range(n_acoes)]
+    us = [f"US{i:02d}" for i in range(n_us)]
+    fundos = [f"FUNDO{i:02d}" for i in range(n_fundos)]
+    cnpjs = [f"{i * 97:014d}" for i in range(n_fundos)]
+    tesouro = ['IPCA2036', 'IPCA46', 'SELIC29', 'PRE2031']
+    manuais = ['CDB01', 'PREV01']
+    linhas = [['ticker', 'type', 'currency', 'isin_cnpj', 'manual_update', 'price_google']]
+    linhas += [[t, 'ACAO_BR', 'BRL', '', 'N', round(float(rng.random() * 50 + 1), 2)] for t in acoes]
+    linhas += [[t, 'ETF_US', 'USD', '', 'N', 0] for t in us]
+    linhas += [[t, 'FUNDO', 'BRL', f"{c[:2]}.{c[2:5]}.{c[5:8]}/{c[8:12]}-{c[12:]}", 'N', 0] for t, c in zip(fundos, cnpjs)]
+    linhas += [[t, 'TESOURO', 'BRL', '', 'N', 0] for t in tesouro]
+    linhas += [[t, 'RENDA_FIXA', 'BRL', '', 'S', 0] for t in manuais]
+    market = [['ticker', 'close_price', 'last_update']] + [[r[0], 1.0 + i, '17/10/2026 19:00:00'] for i, r in enumerate(linhas[1:])]
+    return FakePlanilha({'assets': linhas, 'market_data': market}), dict(zip(cnpjs, fundos))
+
+@contextlib.contextmanager
+def _ambiente_precos(sh, pasta, latencia=0.05):
+    """
+    Liga update_market_data e update_funds a stubs locais (BRAPI, Yahoo, CVM, Tesouro) e a
+    uma Sessao sobre a planilha falsa 'sh'. 1 em cada 10 ações some da BRAPI (cai no Yahoo);
+    1 em cada 50 some também do Yahoo (backup Google). Entrega um dict com o que a
+    verificação precisa (chamadas ao Yahoo, índice do Tesouro, cotas da CVM, etc.).
+    """
+    from functools import partial
+    import update_market_data as umd
+    import update_funds as ufu
+    import cvm, tesouro, snapshots, historico_precos, planilhas
+
+    assets = pd.DataFrame(sh.abas['assets'].valores[1:], columns=sh.abas['assets'].valores[0])
+    acoes = assets.loc[assets['type'] == 'ACAO_BR', 'ticker'].tolist()
+    _StubCotacoes.conhecidos = set(acoes) - set(acoes[::10])
+    sem_yahoo = {f"{t}.SA" for t in acoes[::50]}
+    _StubCotacoes.latencia, _StubCotacoes.requisicoes = latencia, 0
+    _StubArquivo.downloads = 0
+    chamadas_yahoo = []
+
+    def yahoo_falso(simbolos, tamanho_lote=50):
+        simbolos = list(dict.fromkeys(simbolos))
+        chamadas_yahoo.append(len(simbolos))
+        time.sleep(latencia * -(-len(simbolos) // tamanho_lote))
+        return {s: (5.4 if s == 'USDBRL=X' else _preco_sintetico(s)) for s in simbolos if s not in sem_yahoo}
+
+    class _StubCVM(_StubArquivo): pass
+    class _StubTesouro(_StubArquivo):
+        ultima_modificacao = 'Fri, 16 Oct 2026 18:00:00 GMT'
+
+    originais = {(m, k): getattr(m, k) for m, nomes in (
+        (umd, ('BRAPI_URL', 'cotacoes_yahoo', 'cotas_cvm', 'atualizar_indice', 'ultimos_pus', 'anexar_precos', 'compactar',
+               'COTACOES_CACHE_PATH', 'AUSENTES_PATH', 'Sessao')),
+        (ufu, ('cotas_cvm', 'Sessao')), (snapshots, ('publicar_snapshot',))) for k in nomes}
+    env = {k: os.environ.get(k) for k in ('BRAPI_TOKEN', 'SGP_TTL_BRAPI', 'SGP_TTL_YAHOO', 'SGP_TTL_CAMBIO')}
+    df_cvm = gerar_zip_cvm(os.path.join(pasta, 'cvm.zip'), n_fundos=2_000, dias=10)
+    with open(os.path.join(pasta, 'cvm.zip'), 'rb') as f:
+        _StubCVM.conteudo = f.read()
+    _StubTesouro.conteudo = gerar_csv_tesouro(anos=2)
+    servidores = [iniciar_stub(h) for h in (_StubCotacoes, _StubCVM, _StubTesouro)]
+    (_, url_brapi), (_, url_cvm), (_, url_td) = servidores
+    indice_cvm, indice_td = os.path.join(pasta, 'cvm.sqlite'), os.path.join(pasta, 'tesouro.sqlite')
+    try:
+        os.environ.update(BRAPI_TOKEN='stub')
+        sessao_falsa = partial(planilhas.Sessao, abrir=lambda: sh)
+        umd.Sessao = ufu.Sessao = sessao_falsa
+        umd.BRAPI_URL = f"{url_brapi}/api"
+        umd.cotacoes_yahoo = yahoo_falso
+        umd.cotas_cvm = ufu.cotas_cvm = lambda url, cnpjs, timeout=90: cvm.cotas_cvm(
+            f"{url_cvm}/{url.rsplit('/', 1)[-1]}", cnpjs, timeout, caminho_indice=indice_cvm)
+        umd.atualizar_indice = partial(tesouro.atualizar_indice, f"{url_td}/precotaxa.csv", caminho=indice_td)
+        umd.ultimos_pus = partial(tesouro.ultimos_pus, caminho=indice_td)
+        snapshots.publicar_snapshot = partial(originais[(snapshots, 'publicar_snapshot')], pasta=os.path.join(pasta, 'snapshots'))
+        umd.anexar_precos = partial(historico_precos.anexar_precos, pasta=os.path.join(pasta, 'precos'))
+        umd.compactar = partial(historico_precos.compactar, pasta=os.path.join(pasta, 'precos'))
+        umd.COTACOES_CACHE_PATH = os.path.join(pasta, 'cotacoes.json')
+        umd.AUSENTES_PATH = os.path.join(pasta, 'ausentes.json')
+        yield {'assets': assets, 'acoes': acoes, 'sem_yahoo': sem_yahoo, 'chamadas_yahoo': chamadas_yahoo,
+               'df_cvm': df_cvm, 'indice_td': indice_td, 'sessao': sessao_falsa}
+    finally:
+        for servidor, _ in servidores: servidor.shutdown()
+        for (m, k), v in originais.items(): setattr(m, k, v)
+        for k, v in env.items():
+            if v is None: os.environ.pop(k, None)
+            else: os.environ[k] = v
+
+def _precos_esperados(amb, fundos):
+    """market_data que update_market_data deve gravar com os stubs de _ambiente_precos."""
+    import tesouro
+    assets, acoes, sem_yahoo = amb['assets'], amb['acoes'], amb['sem_yahoo']
+    df_cvm = amb['df_cvm']
+    pus = tesouro.ultimos_pus(assets.loc[assets['type'] == 'TESOURO', 'ticker'], caminho=amb['indice_td'])
+    ultimo = df_cvm.assign(cnpj=df_cvm['CNPJ_FUNDO_CLASSE'].str.replace(r'\D', '', regex=True)).drop_duplicates('cnpj', keep='last')
+    esperado = {t: _preco_sintetico(t) for t in _StubCotacoes.conhecidos}
+    esperado.update({t: _preco_sintetico(f"{t}.SA") for t in acoes[::10] if f"{t}.SA" not in sem_yahoo})
+    esperado.update({t[:-3]: float(p) for t, p in zip(assets['ticker'] + '.SA', assets['price_google']) if t in sem_yahoo})
+    esperado.update({t: _preco_sintetico(t) for t in assets.loc[assets['type'] == 'ETF_US', 'ticker']})
+    esperado.update({fundos[c]: q for c, q in zip(ultimo['cnpj'], ultimo['VL_QUOTA']) if c in fundos})
+    esperado.update(dict(zip(pus['ticker'], pus['pu'])))
+    esperado.update({'CDB01': 1.0 + len(assets) - 2, 'PREV01': 1.0 + len(assets) - 1, 'USDBRL=X': 5.4})
+    return esperado
+
+def bench_update_market_data(n_acoes=250, latencia=0.05):
+    import update_market_data as umd
+
+    sh, fundos = gerar_planilha_carteira(n_acoes)
+    env = {k: os.environ.get(k) for k in ('SGP_TTL_BRAPI', 'SGP_TTL_YAHOO', 'SGP_TTL_CAMBIO', 'SGP_TTL_CVM')}
+    tempos, gravados, rede, historicos = {}, {}, {}, {}
+    with tempfile.TemporaryDirectory() as pasta:
+        with _ambiente_precos(sh, pasta, latencia) as amb:
+            anexar = umd.anexar_precos
+            def _anexar(df, **kw):
+                historicos[rodada] = df
+                return anexar(df, **kw)
+            umd.anexar_precos = _anexar
+            try:
+                # fria/quente ignoram o cache de cotações; 'cache' roda com tudo fresco e 'velho'
+                # com as cotações vencidas (TTL 0: servidas na hora e revalidadas em segundo plano);
+                # 'cvm_velha': cotas da CVM vencidas são buscadas antes (a série do mês vai ao histórico)
+                for rodada in ('fria', 'quente', 'cache', 'velho', 'cvm_velha'):
+                    if rodada == 'velho':
+                        os.environ.update(SGP_TTL_BRAPI='0', SGP_TTL_YAHOO='0', SGP_TTL_CAMBIO='0')
+                    if rodada == 'cvm_velha':
+                        os.environ.update(SGP_TTL_CVM='0')
+                    antes = (_StubCotacoes.requisicoes, len(amb['chamadas_yahoo']), _StubArquivo.requisicoes)
+                    t0 = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        umd.update_prices(refresh=rodada in ('fria', 'quente'))
+                    tempos[rodada] = time.perf_counter() - t0
+                    rede[rodada] = (_StubCotacoes.requisicoes - antes[0], len(amb['chamadas_yahoo']) - antes[1], _StubArquivo.requisicoes - antes[2])
+                    gravados[rodada] = {r[0]: r[1] for r in sh.abas['market_data'].valores[1:]}
+            finally:
+                for k, v in env.items():
+                    if v is None: os.environ.pop(k, None)
+                    else: os.environ[k] = v
+            esperado = _precos_esperados(amb, fundos)
+            n_assets = len(amb['assets'])
+
+    gravado = gravados['quente']
+    divergentes = [t for t, p in esperado.items() if not np.isclose(gravado.get(t, np.nan), p)]
+    if divergentes or len(gravado) != len(esperado):
+        raise AssertionError(f"market_data divergente: {divergentes[:5]} ({len(gravado)} x {len(esperado)} linhas)")
+    if _StubArquivo.downloads != 2:
+        raise AssertionError("CVM/Tesouro baixados de novo na execução quente")
+    if any(rede['cache']):
+        raise AssertionError(f"Execução com cache fresco foi à rede (BRAPI, Yahoo, arquivos): {rede['cache']}")
+    if gravados['cache'] != gravado or gravados['velho'] != gravado:
+        raise AssertionError("market_data servido do cache difere da consulta às fontes")
+    if not (rede['velho'][0] and rede['velho'][1]) or rede['velho'][2]:
+        raise AssertionError(f"Revalidação só das cotações vencidas esperada: {rede['velho']}")
+    cvm_no_historico = {r: int((h['fonte'] == 'CVM').sum()) for r, h in historicos.items()}
+    if not rede['cvm_velha'][2] or not cvm_no_historico['cvm_velha'] or cvm_no_historico['cvm_velha'] != cvm_no_historico['fria']:
+        raise AssertionError(f"Série da CVM vencida não chegou ao histórico: {cvm_no_historico}")
+
+    registrar('update_market_data', fria=tempos['fria'], quente=tempos['quente'], cache=tempos['cache'], velho=tempos['velho'])
+    print(f"--- ⏱️ update_market_data ponta a ponta ({n_assets} ativos, latência {latencia * 1000:.0f} ms/req) ---")
+    print(f"   1ª execução (downloads + índices):   {tempos['fria'] * 1000:8.1f} ms")
+    print(f"   2ª execução (304 nos arquivos):      {tempos['quente'] * 1000:8.1f} ms")
+    print(f"   3ª execução (cache de cotações):     {tempos['cache'] * 1000:8.1f} ms  (0 requisições)")
+    print(f"   4ª execução (cotações vencidas):     {tempos['velho'] * 1000:8.1f} ms  (revalidadas em segundo plano)")
+    print(f"   5ª execução (cotas da CVM vencidas): {tempos['cvm_velha'] * 1000:8.1f} ms  (buscadas antes; {cvm_no_historico['cvm_velha']} cotas no histórico)")
+    print(f"   requisições à BRAPI: {rede['fria'][0]} por execução sem cache")
+    print(f"   ✅ market_data com o preço esperado de cada fonte ({len(esperado)} linhas), igual nas 4 execuções")
+
+# --- BENCHMARK: PIPELINE (python -m sgp run) ---
+# prices + funds como scripts separados (cada um autentica, lê e grava a market_data)
+# contra o pipeline (uma sessão, leituras compartilhadas, uma escrita consolidada).
+class _PlanilhaLenta(FakePlanilha):
+    # Cada chamada à API do Sheets custa 'latencia' (as leituras e escritas dominam o tempo)
+    latencia = 0.0
+
+    def worksheet(self, titulo):
+        time.sleep(self.latencia)
+        return super().worksheet(titulo)
+
+def bench_pipeline(n_acoes=250, latencia=0.05, latencia_sheets=0.15):
+    import sgp
+    import planilhas
+    import update_market_data as umd
+    import update_funds as ufu
+
+    saidas, tempos, chamadas, escritas, logs = {}, {}, {}, {}, {}
+    # 'cvm_no_prazo': a etapa CVM do estágio prices estoura o prazo e grava os fundos
+    # como reserva (preço preservado); as cotas do estágio funds têm de vencer
+    prazo_cvm = os.environ.get('PRAZO_CVM')
+    for modo in ('scripts', 'pipeline', 'cvm_no_prazo'):
+        base, fundos = gerar_planilha_carteira(n_acoes)
+        sh = _PlanilhaLenta({t: ws.valores for t, ws in base.abas.items()})
+        sh.latencia = latencia_sheets
+        with tempfile.TemporaryDirectory() as pasta, _ambiente_precos(sh, pasta, latencia) as amb:
+            t0 = time.perf_counter()
+            try:
+                if modo == 'cvm_no_prazo': os.environ['PRAZO_CVM'] = '0.001'
+                with contextlib.redirect_stdout(io.StringIO()) as saida:
+                    if modo == 'scripts':
+                        umd.update_prices(refresh=True)
+                        ufu.update_portfolio_funds()
+                    else:
+                        sgp.run(['prices', 'funds'], sessao=amb['sessao'](), refresh=True)
+            finally:
+                if prazo_cvm is None: os.environ.pop('PRAZO_CVM', None)
+                else: os.environ['PRAZO_CVM'] = prazo_cvm
+            tempos[modo], logs[modo] = time.perf_counter() - t0, saida.getvalue()
+            esperado = _precos_esperados(amb, fundos)
+            if modo == 'cvm_no_prazo':
+                # Só o estágio funds (mescla as próprias linhas): a célula-sinal do app muda mesmo assim
+                carimbo, planilhas.agora_gmt3 = planilhas.agora_gmt3, lambda: 'so-funds'
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        ufu.update_portfolio_funds()
+                finally:
+                    planilhas.agora_gmt3 = carimbo
+                if sh.abas['market_data'].valores[1][3] != 'so-funds':
+                    raise AssertionError("Gravação só do update_funds não carimbou a célula-sinal da market_data")
+        chamadas[modo] = sum(sh.chamadas[k] for k in ('worksheet', 'get_all_records', 'get_values'))
+        escritas[modo] = sum(v for k, v in sh.chamadas.items() if k not in ('worksheet', 'worksheets', 'get_all_records', 'get_values'))
+        saidas[modo] = sh.abas['market_data'].valores
+
+    for modo, valores in saidas.items():
+        if valores[0] != ['ticker', 'close_price', 'last_update', planilhas.COLUNA_SINAL] \
+                or any(len(r) != 4 or not r[2] or bool(r[3]) != (i == 0) for i, r in enumerate(valores[1:])):
+            raise AssertionError(f"market_data fora do formato ticker/close_price/last_update + sinal em D2 ({modo})")
+        gravado = {r[0]: r[1] for r in valores[1:]}
+        divergentes = [t for t, p in esperado.items() if not np.isclose(gravado.get(t, np.nan), p)]
+        if divergentes or len(gravado) != len(esperado):
+            raise AssertionError(f"market_data divergente ({modo}): {divergentes[:5]} ({len(gravado)} x {len(esperado)} linhas)")
+    if [r[:2] for r in saidas['scripts']] != [r[:2] for r in saidas['pipeline']]:
+        raise AssertionError("Pipeline grava market_data diferente dos scripts em sequência")
+    if not any(l.split()[1:3] == ['CVM', 'prazo'] for l in logs['cvm_no_prazo'].splitlines() if len(l.split()) > 2):
+        raise AssertionError("A etapa CVM do estágio prices não estourou o prazo no cenário cvm_no_prazo")
+    if chamadas['pipeline'] >= chamadas['scripts']:
+        raise AssertionError(f"Pipeline não economizou leituras: {chamadas}")
+
+    registrar('pipeline', scripts=tempos['scripts'], pipeline=tempos['pipeline'])
+    print(f"--- ⏱️ Pipeline prices+funds ({len(esperado)} linhas, {latencia_sheets * 1000:.0f} ms por chamada ao Sheets) ---")
+    print(f"   Scripts em sequência:  {tempos['scripts'] * 1000:8.1f} ms  {chamadas['scripts']:2d} leituras  {escritas['scripts']:2d} escritas")
+    print(f"   python -m sgp run:     {tempos['pipeline'] * 1000:8.1f} ms  {chamadas['pipeline']:2d} leituras  {escritas['pipeline']:2d} escritas")
+    print(f"   CVM de prices no prazo: {tempos['cvm_no_prazo'] * 1000:8.1f} ms  cotas do estágio funds vencem o preço preservado")
+    print(f"   ✅ Mesma market_data (last_update em todas as linhas, sinal do app em D2) e uma escrita por aba")
+
+# --- BENCHMARK: SNAPSHOTS LOCAIS ---
+def bench_snapshots(n_historico=50_000, n_market=300):
+    from snapshots import valores_para_df, publicar_snapshot, ler_snapshot, versao_snapshot
+
+    rng = np.random.default_rng(5)
+    datas = (pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, n_historico), unit='D')).strftime('%d/%m/%Y')
+    tabelas = {
+        'market_data': [['ticker', 'close_price', 'last_update']] +
+                       [[f"TCK{i:03d}3", float(rng.random() * 100), '18/10/2026 10:00:00'] for i in range(n_market)],
+        'dividend_calendar': [['Ticker', 'Data Ex', 'Data Pagamento', 'Valor', 'Status', 'Atualizado em']] +
+                             [[f"TCK{i:03d}3", '01/11/2026', 'A confirmar', 0.5, 'Anunciado', '18/10/2026 09:00'] for i in range(n_market)],
+        'dividend_history': [["Ticker", "Data Ref", "Data Pagamento", "Valor Unitario", "Qtd na Epoca", "Total Recebido", "Fonte/Data"]] +
+                            [[f"TCK{i % 150:03d}3", d, d, 0.25, 100, 25.0, "BRAPI"] for i, d in enumerate(datas)],
+    }
+
+    with tempfile.TemporaryDirectory() as pasta:
+        t0 = time.perf_counter()
+        for aba, valores in tabelas.items():
+            publicar_snapshot(aba, valores, pasta=pasta)
+        t_publicar = time.perf_counter() - t0
+
+        # Leitura do app: só o parse da matriz (sem contar a rede do Sheets) x memory-map do snapshot
+        t0 = time.perf_counter()
+        via_sheets = {aba: valores_para_df(v) for aba, v in tabelas.items()}
+        t_parse = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        via_snapshot = {aba: ler_snapshot(aba, versao_snapshot(aba, pasta), pasta) for aba in tabelas}
+        t_snapshot = time.perf_counter() - t0
+
+        for aba in tabelas:
+            a, b = via_sheets[aba], via_snapshot[aba]
+            if list(a.columns) != list(b.columns) or len(a) != len(b):
+                raise AssertionError(f"Formato divergente no snapshot de {aba}")
+            for c in a.columns:
+                if not (a[c].astype(str).values == b[c].astype(str).values).all():
+                    raise AssertionError(f"Coluna {c} divergente no snapshot de {aba}")
+
+    linhas = sum(len(v) - 1 for v in tabelas.values())
+    registrar('snapshots', publicacao=t_publicar, leitura=t_snapshot)
+    print(f"--- ⏱️ Snapshots locais ({linhas:,} linhas em {len(tabelas)} abas) ---")
+    print(f"   publicação (jobs):                    {t_publicar * 1000:8.1f} ms")
+    print(f"   parse da matriz do Sheets (sem rede): {t_parse * 1000:8.1f} ms")
+    print(f"   leitura do snapshot (memory-map):     {t_snapshot * 1000:8.1f} ms")
+    print(f"   {'✅' if t_snapshot < 0.1 else '⚠️'} Meta de 100 ms para a carga inicial; conteúdo idêntico ao do Sheets")
+
+# --- BENCHMARK: CÂMBIO HISTÓRICO ---
+def bench_cambio(n=200_000, anos=10):
+    from cambio import fatores_na_data, historico_taxas
+    from carteira import datas_ptbr
+
+    rng = np.random.default_rng(17)
+    datas = pd.bdate_range('2016-01-01', periods=anos * 252)
+    longo = pd.concat([
+        pd.DataFrame({'ticker': par, 'data': datas, 'close': base * np.exp(np.cumsum(rng.normal(0, 0.006, len(datas))))})
+        for par, base in [('USDBRL=X', 3.9), ('EURBRL=X', 4.3)]], ignore_index=True)
+    historico = historico_taxas(longo)
+    taxas = {'USD': 5.4, 'EUR': 6.1}
+    df_tr = pd.DataFrame({
+        'currency': rng.choice(['BRL', 'BRL', 'USD', 'EUR', ''], n),
+        # Algumas transações antes do histórico: usam a taxa spot
+        'date': (pd.Timestamp('2015-06-01') + pd.to_timedelta(rng.integers(0, anos * 370, n), unit='D')).strftime('%d/%m/%Y'),
+    })
+
+    t0 = time.perf_counter()
+    fatores = fatores_na_data(df_tr['currency'], datas_ptbr(df_tr['date']), taxas, historico)
+    t_vet = time.perf_counter() - t0
+
+    # Referência: busca linha a linha da última cotação até a data
+    amostra = df_tr.sample(2_000, random_state=1)
+    t0 = time.perf_counter()
+    for i, row in amostra.iterrows():
+        d = pd.to_datetime(row['date'], dayfirst=True)
+        moeda = row['currency']
+        if moeda in historico.columns:
+            serie = historico[moeda].loc[:d]
+            esperado = serie.iloc[-1] if not serie.empty else taxas[moeda]
+        else:
+            esperado = 1.0
+        if not np.isclose(esperado, fatores[df_tr.index.get_loc(i)]):
+            raise AssertionError(f"Câmbio divergente na linha {i}")
+    t_ref = (time.perf_counter() - t0) / len(amostra) * n
+
+    registrar('cambio', as_of=t_vet)
+    print(f"--- ⏱️ Câmbio na data da transação ({n:,} transações, {len(datas):,} dias, 2 moedas) ---")
+    print(f"   busca linha a linha (estimado): {t_ref * 1000:9.1f} ms")
+    print(f"   as-of vetorizado:               {t_vet * 1000:9.1f} ms")
+    print(f"   ✅ Taxas idênticas à busca direta (amostra de {len(amostra):,} linhas)")
+
+# --- BENCHMARK: HISTÓRICO DE PREÇOS + PATRIMÔNIO DIÁRIO ---
+def gerar_historico_precos(datas, tickers, seed=13):
+    rng = np.random.default_rng(seed)
+    # Passeio aleatório multiplicativo por ticker (matriz datas x tickers)
+    retornos = rng.normal(0.0003, 0.02, (len(datas), len(tickers)))
+    precos = 20.0 * np.exp(np.cumsum(retornos, axis=0))
+    return pd.DataFrame({
+        'ticker': np.tile(np.array(tickers, dtype=object), len(datas)),
+        'data': np.repeat(datas.values, len(tickers)),
+        'close': precos.ravel(),
+        'fonte': 'YAHOO',
+    })
+
+def bench_patrimonio(anos=10, n_tickers=300, n_trans=100_000, lotes_diarios=20):
+    from historico_precos import anexar_precos, ler_precos, matriz_precos, compactar
+    from patrimonio import curva_patrimonio
+
+    datas = pd.bdate_range('2016-01-01', periods=anos * 252)
+    tickers = [f"TCK{i:03d}3" for i in range(n_tickers)]
+    hist = gerar_historico_precos(datas, tickers)
+    rng = np.random.default_rng(21)
+    df_tr = gerar_transacoes(n_trans, n_tickers=n_tickers, anos=anos)
+    df_tr['type'] = rng.choice(['COMPRA', 'COMPRA', 'COMPRA', 'VENDA'], n_trans)
+    df_tr['price'] = rng.random(n_trans) * 50
+    df_tr['date'] = (pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.integers(0, anos * 360, n_trans), unit='D'))
+
+    with tempfile.TemporaryDirectory() as pasta:
+        t0 = time.perf_counter()
+        # Backfill de uma vez + lotes diários do mês corrente (como nas execuções agendadas)
+        corte = datas[-lotes_diarios]
+        anexar_precos(hist[hist['data'] < corte], pasta)
+        for d in datas[-lotes_diarios:]:
+            anexar_precos(hist[hist['data'] == d], pasta)
+        t_anexar = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        lido = ler_precos(pasta)
+        t_ler = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        precos = matriz_precos(lido)
+        t_matriz = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        curva = curva_patrimonio(df_tr, precos)
+        t_curva = time.perf_counter() - t0
+
+        if len(lido) != len(hist):
+            raise AssertionError("Histórico lido difere do gravado")
+        # Compactação não pode mudar o conteúdo lido
+        compactar(pasta, manter_mes_atual=False)
+        if not ler_precos(pasta).equals(lido):
+            raise AssertionError("Compactação alterou o histórico")
+
+    # Referência: patrimônio de alguns dias somando transação a transação
+    matriz = hist.pivot(index='data', columns='ticker', values='close')
+    for dia in datas[[0, len(datas) // 2, -1]]:
+        ate = df_tr[df_tr['date'] <= dia]
+        qtd = ate.groupby('ticker').apply(lambda g: (g['quantity'] * np.where(g['type'].isin(TIPOS_SAIDA), -1, 1)).sum(), include_groups=False).clip(lower=0)
+        esperado = float((qtd * matriz.loc[dia, qtd.index]).sum())
+        if not np.isclose(esperado, curva.loc[dia, 'patrimonio']):
+            raise AssertionError(f"Patrimônio divergente em {dia.date()}: {esperado} x {curva.loc[dia, 'patrimonio']}")
+
+    total = t_ler + t_matriz + t_curva
+    registrar('patrimonio', anexar=t_anexar, ler=t_ler, matriz=t_matriz, curva=t_curva)
+    print(f"--- ⏱️ Patrimônio diário ({len(datas):,} dias x {n_tickers} tickers, {n_trans:,} transações) ---")
+    print(f"   anexar histórico ({lotes_diarios + 1} lotes): {t_anexar * 1000:8.1f} ms")
+    print(f"   ler histórico:              {t_ler * 1000:8.1f} ms")
+    print(f"   matriz de preços:           {t_matriz * 1000:8.1f} ms")
+    print(f"   curva de patrimônio/TWR:    {t_curva * 1000:8.1f} ms")
+    print(f"   {'✅' if total < 1.0 else '⚠️'} Total da leitura ao gráfico: {total * 1000:.1f} ms; patrimônio confere com a soma direta")
+
+# --- BENCHMARK: ETAPAS EM PARALELO COM PRAZO ---
+def bench_agendador():
+    from agendador import Etapa, executar_etapas, relatorio_etapas
+
+    def lenta(segundos, valor):
+        def f(_):
+            time.sleep(segundos)
+            return valor
+        return f
+
+    def yahoo(entradas):
+        time.sleep(0.4)
+        # Fallback só para o que a BRAPI não trouxe (tudo, se ela falhou)
+        return {t: 1.0 for t in ['A', 'B', 'C'] if t not in (entradas['BRAPI'] or {})}
+
+    # Tempos simulados das fontes reais: CVM lenta estoura o prazo e não segura as outras
+    cenarios = [
+        ("normal", 0.3, 2.0),
+        ("BRAPI fora do prazo", 5.0, 2.0),
+    ]
+    for nome, t_brapi, t_cvm in cenarios:
+        etapas = [
+            Etapa('BRAPI', lenta(t_brapi, {'A': 10.0, 'B': 20.0}), 1.0),
+            Etapa('Yahoo', yahoo, 1.0, depende=['BRAPI']),
+            Etapa('CVM', lenta(t_cvm, {'F': 1.5}), 1.2),
+            Etapa('Tesouro', lenta(0.5, {'T': 3000.0}), 1.0),
+        ]
+        sequencial = min(t_brapi, 1.0) + 0.4 + min(t_cvm, 1.2) + 0.5
+        t0 = time.perf_counter()
+        r = executar_etapas(etapas)
+        total = time.perf_counter() - t0
+        registrar('agendador', **{nome.split()[0]: total})
+        print(f"--- ⏱️ Agendador de etapas ({nome}; sequencial seria ~{sequencial:.1f}s) ---")
+        with contextlib.redirect_stdout(io.StringIO()) as saida:
+            relatorio_etapas(r, total)
+        print("\n".join(saida.getvalue().splitlines()[1:]))
+        if r['CVM']['status'] != 'prazo' or r['Tesouro']['status'] != 'ok':
+            raise AssertionError("Status das etapas inesperado")
+        esperado_yahoo = {'C'} if t_brapi < 1.0 else {'A', 'B', 'C'}
+        if set(r['Yahoo']['valor']) != esperado_yahoo:
+            raise AssertionError("Yahoo não recebeu o resultado (ou a falha) da BRAPI")
+        if total > 2.0:
+            raise AssertionError(f"Etapa lenta segurou as demais ({total:.1f}s)")
+    print(f"   ✅ Prazos respeitados; Yahoo cobre o que a BRAPI não entregou")
+
+# --- BENCHMARK: PARTIDA (IMPORTAÇÃO) DOS SCRIPTS E DO APP ---
+# Cada módulo é importado num processo novo com python -X importtime: o tempo
+# acumulado do import tem um orçamento e os pacotes pesados que ele só usa em
+# alguns caminhos (yfinance, gspread, plotly) não podem carregar na partida.
+# SGP_FOLGA_PARTIDA multiplica os orçamentos em máquinas mais lentas (ex: CI).
+PESADOS = ['yfinance', 'gspread', 'google', 'plotly']
+ORCAMENTO_PARTIDA = {  # módulo -> (ms, pacotes que não podem carregar no import)
+    'sgp': (150, PESADOS + ['pandas', 'requests']),
+    'planilhas': (100, PESADOS + ['pandas', 'pyarrow']),
+    'update_funds': (1200, PESADOS),
+    'update_market_data': (1200, PESADOS),
+    'update_prices': (1200, PESADOS),
+    'update_dividends': (1200, PESADOS),
+    'update_dividend_history': (1200, PESADOS),
+}
+# O app é um script do Streamlit (importá-lo roda a página): só o nível de módulo é conferido
+PROIBIDOS_APP = ['gspread', 'google', 'plotly', 'yfinance']
+
+def tempo_importacao(modulo, repeticoes=3):
+    """
+    (menor tempo acumulado do import em s, {pacote de topo: s}) de 'repeticoes' processos
+    com -X importtime. Com modulo=None mede só a partida do interpretador (site, .pth).
+    """
+    import subprocess, sys
+    melhor, pacotes = None, {}
+    for _ in range(repeticoes):
+        r = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {modulo}" if modulo else "pass"], capture_output=True, text=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+        if r.returncode != 0:
+            raise AssertionError(f"import {modulo} falhou: {r.stderr.strip().splitlines()[-1]}")
+        total, carregados = None, {}
+        # Linhas 'import time: self [us] | cumulative | nome', o nome indentado pelo nível
+        for linha in r.stderr.splitlines():
+            campos = linha[len('import time:'):].split('|')
+            if not linha.startswith('import time:') or len(campos) != 3 or not campos[1].strip().isdigit(): continue
+            nome, acumulado = campos[2].strip(), int(campos[1]) / 1e6
+            raiz = nome.split('.')[0]
+            carregados[raiz] = max(carregados.get(raiz, 0.0), acumulado)
+            if nome == modulo: total = acumulado
+        total = total or 0.0
+        if melhor is None or total < melhor:
+            melhor, pacotes = total, carregados
+    return melhor, pacotes
+
+def importacoes_de_modulo(caminho):
+    """Pacotes de topo importados no nível de módulo do arquivo (fora de funções)."""
+    import ast
+    with open(caminho, encoding='utf-8') as f:
+        arvore = ast.parse(f.read())
+    nomes = set()
+    for no in arvore.body:
+        if isinstance(no, ast.Import): nomes.update(a.name.split('.')[0] for a in no.names)
+        elif isinstance(no, ast.ImportFrom) and no.module and not no.level: nomes.add(no.module.split('.')[0])
+    return nomes
+
+def bench_startup(repeticoes=3):
+    folga = float(os.environ.get("SGP_FOLGA_PARTIDA", 1.0))
+    print(f"--- 🚦 Partida: import de cada módulo num processo novo (menor de {repeticoes}) ---")
+    estourados = []
+    _, interpretador = tempo_importacao(None, 1)
+    for modulo, (orcamento, proibidos) in ORCAMENTO_PARTIDA.items():
+        total, pacotes = tempo_importacao(modulo, repeticoes)
+        registrar('startup', **{modulo: total})
+        pacotes = {p: t for p, t in pacotes.items() if p not in interpretador and p != modulo}
+        carregados = [p for p in proibidos if p in pacotes]
+        pesados = sorted(((t, p) for p, t in pacotes.items()), reverse=True)[:3]
+        ok = total * 1000 <= orcamento * folga and not carregados
+        print(f"   {'✅' if ok else '❌'} {modulo:25s} {total * 1000:7.1f} ms (orçamento {orcamento * folga:6.0f} ms) "
+              f"maiores: {', '.join(f'{p} {t * 1000:.0f}' for t, p in pesados)}")
+        if carregados:
+            estourados.append(f"{modulo} carrega {', '.join(carregados)} no import")
+        elif not ok:
+            estourados.append(f"{modulo} levou {total * 1000:.0f} ms (orçamento {orcamento * folga:.0f} ms)")
+    no_app = importacoes_de_modulo(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'))
+    proibidos_app = sorted(no_app & set(PROIBIDOS_APP))
+    print(f"   {'✅' if not proibidos_app else '❌'} app.py: nível de módulo importa {', '.join(sorted(no_app))}")
+    if proibidos_app:
+        estourados.append(f"app.py importa {', '.join(proibidos_app)} no nível de módulo")
+    if estourados:
+        raise AssertionError("Partida acima do orçamento: " + "; ".join(estourados))
+    print(f"   ✅ Todos os módulos dentro do orçamento de partida")
+
+def _commit():
+    import subprocess
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        sujo = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return rev + ('-sujo' if sujo else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'sem-git'
+
+def salvar_resultados(pasta=BENCH_DIR):
+    """Grava RESULTADOS em <commit>.json e ultimo.json; devolve os resultados anteriores (ou None)."""
+    os.makedirs(pasta, exist_ok=True)
+    ultimo = os.path.join(pasta, 'ultimo.json')
+    anterior = None
+    if os.path.exists(ultimo):
+        with open(ultimo, encoding='utf-8') as f:
+            anterior = json.load(f)
+    commit = _commit()
+    # Rodadas parciais (só alguns benchmarks) completam o que já estava gravado
+    for destino in (os.path.join(pasta, f"{commit}.json"), ultimo):
+        resultados = {}
+        if os.path.exists(destino):
+            with open(destino, encoding='utf-8') as f:
+                resultados = json.load(f)['resultados']
+        resultados.update(RESULTADOS)
+        dados = {'commit': commit, 'data': pd.Timestamp.now().isoformat(timespec='seconds'), 'resultados': resultados}
+        with open(destino, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False, indent=1)
+    return anterior
+
+def comparar_resultados(referencia, tolerancia=TOLERANCIA):
+    """Tabela atual x referência; retorna as métricas acima da tolerância."""
+    base = referencia['resultados']
+    comuns = [k for k in RESULTADOS if k in base]
+    print(f"--- 📈 Comparação com {referencia['commit']} ({referencia['data']}) ---")
+    regressoes = []
+    for k in comuns:
+        razao = RESULTADOS[k] / base[k] if base[k] > 0 else 1.0
+        marca = '🔺' if razao > tolerancia else ('🔻' if razao < 1 / tolerancia else '  ')
+        if razao > tolerancia: regressoes.append(k)
+        print(f"   {marca} {k:40s} {base[k] * 1000:9.1f} ms -> {RESULTADOS[k] * 1000:9.1f} ms  ({razao:5.2f}x)")
+    print(f"   {'⚠️ ' + str(len(regressoes)) + ' regressões acima de ' + f'{tolerancia:.2f}x' if regressoes else '✅ Sem regressões'} "
+          f"({len(comuns)} métricas comparadas)")
+    return regressoes
+
+BENCHMARKS = {
+    'posicoes': bench_posicoes, 'livro': bench_livro, 'carteira': bench_carteira, 'fluxo_caixa': bench_fluxo_caixa,
+    'cambio': bench_cambio, 'patrimonio': bench_patrimonio, 'escala': bench_escala,
+    'dividendos': bench_dividendos_concorrente, 'historico_incremental': bench_historico_incremental,
+    'cache_dividendos': bench_cache_dividendos,
+    'cvm': bench_cvm, 'tesouro': bench_tesouro, 'provedores': bench_provedores, 'brapi': bench_brapi, 'telemetria': bench_telemetria, 'agendador': bench_agendador,
+    'planilhas': bench_planilhas, 'snapshots': bench_snapshots, 'update_market_data': bench_update_market_data,
+    'simbolos': bench_simbolos, 'pipeline': bench_pipeline, 'startup': bench_startup,
+}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks dos caminhos quentes do SGP")
+    parser.add_argument("nomes", nargs="*", help=f"Benchmarks a rodar (padrão: todos): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--comparar", metavar="ARQUIVO|COMMIT", help="Compara com um resultado gravado (padrão: a execução anterior)")
+    parser.add_argument("--nao-salvar", action="store_true", help="Não grava os resultados em " + BENCH_DIR)
+    parser.add_argument("--estrito", action="store_true", help="Sai com erro se houver regressão")
+    args = parser.parse_args()
+
+    for nome in args.nomes or BENCHMARKS:
+        BENCHMARKS[nome]()
+
+    referencia = None
+    if args.comparar:
+        caminho = args.comparar if args.comparar.endswith('.json') else os.path.join(BENCH_DIR, f"{args.comparar}.json")
+        with open(caminho, encoding='utf-8') as f:
+            referencia = json.load(f)
+    anterior = None if args.nao_salvar else salvar_resultados()
+    referencia = referencia or anterior
+    if referencia and comparar_resultados(referencia) and args.estrito:
+        raise SystemExit(1)
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from telemetria import contar, registrar_erro
+
+# --- CACHE DE COTAÇÕES ENTRE EXECUÇÕES (TTL POR FONTE) ---
+# As execuções de preço rodam várias vezes ao dia, mas cotas de fundos (CVM) e PUs
+# do Tesouro só mudam uma vez por dia. Cada resultado fica num JSON local com o
+# instante em que foi obtido; até o TTL da fonte ele é usado sem ir à rede. Passado
+# o TTL, dentro da janela de revalidação, o valor velho é entregue na hora e a
+# fonte é consultada em segundo plano (stale-while-revalidate); fora da janela, a
+# consulta é feita antes de responder. Símbolos que a fonte não achou também ficam
+# guardados (valor null) para não repetir a consulta a cada execução.
+
+COTACOES_CACHE_PATH = os.environ.get("SGP_COTACOES_CACHE", os.path.join("cache", "cotacoes.json"))
+
+# (TTL, janela de revalidação) em segundos; sobrescreva com SGP_TTL_<FONTE>
+TTLS = {
+    'BRAPI': (10 * 60, 5 * 60),
+    'YAHOO': (10 * 60, 5 * 60),
+    'CAMBIO': (10 * 60, 5 * 60),
+    'CVM': (20 * 3600, 24 * 3600),
+    'TESOURO': (20 * 3600, 24 * 3600),
+}
+
+def ttl_fonte(fonte):
+    ttl, janela = TTLS.get(fonte, (0, 0))
+    return float(os.environ.get(f"SGP_TTL_{fonte}", ttl)), janela
+
+class CacheCotacoes:
+    def __init__(self, caminho=COTACOES_CACHE_PATH, desligado=False):
+        self.caminho = caminho
+        self.desligado = desligado  # --refresh: consulta tudo, mas grava o resultado
+        self._lock = threading.Lock()
+        self._revalidando = []
+        self.contagem = defaultdict(lambda: [0, 0, 0])  # fonte -> [hits, velhos, misses] desta execução
+        self._dados = {}
+        if os.path.exists(caminho):
+            try:
+                with open(caminho, encoding="utf-8") as f:
+                    self._dados = json.load(f)
+            except (OSError, ValueError) as e:
+                registrar_erro("cache_cotacoes.leitura", e)
+
+    def _guardar(self, fonte, chaves, valores):
+        # Resposta vazia: fonte fora do ar, não vale como "não encontrado"
+        if not valores: return
+        agora = time.time()
+        with self._lock:
+            entradas = self._dados.setdefault(fonte, {})
+            for chave in chaves:
+                entradas[chave] = [valores.get(chave), agora]
+
+    def _revalidar(self, fonte, chaves, buscar):
+        try:
+            self._guardar(fonte, chaves, buscar(chaves))
+        except Exception as e:
+            registrar_erro(f"cache_cotacoes.{fonte}", e)
+
+    def obter(self, fonte, chaves, buscar, revalidar=True):
+        """
+        {chave: valor} de 'chaves' na 'fonte'; 'buscar(lista)' consulta a fonte e devolve
+        {chave: valor} só com o que achou. Chaves sem valor ficam fora da resposta.
+        Com revalidar=False os valores vencidos são consultados antes de responder, como
+        os que faltam (para quem usa mais do que o retorno de buscar, ex: séries da CVM).
+        """
+        chaves = list(dict.fromkeys(chaves))
+        ttl, janela = ttl_fonte(fonte)
+        agora = time.time()
+        with self._lock:
+            entradas = dict(self._dados.get(fonte, {}))
+        frescos, velhos, faltando = [], [], []
+        for chave in chaves:
+            idade = agora - entradas[chave][1] if chave in entradas and not self.desligado else None
+            if idade is not None and idade < ttl: frescos.append(chave)
+            elif idade is not None and idade < ttl + janela and revalidar: velhos.append(chave)
+            else: faltando.append(chave)
+        with self._lock:
+            for i, (tipo, lista) in enumerate([('hit', frescos), ('velho', velhos), ('miss', faltando)]):
+                self.contagem[fonte][i] += len(lista)
+                contar(f"cache_cotacoes.{fonte}.{tipo}", len(lista))
+
+        if velhos:
+            t = threading.Thread(target=self._revalidar, args=(fonte, velhos, buscar), daemon=True, name=f"revalidar-{fonte}")
+            t.start()
+            with self._lock:
+                self._revalidando.append(t)
+        resultado = {c: entradas[c][0] for c in frescos + velhos if entradas[c][0] is not None}
+        if faltando:
+            novos = buscar(faltando)
+            self._guardar(fonte, faltando, novos)
+            resultado.update({c: novos[c] for c in faltando if novos.get(c) is not None})
+        return resultado
+
+    def resumo(self):
+        """Linha 'FONTE hits/velhos/misses' para o log da execução."""
+        return " · ".join(f"{f} {h}/{v}/{m}" for f, (h, v, m) in self.contagem.items())
+
+    def salvar(self, espera=30.0):
+        """Espera as revalidações em segundo plano (até 'espera' s) e grava o arquivo; descarta o que expirou."""
+        limite = time.monotonic() + espera
+        for t in list(self._revalidando):
+            t.join(max(0.0, limite - time.monotonic()))
+        agora = time.time()
+        with self._lock:
+            dados = {}
+            for fonte, entradas in self._dados.items():
+                ttl, janela = ttl_fonte(fonte)
+                dados[fonte] = {k: v for k, v in entradas.items() if agora - v[1] < ttl + janela}
+        pasta = os.path.dirname(self.caminho)
+        if pasta: os.makedirs(pasta, exist_ok=True)
+        with open(self.caminho + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False)
+        os.replace(self.caminho + ".tmp", self.caminho)
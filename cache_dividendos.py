@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+from telemetria import contar
+
+# --- CACHE LOCAL DE PROVENTOS (SQLite) ---
+# Proventos passados não mudam: guardamos a série de cada (provedor, símbolo) e,
+# nas execuções seguintes, pedimos ao provedor apenas o trecho novo (a "cauda").
+
+CACHE_PATH = os.environ.get("DIVIDEND_CACHE", os.path.join("cache", "dividendos.sqlite"))
+TTL = timedelta(hours=float(os.environ.get("DIVIDEND_CACHE_TTL_HORAS", 24)))
+DESPEJO = timedelta(days=float(os.environ.get("DIVIDEND_CACHE_DESPEJO_DIAS", 365)))
+
+class CacheDividendos:
+    def __init__(self, caminho=CACHE_PATH, ttl=TTL):
+        pasta = os.path.dirname(caminho)
+        if pasta: os.makedirs(pasta, exist_ok=True)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS proventos (
+                provedor TEXT, simbolo TEXT, data TEXT, valor REAL,
+                PRIMARY KEY (provedor, simbolo, data)
+            );
+            CREATE TABLE IF NOT EXISTS consultas (
+                provedor TEXT, simbolo TEXT, consultado_em TEXT,
+                PRIMARY KEY (provedor, simbolo)
+            );
+        """)
+
+    def ler(self, provedor, simbolo):
+        """Retorna (serie ou None, datetime da última consulta ou None)."""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT consultado_em FROM consultas WHERE provedor = ? AND simbolo = ?",
+                (provedor, simbolo)).fetchone()
+            if not linha: return None, None
+            dados = self._conn.execute(
+                "SELECT data, valor FROM proventos WHERE provedor = ? AND simbolo = ? ORDER BY data",
+                (provedor, simbolo)).fetchall()
+        consultado_em = datetime.fromisoformat(linha[0])
+        if not dados: return None, consultado_em
+        serie = pd.Series([v for _, v in dados], index=pd.to_datetime([d for d, _ in dados]), dtype=float)
+        return serie, consultado_em
+
+    def gravar(self, provedor, simbolo, serie, substituir=False):
+        """Mescla 'serie' no cache (datas novas sobrescrevem) e marca a consulta como feita agora."""
+        linhas = [] if serie is None else [(provedor, simbolo, d.strftime('%Y-%m-%d'), float(v)) for d, v in serie.items()]
+        with self._lock, self._conn:
+            if substituir:
+                self._conn.execute("DELETE FROM proventos WHERE provedor = ? AND simbolo = ?", (provedor, simbolo))
+            self._conn.executemany("INSERT OR REPLACE INTO proventos VALUES (?, ?, ?, ?)", linhas)
+            self._conn.execute("INSERT OR REPLACE INTO consultas VALUES (?, ?, ?)",
+                               (provedor, simbolo, datetime.now().isoformat(timespec='seconds')))
+
+    def despejar(self, idade_maxima=DESPEJO):
+        """Remove símbolos que não são consultados há mais de 'idade_maxima' (ex: deslistados)."""
+        limite = (datetime.now() - idade_maxima).isoformat(timespec='seconds')
+        with self._lock, self._conn:
+            velhos = self._conn.execute("SELECT provedor, simbolo FROM consultas WHERE consultado_em < ?", (limite,)).fetchall()
+            for provedor, simbolo in velhos:
+                self._conn.execute("DELETE FROM proventos WHERE provedor = ? AND simbolo = ?", (provedor, simbolo))
+                self._conn.execute("DELETE FROM consultas WHERE provedor = ? AND simbolo = ?", (provedor, simbolo))
+        return len(velhos)
+
+    def obter(self, provedor, simbolo, buscar, refresh=False, offline=False):
+        """
+        Série de proventos de (provedor, símbolo) usando o cache sempre que possível.
+        'buscar(desde)' consulta o provedor; desde=None significa histórico completo.
+        - offline: nunca vai à rede, devolve o que houver no cache.
+        - refresh: ignora o cache e baixa o histórico completo.
+        """
+        serie, consultado_em = (None, None) if refresh else self.ler(provedor, simbolo)
+        if offline:
+            contar("cache_dividendos.offline")
+            return serie
+        if consultado_em and datetime.now() - consultado_em < self.ttl:
+            contar("cache_dividendos.hit")
+            return serie
+        contar("cache_dividendos.cauda" if consultado_em else "cache_dividendos.miss")
+
+        desde = serie.index.max() if serie is not None else None
+        nova = buscar(desde)
+        if nova is None:
+            if serie is None:
+                # Registra o "miss" para não repetir a consulta completa antes do TTL
+                self.gravar(provedor, simbolo, None, substituir=refresh)
+            return serie
+
+        nova = nova.groupby(level=0).sum()
+        self.gravar(provedor, simbolo, nova, substituir=refresh or desde is None)
+        if serie is None: return nova if not nova.empty else None
+        return nova.combine_first(serie).sort_index()
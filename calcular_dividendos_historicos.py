@@ -1,48 +1,36 @@
 import pandas as pd
-import yfinance as yf
+import argparse
 from datetime import timedelta
 import time
+from posicoes import construir_posicoes, quantidades_nas_datas, tickers_atuais
+from provedores import dividendos_yahoo
+from cache_dividendos import CacheDividendos
+from simbolos import Resolvedor
 
 # --- CONFIGURAÇÕES ---
 ARQUIVO_TRANSACOES = 'transactions_final_eventos.csv'
 ARQUIVO_SAIDA = 'dividend_history_final.csv'
 
-# Mapeamento de Tickers (Caso o Yahoo use sufixo .SA)
-def normalizar_ticker_yahoo(ticker):
-    ticker = str(ticker).upper().strip()
-    if ticker.endswith('11') or ticker.endswith('3') or ticker.endswith('4') or ticker.endswith('5') or ticker.endswith('6'):
-        if not ticker.endswith('.SA'):
-            return f"{ticker}.SA"
-    return ticker
-
-# --- FUNÇÃO: SALDO NA DATA (MÁQUINA DO TEMPO) ---
-def calcular_quantidade_na_data(df, ticker, data_corte):
+# --- PROVENTOS (CACHE LOCAL -> YAHOO) ---
+def obter_dividendos(cache, resolvedor, ticker, offline=False, refresh=False):
     """
-    Calcula quantas ações o usuário tinha EXATAMENTE no final do dia 'data_corte'.
+    Série de proventos indexada pela Data Ex. No modo offline usa apenas o cache;
+    se o Yahoo nunca foi consultado para o ativo, aproveita a série da BRAPI gravada
+    pela auditoria (indexada pela Data Com, por isso +1 dia). Símbolos de cada fonte
+    vêm do 'resolvedor', os mesmos com que a auditoria grava o cache.
     """
-    # Filtrar transações deste ticker até a data de corte (inclusive)
-    mask = (df['ticker'] == ticker) & (df['date'] <= data_corte)
-    transacoes = df[mask]
-    
-    if transacoes.empty:
-        return 0
-    
-    qtd = 0.0
-    for _, row in transacoes.iterrows():
-        q = float(row['quantity'])
-        t = row['type'].upper()
-        
-        # Entradas
-        if t in ['COMPRA', 'BONIFICACAO', 'DESDOBRAMENTO']:
-            qtd += q
-        # Saídas
-        elif t in ['VENDA', 'AGRUPAMENTO']:
-            qtd -= q
-            
-    return max(0.0, qtd)
+    ticker_y = resolvedor.yahoo(ticker)
+    divs = cache.obter("YAHOO", ticker_y, lambda desde: dividendos_yahoo(ticker_y, desde), refresh=refresh, offline=offline)
+    if divs is None and offline and resolvedor.brapi(ticker):
+        divs = cache.obter("BRAPI", resolvedor.brapi(ticker), None, offline=True)
+        if divs is not None:
+            divs.index = divs.index + timedelta(days=1)
+    return divs
 
-def main():
+def main(offline=False, refresh=False):
     print("--- 💰 INICIANDO CÁLCULO DE DIVIDENDOS HISTÓRICOS ---")
+    if offline: print("📦 Modo offline: usando apenas o cache local de proventos.")
+    cache = CacheDividendos()
     
     # 1. Carregar Transações
     try:
@@ -55,7 +43,11 @@ def main():
             df_trans[c] = df_trans[c].astype(str).str.replace('"', '').str.replace('.', '').str.replace(',', '.').astype(float)
             
         df_trans['date'] = pd.to_datetime(df_trans['date'])
+        # Ticker vigente (RENAME_MAP): proventos antes e depois da troca caem na mesma posição
+        df_trans['ticker'] = tickers_atuais(df_trans['ticker'])
         tickers_unicos = df_trans['ticker'].unique()
+        # Máquina do tempo: saldo acumulado por ticker calculado uma única vez
+        posicoes = construir_posicoes(df_trans)
         print(f"📂 Transações carregadas. {len(tickers_unicos)} ativos identificados no histórico.")
         
     except Exception as e:
@@ -63,6 +55,8 @@ def main():
         return
 
     historico_recebimentos = []
+    # Sem a aba assets: símbolo Yahoo inferido pelo formato do ticker (ver simbolos.py)
+    resolvedor = Resolvedor()
 
     # 2. Loop por Ativo
     for ticker in tickers_unicos:
@@ -72,35 +66,32 @@ def main():
             
         print(f"\n🔍 Analisando proventos de: {ticker}...")
         
-        ticker_y = normalizar_ticker_yahoo(ticker)
+        ticker_y = resolvedor.yahoo(ticker)
+        if not ticker_y:
+            print(f"   -> Sem cotação em bolsa, ignorado.")
+            continue
         
         try:
-            # Baixar dados do Yahoo
-            stock = yf.Ticker(ticker_y)
-            divs = stock.dividends
+            # Baixar dados do Yahoo (ou ler do cache local)
+            divs = obter_dividendos(cache, resolvedor, ticker, offline, refresh)
             
-            if divs.empty:
+            if divs is None or divs.empty:
                 print(f"   -> Sem histórico de dividendos no Yahoo.")
                 continue
             
-            # Converter timezone se necessário para remover info de fuso
-            divs.index = divs.index.tz_localize(None)
-            
             # 3. Cruzar com a Posição do Usuário
             count_recebimentos = 0
             total_ativo = 0.0
             
-            for data_ex, valor_por_acao in divs.items():
-                # A "Data Com" geralmente é o dia anterior à Data Ex. 
-                # Se eu tinha a ação no dia anterior à Ex, eu recebo.
-                # Mas para simplificar e ser seguro: Calculamos o saldo na própria Data Ex.
-                # Se a compra foi NA data Ex, não recebe. Se foi antes, recebe.
-                # Então calculamos o saldo no dia ANTERIOR à data Ex.
-                
-                data_com = data_ex - timedelta(days=1)
-                
-                qtd_possuida = calcular_quantidade_na_data(df_trans, ticker, data_com)
-                
+            # A "Data Com" geralmente é o dia anterior à Data Ex. 
+            # Se eu tinha a ação no dia anterior à Ex, eu recebo.
+            # Mas para simplificar e ser seguro: Calculamos o saldo na própria Data Ex.
+            # Se a compra foi NA data Ex, não recebe. Se foi antes, recebe.
+            # Então calculamos o saldo no dia ANTERIOR à data Ex (todas as datas de uma vez).
+            datas_com = divs.index - timedelta(days=1)
+            qtds = quantidades_nas_datas(posicoes, ticker, datas_com)
+            
+            for data_ex, valor_por_acao, qtd_possuida in zip(divs.index, divs.values, qtds):
                 if qtd_possuida > 0:
                     valor_total = qtd_possuida * valor_por_acao
                     
@@ -146,4 +137,8 @@ def main():
         print("\n❌ Nenhum dividendo encontrado com base no histórico.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Cálculo de dividendos históricos a partir do CSV de transações")
+    parser.add_argument("--offline", action="store_true", help="Não acessa a rede; usa só o cache de proventos")
+    parser.add_argument("--refresh", action="store_true", help="Ignora o cache local e baixa o histórico completo")
+    args = parser.parse_args()
+    main(offline=args.offline, refresh=args.refresh)
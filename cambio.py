@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# --- CÂMBIO (SPOT + HISTÓRICO DIÁRIO) ---
+# As cotações de câmbio são tickers "XXXBRL=X" como qualquer outro: a última fica
+# na market_data e a série diária no histórico de preços (historico_precos.py).
+# Aqui ficam as conversões vetorizadas: posições pela taxa spot e transações pela
+# taxa do dia da operação (as-of: último dia com cotação até a data).
+
+MOEDA_BASE = 'BRL'
+SUFIXO = f"{MOEDA_BASE}=X"
+TAXAS_PADRAO = {'USD': 5.00}
+
+def simbolo_cambio(moeda):
+    return f"{str(moeda).strip().upper()}{SUFIXO}"
+
+def moeda_do_simbolo(simbolo):
+    """'USDBRL=X' -> 'USD'; None se não for um par contra o real."""
+    s = str(simbolo).strip().upper()
+    return s[:-len(SUFIXO)] if s.endswith(SUFIXO) and len(s) > len(SUFIXO) else None
+
+def _moedas(moedas):
+    return pd.Series(moedas).fillna('').astype(str).str.strip().str.upper().values
+
+def moedas_estrangeiras(moedas):
+    return sorted(m for m in set(_moedas(moedas)) if m and m != MOEDA_BASE)
+
+def taxas_spot(df_mk, padrao=TAXAS_PADRAO):
+    """{moeda: cotação em BRL} a partir das linhas XXXBRL=X da market_data."""
+    taxas = dict(padrao)
+    for ticker, valor in zip(df_mk['ticker'], pd.to_numeric(df_mk['close_price'], errors='coerce')):
+        moeda = moeda_do_simbolo(ticker)
+        if moeda and pd.notna(valor) and valor > 0:
+            taxas[moeda] = float(valor)
+    return taxas
+
+def fatores_spot(moedas, taxas):
+    """Fator para BRL por linha: taxa spot da moeda; 1.0 para BRL, vazio ou moeda sem cotação."""
+    m = _moedas(moedas)
+    fator = np.ones(len(m))
+    for moeda, taxa in taxas.items():
+        fator[m == moeda] = taxa
+    return fator
+
+def historico_taxas(precos):
+    """
+    Tabela datas x moeda a partir do histórico de preços, longo (ticker/data/close)
+    ou já em matriz (datas x tickers). Só entram as colunas XXXBRL=X.
+    """
+    if 'ticker' in precos.columns:
+        fx = precos[precos['ticker'].map(moeda_do_simbolo).notna()]
+        if fx.empty: return pd.DataFrame()
+        precos = fx.pivot(index='data', columns='ticker', values='close')
+    colunas = {c: moeda_do_simbolo(c) for c in precos.columns if moeda_do_simbolo(c)}
+    return precos[list(colunas)].rename(columns=colunas).sort_index()
+
+def fatores_na_data(moedas, datas, taxas, historico=None):
+    """
+    Fator para BRL por linha pela taxa da própria data (as-of, sem olhar o futuro).
+    Linhas anteriores ao histórico, ou sem histórico da moeda, usam a taxa spot.
+    Textos em 'datas' são lidos com dayfirst; passe datas já convertidas (ver
+    carteira.datas_ptbr) para não repetir a conversão.
+    """
+    m = _moedas(moedas)
+    fator = fatores_spot(m, taxas)
+    if historico is None or historico.empty: return fator
+    d = pd.to_datetime(pd.Series(datas), dayfirst=True, errors='coerce').values.astype('datetime64[ns]')
+    for moeda in historico.columns:
+        sel = np.flatnonzero(m == moeda)
+        if not len(sel): continue
+        serie = historico[moeda].dropna()
+        # Um searchsorted por moeda: posição do último dia cotado <= data da linha
+        idx = serie.index.values.astype('datetime64[ns]').searchsorted(d[sel], side='right') - 1
+        ok = (idx >= 0) & ~np.isnat(d[sel])
+        fator[sel[ok]] = serie.values[idx[ok]]
+    return fator
+
+def taxas_nas_datas(datas, taxas, historico=None):
+    """Tabela datas x moeda (ffill do histórico, spot onde ainda não há cotação)."""
+    datas = pd.DatetimeIndex(datas)
+    if historico is None or historico.empty:
+        tabela = pd.DataFrame(index=datas)
+    else:
+        tabela = historico.reindex(historico.index.union(datas)).ffill().reindex(datas)
+    for moeda, taxa in taxas.items():
+        tabela[moeda] = tabela[moeda].fillna(taxa) if moeda in tabela.columns else taxa
+    return tabela
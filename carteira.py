@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from cambio import fatores_spot, fatores_na_data
+
+# --- AVALIAÇÃO DA CARTEIRA (VETORIZADA) ---
+# Mesmas regras que o app aplicava linha a linha com apply/lambda, agora em
+# operações de coluna do pandas/NumPy.
+
+def numeros_ptbr(serie):
+    """
+    Versão vetorizada do clean_num: aceita números ou textos PT-BR ("1.234,56").
+    Vazio, "-" ou texto inválido viram 0.0.
+    """
+    serie = pd.Series(serie)
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float).fillna(0.0)
+    # Normaliza tudo como texto e converte numa única passada (to_numeric é lento
+    # quando precisa descartar muitos textos inválidos)
+    texto = serie.astype(str).str.replace('"', '', regex=False).str.strip()
+    tem_virgula = texto.str.contains(',', regex=False)
+    texto = texto.where(~tem_virgula, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(texto, errors='coerce').fillna(0.0).astype(float)
+
+def datas_ptbr(serie):
+    """
+    pd.to_datetime(dayfirst=True) que converte cada texto distinto uma única vez
+    (o livro de transações repete muito as mesmas datas). Inválidas viram NaT.
+    """
+    serie = pd.Series(serie)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype('datetime64[ns]')
+    codigos, unicos = pd.factorize(serie)
+    convertidas = pd.to_datetime(pd.Series(unicos, dtype=object), dayfirst=True, errors='coerce').values.astype('datetime64[ns]')
+    return pd.Series(np.where(codigos >= 0, convertidas[codigos], np.datetime64('NaT')), index=serie.index)
+
+def avaliar_carteira(df_tr, df_mk, df_as, taxas, historico=None):
+    """
+    Posição atual, custo médio e valor em BRL por ticker vigente (ver posicoes.Livro).
+    Espera quantity/price/close_price já numéricos (ver numeros_ptbr). Acrescenta
+    custo_total e qtd_ajustada em df_tr. 'taxas' são as cotações spot por moeda e
+    'historico' a tabela diária de câmbio (ver cambio.py): o custo usa a taxa do dia
+    da transação, o valor atual a spot.
+    """
+    from posicoes import Livro, sinal_quantidade, tickers_atuais
+
+    moeda_tr = df_tr['currency'] if 'currency' in df_tr.columns else pd.Series('', index=df_tr.index)
+    data_tr = datas_ptbr(df_tr['date'] if 'date' in df_tr.columns else pd.Series(pd.NaT, index=df_tr.index))
+    fatores = fatores_na_data(moeda_tr, data_tr, taxas, historico)
+    df_tr['custo_total'] = df_tr['quantity'].values * df_tr['price'].values * fatores
+    df_tr['qtd_ajustada'] = df_tr['quantity'].values * sinal_quantidade(df_tr['type'])
+
+    foto = Livro(df_tr, fatores, datas_tr=data_tr).fotografia()
+    resumo = foto[foto['quantidade'] > 0].rename(columns={'quantidade': 'qtd_ajustada'}) # Apenas carteira atual
+    resumo = resumo[['ticker', 'qtd_ajustada', 'custo_total', 'preco_medio', 'realizado']].reset_index(drop=True)
+
+    # Merge com Cotações e com Cadastro (para saber moeda e tipo) pelo ticker vigente;
+    # se o ticker antigo e o novo aparecem, vale a linha do novo
+    def _por_ticker_atual(df, colunas):
+        df = df[['ticker'] + colunas].assign(_atual=tickers_atuais(df['ticker']).values)
+        df = df.assign(_exato=df['ticker'].astype(str).str.strip().str.upper() == df['_atual'])
+        df = df.sort_values('_exato', ascending=False, kind='mergesort').drop_duplicates('_atual')
+        return df.drop(columns=['ticker', '_exato']).rename(columns={'_atual': 'ticker'})
+    resumo = resumo.merge(_por_ticker_atual(df_mk, ['close_price']), on='ticker', how='left')
+    resumo = resumo.merge(_por_ticker_atual(df_as, ['type', 'currency']), on='ticker', how='left')
+
+    resumo['valor_atual_brl'] = resumo['qtd_ajustada'] * resumo['close_price'] * fatores_spot(resumo['currency'], taxas)
+    return resumo
@@ -0,0 +1,141 @@
+import os
+import json
+import sqlite3
+import tempfile
+import zipfile
+import pandas as pd
+import requests
+from provedores import cliente
+from telemetria import contar
+
+# --- INGESTÃO CVM (INF_DIARIO) EM STREAMING ---
+# O zip mensal da CVM traz todas as colunas de todos os fundos. Aqui o arquivo é
+# baixado direto para o disco, o CSV interno é lido em pedaços só com as colunas
+# de CNPJ, data e cota, e apenas os CNPJs pedidos ficam em memória. O resultado
+# vira um índice local por mês; enquanto a CVM responder 304 (ETag/Last-Modified)
+# o download é pulado.
+
+CVM_INDEX_PATH = os.environ.get("CVM_INDEX", os.path.join("cache", "cvm.sqlite"))
+COLUNAS_CNPJ = ['CNPJ_FUNDO_CLASSE', 'CNPJ_FUNDO']
+CHUNK_LINHAS = 200_000
+
+def normalizar_cnpj(serie):
+    return serie.astype(str).str.replace(r'\D', '', regex=True).str.zfill(14)
+
+def _conectar(caminho):
+    pasta = os.path.dirname(caminho)
+    if pasta: os.makedirs(pasta, exist_ok=True)
+    conn = sqlite3.connect(caminho)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS cotas (
+            arquivo TEXT, cnpj TEXT, data TEXT, quota REAL,
+            PRIMARY KEY (arquivo, cnpj, data)
+        );
+        CREATE TABLE IF NOT EXISTS arquivos (
+            arquivo TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, cnpjs TEXT
+        );
+    """)
+    return conn
+
+def _ler_indice(conn, arquivo, cnpjs):
+    dados = conn.execute(
+        f"SELECT cnpj, data, quota FROM cotas WHERE arquivo = ? AND cnpj IN ({','.join('?' * len(cnpjs))})",
+        [arquivo] + sorted(cnpjs)).fetchall()
+    df = pd.DataFrame(dados, columns=['cnpj', 'data', 'quota'])
+    df['data'] = pd.to_datetime(df['data'])
+    return df.sort_values(['cnpj', 'data'], ignore_index=True)
+
+def _gravar_indice(conn, arquivo, df, cnpjs, etag, last_modified):
+    with conn:
+        conn.execute("DELETE FROM cotas WHERE arquivo = ?", (arquivo,))
+        conn.executemany("INSERT OR REPLACE INTO cotas VALUES (?, ?, ?, ?)",
+                         [(arquivo, c, d.strftime('%Y-%m-%d'), float(q)) for c, d, q in df.itertuples(index=False)])
+        conn.execute("INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?)",
+                     (arquivo, etag, last_modified, json.dumps(sorted(cnpjs))))
+
+def ler_zip_cvm(caminho_zip, cnpjs, chunksize=CHUNK_LINHAS):
+    """Lê o CSV de dentro do zip em pedaços, mantendo só cnpj/data/quota dos CNPJs pedidos."""
+    with zipfile.ZipFile(caminho_zip) as zf:
+        membro = next(n for n in zf.namelist() if n.lower().endswith('.csv'))
+        with zf.open(membro) as f:
+            cabecalho = f.readline().decode('latin1').strip().split(';')
+        col_cnpj = next((c for c in COLUNAS_CNPJ if c in cabecalho), None)
+        if col_cnpj is None:
+            raise ValueError("Coluna de CNPJ não encontrada")
+
+        partes = []
+        with zf.open(membro) as f:
+            leitor = pd.read_csv(f, sep=';', encoding='latin1', dtype=str, chunksize=chunksize,
+                                 usecols=[col_cnpj, 'DT_COMPTC', 'VL_QUOTA'])
+            for chunk in leitor:
+                chunk['cnpj'] = normalizar_cnpj(chunk[col_cnpj])
+                chunk = chunk[chunk['cnpj'].isin(cnpjs)]
+                if not chunk.empty:
+                    partes.append(chunk[['cnpj', 'DT_COMPTC', 'VL_QUOTA']])
+
+    if not partes:
+        return pd.DataFrame({'cnpj': pd.Series(dtype=str), 'data': pd.Series(dtype='datetime64[ns]'), 'quota': pd.Series(dtype=float)})
+    df = pd.concat(partes, ignore_index=True)
+    df = pd.DataFrame({
+        'cnpj': df['cnpj'],
+        'data': pd.to_datetime(df['DT_COMPTC'], errors='coerce'),
+        'quota': pd.to_numeric(df['VL_QUOTA'], errors='coerce'),
+    }).dropna()
+    return df.drop_duplicates(['cnpj', 'data'], keep='last').sort_values(['cnpj', 'data'], ignore_index=True)
+
+def cotas_cvm(url, cnpjs, timeout=90, caminho_indice=CVM_INDEX_PATH):
+    """
+    Cotas diárias (DataFrame cnpj/data/quota) dos 'cnpjs' no arquivo mensal 'url'.
+    Usa o índice local quando a CVM responde 304; retorna None se o mês estiver indisponível.
+    """
+    cnpjs = set(cnpjs)
+    if not cnpjs: return None
+    arquivo = url.rsplit('/', 1)[-1]
+    conn = _conectar(caminho_indice)
+    try:
+        meta = conn.execute("SELECT etag, last_modified, cnpjs FROM arquivos WHERE arquivo = ?", (arquivo,)).fetchone()
+        cobertos = set(json.loads(meta[2])) if meta else set()
+        indice_serve = bool(meta) and cnpjs <= cobertos
+
+        headers = {}
+        if indice_serve:
+            if meta[0]: headers['If-None-Match'] = meta[0]
+            if meta[1]: headers['If-Modified-Since'] = meta[1]
+
+        try:
+            resp = cliente("CVM").get(url, headers=headers, timeout=timeout, stream=True)
+        except requests.RequestException:
+            # Sem rede: um índice antigo ainda é melhor que nada
+            contar("CVM.offline")
+            return _ler_indice(conn, arquivo, cnpjs) if indice_serve else None
+
+        with resp:
+            if resp.status_code == 304 and indice_serve:
+                print(f"   Índice local de {arquivo} ainda válido (304).")
+                contar("CVM.indice_304")
+                return _ler_indice(conn, arquivo, cnpjs)
+            if resp.status_code != 200:
+                return _ler_indice(conn, arquivo, cnpjs) if indice_serve else None
+
+            with tempfile.TemporaryDirectory() as pasta:
+                caminho_zip = os.path.join(pasta, arquivo)
+                with open(caminho_zip, 'wb') as f:
+                    for bloco in resp.iter_content(chunk_size=1 << 20):
+                        f.write(bloco)
+                if os.path.getsize(caminho_zip) < 1000:
+                    print(f"   Arquivo CVM {arquivo} muito pequeno. Ignorando.")
+                    return None
+                # Mantém no índice também os CNPJs de consultas anteriores
+                todos = cnpjs | cobertos
+                contar("CVM.download")
+                df = ler_zip_cvm(caminho_zip, todos)
+
+        _gravar_indice(conn, arquivo, df, todos, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        return df[df['cnpj'].isin(cnpjs)].reset_index(drop=True)
+    finally:
+        conn.close()
+
+def ultimas_cotas(df):
+    """{cnpj: cota mais recente} a partir do resultado de cotas_cvm."""
+    if df is None or df.empty: return {}
+    return df.sort_values('data').drop_duplicates('cnpj', keep='last').set_index('cnpj')['quota'].to_dict()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from carteira import numeros_ptbr, datas_ptbr
+from cambio import fatores_na_data
+
+# --- FLUXO DE CAIXA (VETORIZADO) ---
+# As datas e valores são tratados uma única vez em eventos_caixa(); a linha do
+# tempo em qualquer resolução (semana, mês, trimestre, ano) sai só de um groupby.
+
+RESOLUCOES = {"Semanal": "W", "Mensal": "M", "Trimestral": "Q", "Anual": "Y"}
+
+def _coluna(df, *nomes):
+    for n in nomes:
+        if n in df.columns: return df[n]
+    raise KeyError(nomes[0])
+
+def eventos_caixa(df_tr, df_hist, taxas=None, historico=None):
+    """
+    DataFrame [data, movimentacao, proventos] com um evento por transação/provento.
+    COMPRA = saída de caixa (negativo), VENDA = entrada (positivo), demais tipos = 0.
+    Espera quantity/price já numéricos em df_tr. Com 'taxas' (e opcionalmente o
+    'historico' de câmbio), transações em moeda estrangeira viram BRL pela taxa do dia.
+    """
+    tipos = df_tr['type'].astype(str).str.upper().values
+    sinal = np.select([tipos == 'COMPRA', tipos == 'VENDA'], [-1.0, 1.0], default=0.0)
+    datas_tr = datas_ptbr(df_tr['date'])
+    if taxas is not None and 'currency' in df_tr.columns:
+        sinal = sinal * fatores_na_data(df_tr['currency'], datas_tr, taxas, historico)
+    mov = pd.DataFrame({
+        'data': datas_tr.values,
+        'movimentacao': df_tr['quantity'].values * df_tr['price'].values * sinal,
+        'proventos': 0.0,
+    })
+
+    # Limpar nomes das colunas (remover espaços extras e minúsculas)
+    divs = df_hist.copy()
+    divs.columns = [str(c).lower().strip() for c in divs.columns]
+    if divs.empty:
+        return mov
+    # Usar 'data ex' (ou 'data ref', na aba gerada pela auditoria) como data aproximada de recebimento
+    prov = pd.DataFrame({
+        'data': datas_ptbr(_coluna(divs, 'data ex', 'data ref')).values,
+        'movimentacao': 0.0,
+        'proventos': numeros_ptbr(divs['total recebido']).values,
+    })
+    return pd.concat([mov, prov], ignore_index=True)
+
+def linha_do_tempo(eventos, freq="M"):
+    """Movimentação/Proventos/Liquido agrupados por período ('W', 'M', 'Q' ou 'Y')."""
+    validos = eventos[eventos['data'].notna()]
+    periodo = validos['data'].dt.to_period(freq)
+    timeline = validos.groupby(periodo)[['movimentacao', 'proventos']].sum()
+    timeline.columns = ['Movimentação', 'Proventos']
+    timeline['Liquido'] = timeline['Movimentação'] + timeline['Proventos']
+    timeline.index = timeline.index.astype(str)
+    return timeline
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+# --- ESTADO DO HISTÓRICO DE DIVIDENDOS (RECÁLCULO INCREMENTAL) ---
+# As linhas da aba dividend_history de cada ticker só mudam quando as transações
+# dele mudam ou quando o provedor traz um provento novo. Para cada ticker ficam
+# guardadas a assinatura das transações, a marca d'água (última data com vista
+# no provedor e a fonte) e as linhas calculadas; a execução seguinte recalcula só
+# os tickers cuja assinatura ou marca mudou e reaproveita o resto.
+
+ESTADO_PATH = os.environ.get("DIVIDEND_HISTORY_STATE", os.path.join("cache", "historico_dividendos.sqlite"))
+# Versão do formato das linhas guardadas; estado de outra versão é descartado
+# (v2: Fonte/Data traz a data do provento mais recente, não a da execução)
+VERSAO_LINHAS = 2
+
+class EstadoHistorico:
+    def __init__(self, caminho=ESTADO_PATH):
+        pasta = os.path.dirname(caminho)
+        if pasta: os.makedirs(pasta, exist_ok=True)
+        self._conn = sqlite3.connect(caminho)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tickers (
+                ticker TEXT PRIMARY KEY, assinatura TEXT, marca TEXT, fonte TEXT
+            );
+            CREATE TABLE IF NOT EXISTS linhas (
+                ticker TEXT, seq INTEGER, simbolo TEXT, data_ref TEXT, pagamento TEXT,
+                valor REAL, quantidade REAL, total REAL, fonte_data TEXT,
+                PRIMARY KEY (ticker, seq)
+            );
+        """)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != VERSAO_LINHAS:
+            with self._conn:
+                self._conn.execute("DELETE FROM tickers")
+                self._conn.execute("DELETE FROM linhas")
+            self._conn.execute(f"PRAGMA user_version = {VERSAO_LINHAS}")
+
+    def fechar(self):
+        self._conn.close()
+
+    def marcas(self):
+        """{ticker: (assinatura, marca, fonte)} do último processamento."""
+        return {t: (a, m, f) for t, a, m, f in self._conn.execute("SELECT ticker, assinatura, marca, fonte FROM tickers")}
+
+    def atualizar(self, entradas, manter=None, limpar=False):
+        """
+        Regrava os tickers de 'entradas' ({ticker: (assinatura, marca, fonte, linhas)}) numa
+        única transação. Tickers fora de 'manter' são removidos; 'limpar' apaga tudo antes.
+        """
+        with self._conn:
+            if limpar:
+                self._conn.execute("DELETE FROM tickers")
+                self._conn.execute("DELETE FROM linhas")
+            elif manter is not None:
+                fora = [(t,) for t in self.marcas() if t not in set(manter)]
+                self._conn.executemany("DELETE FROM tickers WHERE ticker = ?", fora)
+                self._conn.executemany("DELETE FROM linhas WHERE ticker = ?", fora)
+            for ticker, (assinatura, marca, fonte, linhas) in entradas.items():
+                self._conn.execute("INSERT OR REPLACE INTO tickers VALUES (?, ?, ?, ?)", (ticker, assinatura, marca, fonte))
+                self._conn.execute("DELETE FROM linhas WHERE ticker = ?", (ticker,))
+                self._conn.executemany("INSERT INTO linhas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       [(ticker, i, *linha) for i, linha in enumerate(linhas)])
+
+    def linhas(self, tickers):
+        """Linhas guardadas, na ordem de 'tickers' e, dentro de cada ticker, na ordem calculada."""
+        por_ticker = {}
+        for linha in self._conn.execute("SELECT ticker, simbolo, data_ref, pagamento, valor, quantidade, total, fonte_data FROM linhas ORDER BY ticker, seq"):
+            por_ticker.setdefault(linha[0], []).append(list(linha[1:]))
+        return [linha for t in tickers for linha in por_ticker.get(t, [])]
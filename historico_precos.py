@@ -0,0 +1,114 @@
+import os
+import datetime
+import pandas as pd
+
+# --- HISTÓRICO DE PREÇOS (APPEND-ONLY, PARTICIONADO POR MÊS) ---
+# Cada execução do update_market_data acrescenta os fechamentos do dia como um
+# arquivo Arrow novo dentro da partição do mês (PRECOS_DIR/mes=AAAA-MM/). Nada é
+# reescrito: na leitura, o registro mais recente de cada (ticker, data) vence.
+# compactar() junta os arquivos de cada mês num só, sem mudar o conteúdo lido.
+#
+# Escopo local: o histórico fica só na máquina que roda o update_market_data. No
+# GitHub Actions ele vai para o actions/cache e para o artefato "snapshots-market";
+# o dashboard publicado (Streamlit Cloud) não o recebe. Para ter a página Evolução,
+# rode o app na mesma máquina dos scripts ou extraia o artefato em cache/ (ou aponte
+# SGP_PRECOS para a pasta). Sem histórico, o app esconde a página.
+
+PRECOS_DIR = os.environ.get("SGP_PRECOS", os.path.join("cache", "precos"))
+COLUNAS = ['ticker', 'data', 'close', 'fonte']
+
+def _normalizar(df):
+    df = pd.DataFrame({
+        'ticker': df['ticker'].astype(str).str.strip(),
+        'data': pd.to_datetime(df['data'], errors='coerce').dt.normalize(),
+        'close': pd.to_numeric(df['close'], errors='coerce'),
+        'fonte': df['fonte'].astype(str) if 'fonte' in df.columns else '',
+    })
+    return df[df['data'].notna() & (df['close'] > 0)]
+
+def _gravar(df, caminho):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    # Esquema fixo: lotes gravados por versões diferentes do pandas continuam concatenáveis
+    esquema = pa.schema([('ticker', pa.string()), ('data', pa.timestamp('ns')), ('close', pa.float64()), ('fonte', pa.string())])
+    tabela = pa.Table.from_pandas(df[COLUNAS].astype({'data': 'datetime64[ns]'}), schema=esquema, preserve_index=False)
+    feather.write_feather(tabela, caminho + ".tmp", compression='uncompressed')
+    os.replace(caminho + ".tmp", caminho)
+
+def anexar_precos(df, pasta=PRECOS_DIR):
+    """
+    Acrescenta fechamentos (colunas ticker/data/close/fonte) ao histórico: um arquivo
+    novo por mês tocado. Retorna o número de registros gravados.
+    """
+    df = _normalizar(df)
+    if df.empty: return 0
+    lote = f"{datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+    for mes, parte in df.groupby(df['data'].dt.to_period('M')):
+        destino = os.path.join(pasta, f"mes={mes}")
+        os.makedirs(destino, exist_ok=True)
+        _gravar(parte, os.path.join(destino, f"{lote}.arrow"))
+    return len(df)
+
+def _arquivos_por_mes(pasta, inicio=None, fim=None):
+    if not os.path.isdir(pasta): return {}
+    ini = pd.Timestamp(inicio).strftime('%Y-%m') if inicio is not None else None
+    fi = pd.Timestamp(fim).strftime('%Y-%m') if fim is not None else None
+    meses = {}
+    for nome in sorted(os.listdir(pasta)):
+        if not nome.startswith("mes="): continue
+        mes = nome[4:]
+        if (ini and mes < ini) or (fi and mes > fi): continue
+        arquivos = sorted(a for a in os.listdir(os.path.join(pasta, nome)) if a.endswith(".arrow"))
+        if arquivos: meses[mes] = [os.path.join(pasta, nome, a) for a in arquivos]
+    return meses
+
+def versao_precos(pasta=PRECOS_DIR):
+    """Identifica o estado do histórico (arquivo mais recente); None se vazio."""
+    arquivos = [a for lista in _arquivos_por_mes(pasta).values() for a in lista]
+    return max(os.path.basename(a) for a in arquivos) if arquivos else None
+
+def ler_precos(pasta=PRECOS_DIR, inicio=None, fim=None, tickers=None):
+    """Histórico longo [ticker, data, close, fonte] sem duplicatas (o lote mais novo vence)."""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    arquivos = [a for lista in _arquivos_por_mes(pasta, inicio, fim).values() for a in lista]
+    if not arquivos:
+        return pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c == 'data' else float if c == 'close' else str) for c in COLUNAS})
+    # Lotes em ordem cronológica (nome = instante da gravação): o último registro vence
+    arquivos.sort(key=os.path.basename)
+    df = pa.concat_tables([feather.read_table(a, memory_map=True) for a in arquivos]).to_pandas()
+    df['data'] = df['data'].astype('datetime64[ns]')
+    if inicio is not None: df = df[df['data'] >= pd.Timestamp(inicio)]
+    if fim is not None: df = df[df['data'] <= pd.Timestamp(fim)]
+    if tickers is not None: df = df[df['ticker'].isin(list(tickers))]
+    df = df.drop_duplicates(['ticker', 'data'], keep='last')
+    return df.sort_values(['ticker', 'data'], ignore_index=True)
+
+def compactar(pasta=PRECOS_DIR, manter_mes_atual=True):
+    """Junta os lotes de cada mês num único arquivo. Retorna quantos arquivos foram removidos."""
+    mes_atual = datetime.date.today().strftime('%Y-%m')
+    removidos = 0
+    for mes, arquivos in _arquivos_por_mes(pasta).items():
+        if len(arquivos) < 2 or (manter_mes_atual and mes == mes_atual): continue
+        df = ler_precos(pasta, inicio=f"{mes}-01", fim=pd.Timestamp(f"{mes}-01") + pd.offsets.MonthEnd(0))
+        # Substitui o lote mais novo (mesmo nome = mesma posição na ordem de leitura)
+        _gravar(df, arquivos[-1])
+        for a in arquivos[:-1]:
+            os.remove(a)
+            removidos += 1
+    return removidos
+
+def matriz_precos(df, datas=None):
+    """
+    Matriz datas x tickers de fechamentos, com o último preço conhecido repetido nos
+    dias sem cotação. Sem 'datas', usa os dias úteis entre a primeira e a última data.
+    """
+    if df.empty: return pd.DataFrame(index=pd.DatetimeIndex(datas if datas is not None else []))
+    matriz = df.pivot(index='data', columns='ticker', values='close').sort_index()
+    if datas is None:
+        datas = pd.bdate_range(matriz.index.min(), matriz.index.max())
+    datas = pd.DatetimeIndex(datas)
+    # Une as datas pedidas às cotadas antes do ffill para não perder cotações de fim de semana
+    completa = matriz.reindex(matriz.index.union(datas)).ffill()
+    return completa.reindex(datas)
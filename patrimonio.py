@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from carteira import numeros_ptbr, datas_ptbr
+from posicoes import Livro
+from cambio import TAXAS_PADRAO, moeda_do_simbolo, historico_taxas, taxas_nas_datas, fatores_na_data
+
+# --- MOTOR DE PATRIMÔNIO DIÁRIO (NAV) ---
+# Combina as transações com a matriz de preços (datas x tickers) do histórico:
+# a quantidade de cada ticker em cada dia sai do livro de posições (posicoes.py),
+# e o patrimônio é o produto quantidade x preço x câmbio somado por linha.
+# O retorno é ponderado no tempo: aportes e resgates do dia não contam como ganho.
+
+def _posicoes_nas_datas(datas_tr, datas):
+    # Índice da primeira data >= data da transação (o evento conta a partir desse dia)
+    d = np.asarray(datas_tr, dtype='datetime64[ns]')
+    pos = pd.DatetimeIndex(datas).searchsorted(d, side='left')
+    validas = ~np.isnat(d) & (pos < len(datas))
+    return pos, validas
+
+def matriz_quantidades(df_tr, datas, tickers=None, datas_tr=None):
+    """
+    Quantidade de cada ticker ao final de cada data (DataFrame datas x tickers),
+    com as regras de tipo e de renomeação do livro de posições.
+    """
+    return Livro(df_tr, datas_tr=datas_tr).matriz(datas, tickers)
+
+def curva_patrimonio(df_tr, precos, moedas=None, taxas=TAXAS_PADRAO):
+    """
+    Patrimônio diário em BRL a partir da matriz 'precos' (datas x tickers, já com ffill).
+    'moedas' mapeia ticker -> moeda; o câmbio de cada dia vem das colunas XXXBRL=X da
+    própria matriz, com as 'taxas' spot onde ainda não há cotação (ver cambio.py).
+    Retorna DataFrame indexado por data com patrimonio, aporte (compras - vendas do
+    dia), retorno_dia e retorno_acum.
+    """
+    if precos.empty:
+        return pd.DataFrame(columns=['patrimonio', 'aporte', 'retorno_dia', 'retorno_acum'], dtype=float)
+    datas = precos.index
+    historico = historico_taxas(precos)
+    tickers = [t for t in precos.columns if moeda_do_simbolo(t) is None]
+    tabela = taxas_nas_datas(datas, taxas, historico)
+    moedas = moedas or {}
+    moeda_col = np.array([str(moedas.get(t, '')).strip().upper() for t in tickers])
+    fator = np.ones((len(datas), len(tickers)))
+    for moeda in tabela.columns:
+        fator[:, moeda_col == moeda] = tabela[moeda].values[:, None]
+
+    datas_tr = datas_ptbr(df_tr['date'])
+    qtd = matriz_quantidades(df_tr, datas, tickers, datas_tr).values
+    px = precos[tickers].values
+    # Ticker sem cotação ainda (NaN) não soma no patrimônio
+    patrimonio = np.nansum(qtd * px * fator, axis=1)
+
+    # Aportes do dia em BRL: COMPRA entra, VENDA sai (mesma regra do fluxo de caixa)
+    pos, validas = _posicoes_nas_datas(datas_tr, datas)
+    tipos = df_tr['type'].astype(str).str.upper().values
+    sinal = np.select([tipos == 'COMPRA', tipos == 'VENDA'], [1.0, -1.0], default=0.0)
+    valor = numeros_ptbr(df_tr['quantity']).values * numeros_ptbr(df_tr['price']).values * sinal
+    if 'currency' in df_tr.columns:
+        valor = valor * fatores_na_data(df_tr['currency'], datas_tr, taxas, historico)
+    aporte = np.bincount(pos[validas], weights=valor[validas], minlength=len(datas))
+
+    anterior = np.concatenate([[0.0], patrimonio[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retorno = np.where(anterior > 0, (patrimonio - aporte) / anterior - 1.0, 0.0)
+    return pd.DataFrame({
+        'patrimonio': patrimonio,
+        'aporte': aporte,
+        'retorno_dia': retorno,
+        'retorno_acum': np.cumprod(1.0 + retorno) - 1.0,
+    }, index=datas)
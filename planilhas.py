@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import threading
+import datetime
+from telemetria import medir, registrar_erro
+
+# gspread, google-auth, pandas e snapshots (pyarrow) são importados só onde são
+# usados: quem importa este módulo (python -m sgp list, os update_* antes da
+# primeira leitura) não paga a carga deles na partida.
+
+# --- SINCRONIZAÇÃO DE ABAS (ESCRITA DELTA) ---
+# Em vez de clear() + reescrita completa, comparamos a tabela nova com o conteúdo
+# atual da aba e enviamos só as células que mudaram, num único batch_update.
+# Quando a maior parte das linhas muda (ex: last_update em toda a market_data), a
+# aba é reescrita no lugar com uma única values.update que também apaga o que
+# sobrou da tabela antiga: a aba continua a mesma (mesmo gid, fórmulas de outras
+# abas que apontam para ela seguem válidas) e o dashboard nunca lê uma aba vazia.
+# Aba que ainda não existe é montada numa temporária e renomeada no final.
+
+LIMITE_DELTA = 0.5  # acima dessa fração de linhas alteradas, reescreve a aba inteira
+
+def _vazio(v):
+    return v is None or v == ''
+
+def _igual(a, b):
+    if _vazio(a) and _vazio(b): return True
+    if _vazio(a) or _vazio(b): return False
+    try:
+        return float(a) == float(b)
+    except (TypeError, ValueError):
+        return str(a) == str(b)
+
+def diferencas(atuais, novos):
+    """
+    Lista de {'range', 'values'} com as células que mudaram (trechos contíguos por linha).
+    Células que existiam e não existem mais na tabela nova são apagadas com ''.
+    """
+    from gspread.utils import rowcol_to_a1
+    n_linhas = max(len(atuais), len(novos))
+    n_cols = max([len(r) for r in atuais] + [len(r) for r in novos] + [0])
+    blocos = []
+    for i in range(n_linhas):
+        antiga = atuais[i] if i < len(atuais) else []
+        nova = novos[i] if i < len(novos) else []
+        inicio, trecho = None, []
+        for j in range(n_cols + 1):
+            if j < n_cols:
+                a = antiga[j] if j < len(antiga) else ''
+                b = nova[j] if j < len(nova) else ''
+                if not _igual(a, b):
+                    if inicio is None: inicio = j
+                    trecho.append(b)
+                    continue
+            if inicio is not None:
+                blocos.append({
+                    'range': f"{rowcol_to_a1(i + 1, inicio + 1)}:{rowcol_to_a1(i + 1, inicio + len(trecho))}",
+                    'values': [trecho],
+                })
+                inicio, trecho = None, []
+    return blocos
+
+def _criar_aba(sh, titulo, valores, value_input_option):
+    n_cols = max([len(r) for r in valores] + [1])
+    temp = sh.add_worksheet(title=f"{titulo}__novo_{int(time.time())}", rows=max(len(valores), 1), cols=n_cols)
+    try:
+        temp.update(values=valores, range_name='A1', value_input_option=value_input_option)
+    except Exception:
+        # Não deixa a temporária órfã na planilha
+        sh.del_worksheet(temp)
+        raise
+    sh.batch_update({'requests': [{'updateSheetProperties': {
+        'properties': {'sheetId': temp.id, 'title': titulo}, 'fields': 'title'}}]})
+
+def _reescrever(ws, valores, atuais, value_input_option):
+    """Uma values.update cobrindo a tabela nova e a antiga; o que sobrar da antiga vira ''."""
+    from gspread.utils import rowcol_to_a1
+    n_linhas = max(len(valores), len(atuais), 1)
+    n_cols = max([len(r) for r in valores] + [len(r) for r in atuais] + [1])
+    if n_linhas > ws.row_count or n_cols > ws.col_count:
+        ws.resize(rows=max(n_linhas, ws.row_count), cols=max(n_cols, ws.col_count))
+    matriz = [list(r) + [''] * (n_cols - len(r)) for r in valores] + [[''] * n_cols] * (n_linhas - len(valores))
+    ws.update(values=matriz, range_name=f"A1:{rowcol_to_a1(n_linhas, n_cols)}", value_input_option=value_input_option)
+    return sum(len(r) for r in matriz)
+
+def sincronizar_aba(sh, titulo, valores, value_input_option='RAW', atuais=None, limite_delta=LIMITE_DELTA):
+    """
+    Deixa a aba 'titulo' igual a 'valores' (lista de linhas, cabeçalho incluso).
+    'atuais' pode trazer o conteúdo já lido (valores não formatados) para poupar uma leitura.
+    Retorna (modo, células enviadas): modo é 'nenhum', 'delta', 'completa' (aba
+    reescrita no lugar) ou 'nova' (aba criada).
+    """
+    import gspread
+    from gspread.utils import a1_to_rowcol
+    try:
+        ws = sh.worksheet(titulo)
+    except gspread.WorksheetNotFound:
+        ws = None
+
+    if ws is None:
+        _criar_aba(sh, titulo, valores, value_input_option)
+        return 'nova', sum(len(r) for r in valores)
+
+    if atuais is None:
+        atuais = ws.get_values(value_render_option='UNFORMATTED_VALUE', date_time_render_option='FORMATTED_STRING')
+    blocos = diferencas(atuais, valores)
+    alteradas = sum(len(b['values'][0]) for b in blocos)
+    if not blocos:
+        return 'nenhum', 0
+
+    # Linhas, não células: uma coluna que muda em toda linha (last_update) já vale reescrever
+    linhas_alteradas = len({a1_to_rowcol(b['range'].split(':')[0])[0] for b in blocos})
+    if linhas_alteradas / max(len(valores), len(atuais), 1) > limite_delta:
+        return 'completa', _reescrever(ws, valores, atuais, value_input_option)
+
+    n_linhas = len(valores)
+    n_cols = max(len(r) for r in valores)
+    if n_linhas > ws.row_count or n_cols > ws.col_count:
+        ws.resize(rows=max(n_linhas, ws.row_count), cols=max(n_cols, ws.col_count))
+    ws.batch_update(blocos, value_input_option=value_input_option)
+    return 'delta', alteradas
+
+# --- SESSÃO COMPARTILHADA (UMA AUTENTICAÇÃO, UMA LEITURA, UMA ESCRITA POR ABA) ---
+# Os scripts de atualização recebem uma Sessao: a planilha é aberta uma vez, cada
+# aba de entrada é lida uma vez (os estágios recebem cópias) e as escritas ficam
+# pendentes até gravar(), que envia uma única sincronizar_aba por aba de saída.
+# A market_data é mesclada por ticker: cada estágio contribui com as linhas que
+# cotou e, no mesmo ticker, vence a maior prioridade. Linhas marcadas como
+# reserva (preço preservado da execução anterior ou o padrão 1.0) só valem se
+# nenhum estágio trouxe cotação de verdade para o ticker. Contribuição 'completa'
+# define o conjunto de linhas (o que não vier de nenhum estágio sai da aba); sem
+# ela, as linhas atuais da aba são mantidas.
+
+ID_PLANILHA = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8"
+ESCOPOS = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+CABECALHO_PRECOS = ['ticker', 'close_price', 'last_update']
+# Quem escreve na market_data (maior vence quando dois estágios cotam o mesmo ticker)
+PRIORIDADE_PRECOS = {'update_market_data': 3, 'update_funds': 2, 'update_prices': 1}
+# Célula-sinal do app (SINAIS em app.py): toda gravação da aba carimba o instante na
+# 2ª linha da coluna COLUNA_SINAL, qualquer que seja o estágio que mesclou linhas nela
+COLUNA_SINAL = 'Atualizado em'
+ABAS_SINAL = {'market_data': len(CABECALHO_PRECOS)}  # aba -> índice da coluna (D)
+
+def abrir_planilha(chave=ID_PLANILHA):
+    import gspread
+    from google.oauth2.service_account import Credentials
+    creds_str = os.environ.get("GOOGLE_SHEETS_CREDS")
+    if not creds_str: raise ValueError("Secret GOOGLE_SHEETS_CREDS não encontrada")
+    creds = Credentials.from_service_account_info(json.loads(creds_str), scopes=ESCOPOS)
+    return gspread.authorize(creds).open_by_key(chave)
+
+def agora_gmt3():
+    """Carimbo 'dd/mm/aaaa HH:MM:SS' no horário de Brasília (coluna last_update)."""
+    fuso_gmt3 = datetime.timezone(datetime.timedelta(hours=-3))
+    return datetime.datetime.now(fuso_gmt3).strftime('%d/%m/%Y %H:%M:%S')
+
+def carimbar_sinal(valores, coluna, instante):
+    """Cópia de 'valores' com COLUNA_SINAL na posição 'coluna', vazia exceto na 1ª linha de dados."""
+    valores = [list(r) for r in valores]
+    if not valores: return valores
+    if COLUNA_SINAL in valores[0]:
+        atual = valores[0].index(COLUNA_SINAL)
+        for r in valores:
+            if len(r) > atual: del r[atual]
+    for i, r in enumerate(valores):
+        r += [''] * (coluna - len(r))
+        r.insert(coluna, COLUNA_SINAL if i == 0 else (instante if i == 1 else ''))
+    return valores
+
+class Sessao:
+    def __init__(self, abrir=abrir_planilha):
+        self._abrir = abrir
+        self._sh = None
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._tabelas = {}
+        self._valores = {}
+        self._saidas = {}   # aba -> (valores, value_input_option)
+        self._partes = {}   # aba -> [{'cabecalho', 'linhas', 'prioridade', 'completo', 'reservas'}]
+        self.fechada = False
+
+    def _trava(self, chave):
+        with self._lock:
+            return self._locks.setdefault(chave, threading.Lock())
+
+    @property
+    def planilha(self):
+        with self._trava('planilha'):
+            if self._sh is None:
+                self._sh = self._abrir()
+            return self._sh
+
+    def tabela(self, aba):
+        """DataFrame de get_all_records da aba (colunas em minúsculas), lido uma vez por sessão."""
+        import pandas as pd
+        with self._trava(('tabela', aba)):
+            if aba not in self._tabelas:
+                with medir("planilha.leitura"):
+                    df = pd.DataFrame(self.planilha.worksheet(aba).get_all_records())
+                df.columns = [str(c).lower().strip() for c in df.columns]
+                self._tabelas[aba] = df
+        return self._tabelas[aba].copy()
+
+    def valores(self, aba):
+        """Valores não formatados da aba (lista de linhas), lidos uma vez por sessão; [] se a aba não existe."""
+        import gspread
+        with self._trava(('valores', aba)):
+            if aba not in self._valores:
+                with medir("planilha.leitura"):
+                    try:
+                        ws = self.planilha.worksheet(aba)
+                    except gspread.WorksheetNotFound:
+                        self._valores[aba] = []
+                    else:
+                        self._valores[aba] = ws.get_values(value_render_option='UNFORMATTED_VALUE',
+                                                           date_time_render_option='FORMATTED_STRING')
+        return [list(r) for r in self._valores[aba]]
+
+    def escrever(self, aba, valores, value_input_option='RAW'):
+        """Agenda a aba inteira (cabeçalho incluso) para gravar(); a última escrita da aba vale."""
+        with self._lock:
+            if self.fechada: return
+            self._saidas[aba] = ([list(r) for r in valores], value_input_option)
+
+    def mesclar(self, aba, cabecalho, linhas, prioridade=0, completo=False, reservas=()):
+        """
+        Agenda linhas chaveadas pela 1ª coluna (ex: market_data) para mesclar em gravar().
+        'reservas' são as chaves cujas linhas só preenchem a aba (valor preservado ou
+        padrão): perdem para qualquer linha não reserva do mesmo ticker.
+        """
+        with self._lock:
+            if self.fechada: return
+            self._partes.setdefault(aba, []).append({'cabecalho': list(cabecalho), 'linhas': [list(r) for r in linhas],
+                                                     'prioridade': prioridade, 'completo': completo,
+                                                     'reservas': {str(c).strip() for c in reservas}})
+
+    def _consolidar(self, aba, partes):
+        completo = any(p['completo'] for p in partes)
+        atuais = self.valores(aba) if not completo else []
+        base = [{'cabecalho': atuais[0], 'linhas': atuais[1:], 'reservas': set()}] if atuais else []
+        # Ordem das linhas: a da aba (ou da contribuição completa); valores: cotações por
+        # prioridade, depois as reservas por prioridade, depois o que já estava na aba
+        ordem = base + sorted(partes, key=lambda p: (not p['completo'], -p['prioridade']))
+        por_prioridade = sorted(partes, key=lambda p: -p['prioridade'])
+        precedencia = [(p, False) for p in por_prioridade] + [(p, True) for p in por_prioridade] + [(p, False) for p in base]
+        cabecalho = []
+        for p, _ in precedencia:
+            cabecalho += [c for c in p['cabecalho'] if c not in cabecalho]
+        linhas = {}
+        for p in ordem:
+            for r in p['linhas']:
+                if str(r[0]).strip(): linhas.setdefault(str(r[0]).strip(), {})
+        for p, reserva in precedencia:
+            for r in p['linhas']:
+                t = str(r[0]).strip()
+                if t in linhas and (t in p['reservas']) == reserva:
+                    for c, v in zip(p['cabecalho'], r): linhas[t].setdefault(c, v)
+        return [cabecalho] + [[campos.get(c, '') for c in cabecalho] for campos in linhas.values()]
+
+    def gravar(self):
+        """Uma sincronizar_aba por aba de saída (e o snapshot local). Retorna {aba: (modo, células)}."""
+        import snapshots
+        with self._lock:
+            self.fechada = True
+            saidas, partes = dict(self._saidas), dict(self._partes)
+        for aba, lista in partes.items():
+            if aba not in saidas:
+                saidas[aba] = (self._consolidar(aba, lista), 'USER_ENTERED')
+        gravados = {}
+        for aba, (valores, opcao) in saidas.items():
+            if aba in ABAS_SINAL:
+                valores = carimbar_sinal(valores, ABAS_SINAL[aba], agora_gmt3())
+            try:
+                with medir("planilha.escrita"):
+                    gravados[aba] = sincronizar_aba(self.planilha, aba, valores, value_input_option=opcao,
+                                                    atuais=self._valores.get(aba))
+                print(f"   💾 {aba} ({gravados[aba][0]}): {gravados[aba][1]} células enviadas.")
+            except Exception as e:
+                print(f"❌ Erro ao gravar {aba}: {e}")
+                registrar_erro("planilha.escrita", e)
+                continue
+            versao = snapshots.publicar_snapshot(aba, valores)
+            if versao: print(f"   Snapshot local publicado: {aba}/{versao}")
+        return gravados
@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+# --- LIVRO DE POSIÇÕES (MÁQUINA DO TEMPO VETORIZADA) ---
+# As transações são reproduzidas uma única vez, em ordem de data, num estado por
+# ticker após cada evento: quantidade (cumsum vetorizado), custo total, preço
+# médio e resultado realizado. Qualquer vetor de datas é respondido depois com um
+# único searchsorted por ticker (O(log n) por consulta). Tickers renomeados
+# (RENAME_MAP) continuam a mesma posição sob o ticker atual.
+#
+# Convenção das quantidades: a linha traz o número de ações que entram ou saem.
+# DESDOBRAMENTO e BONIFICACAO somam as ações novas, AGRUPAMENTO subtrai as que
+# deixaram de existir. Desdobramento e agrupamento não mexem no custo total (só no
+# preço médio); a bonificação entra pelo custo atribuído na coluna price, se houver.
+
+TIPOS_ENTRADA = ['COMPRA', 'BONIFICACAO', 'DESDOBRAMENTO', 'BUY', 'ENTRADA']
+TIPOS_SAIDA = ['VENDA', 'AGRUPAMENTO', 'SELL', 'SAIDA']
+TIPOS_COM_CUSTO = ['COMPRA', 'BUY', 'ENTRADA', 'BONIFICACAO']  # somam quantidade x preço ao custo
+TIPOS_REALIZACAO = ['VENDA', 'SELL']                            # saem pelo preço médio e realizam resultado
+TIPOS_BAIXA = ['SAIDA']                                         # saem pelo preço médio sem realizar
+
+# --- MAPEAMENTO DE MUDANÇAS DE TICKER ---
+RENAME_MAP = {
+    "CESP6": "AURE3",
+    "BTOW3": "AMER3",
+    "ENAT3": "BRAV3",
+    "LCAM3": "RENT3",
+    "BKBR3": "ZAMP3",
+    "IGTA3": "IGTI11",
+    "BRDT3": "VBBR3",
+    "JPSA3": "ALOS3",
+    "SULA11": "RDOR3",
+    "TRPL4": "ISAE4"
+}
+
+def ticker_atual(ticker, renomear=RENAME_MAP):
+    """Segue a cadeia de renomeações até o ticker vigente (sem diferenciar maiúsculas)."""
+    t = str(ticker).strip().upper()
+    vistos = set()
+    while t in renomear and t not in vistos:
+        vistos.add(t)
+        t = renomear[t]
+    return t
+
+def tickers_atuais(tickers, renomear=RENAME_MAP):
+    serie = pd.Series(tickers)
+    codigos, unicos = pd.factorize(serie)
+    atuais = np.array([ticker_atual(t, renomear) for t in unicos], dtype=object)
+    return pd.Series(np.where(codigos >= 0, atuais[np.maximum(codigos, 0)], ''), index=serie.index)
+
+def _classes_por_tipo(tipos):
+    # Regras avaliadas uma vez por tipo distinto (o livro repete poucos tipos)
+    codigos, unicos = pd.factorize(pd.Series(tipos))
+    t = pd.Index(unicos).astype(str).str.upper()
+    sinal = np.select([t.isin(TIPOS_ENTRADA), t.isin(TIPOS_SAIDA)], [1.0, -1.0], default=0.0)
+    # 1 soma custo, 2 vende pelo médio, 3 baixa pelo médio, 0 só mexe na quantidade
+    classe = np.select([t.isin(TIPOS_COM_CUSTO), t.isin(TIPOS_REALIZACAO), t.isin(TIPOS_BAIXA)], [1, 2, 3], default=0)
+    validos = codigos >= 0
+    return (np.where(validos, np.append(sinal, 0.0)[codigos], 0.0),
+            np.where(validos, np.append(classe, 0)[codigos], 0))
+
+def sinal_quantidade(tipos):
+    """+1 para os tipos que trazem ações, -1 para os que tiram, 0 para o resto."""
+    return _classes_por_tipo(tipos)[0]
+
+def _datas_ns(datas):
+    return np.asarray(pd.to_datetime(datas), dtype='datetime64[ns]').astype('int64')
+
+class Livro:
+    """
+    Estado de cada ticker (vigente) após cada transação. Espera colunas 'ticker',
+    'date', 'type' e 'quantity' (datas e números podem vir em PT-BR); 'price' é
+    opcional. 'fatores' converte o preço de cada linha para BRL (ver cambio.py) e
+    'datas_tr' evita converter de novo datas que quem chama já converteu.
+    """
+    def __init__(self, df_trans, fatores=None, renomear=RENAME_MAP, datas_tr=None):
+        from carteira import numeros_ptbr, datas_ptbr
+
+        n = len(df_trans)
+        sinal, classe = _classes_por_tipo(df_trans['type'])
+        preco = numeros_ptbr(df_trans['price']).values if 'price' in df_trans.columns else np.zeros(n)
+        if fatores is not None: preco = preco * np.asarray(fatores, dtype=float)
+        datas = np.asarray(datas_ptbr(df_trans['date']) if datas_tr is None else pd.Series(datas_tr), dtype='datetime64[ns]')
+        codigos, nomes = pd.factorize(tickers_atuais(df_trans['ticker'], renomear), sort=True)
+
+        validas = ~np.isnat(datas) & (nomes[np.maximum(codigos, 0)] != '') if len(nomes) else np.zeros(n, dtype=bool)
+        validas &= codigos >= 0
+        # Estável: por ticker e data; no mesmo dia vale a ordem em que as transações foram lançadas
+        idx = np.flatnonzero(validas)
+        idx = idx[np.lexsort((datas[idx].astype('int64'), codigos[idx]))]
+
+        self._datas = datas[idx].astype('int64')
+        self._delta = numeros_ptbr(df_trans['quantity']).values[idx] * sinal[idx]
+        self._preco = preco[idx]
+        self._tipo = classe[idx]
+        contagem = np.bincount(codigos[idx], minlength=len(nomes))
+        fins = np.cumsum(contagem)
+        inicios = fins - contagem
+        self._faixas = {t: (i, f) for t, i, f in zip(nomes, inicios, fins) if f > i}
+        self._renomear = renomear
+
+        # Quantidade: cumsum global menos o acumulado antes do início de cada ticker
+        acumulado = np.cumsum(self._delta)
+        base = np.repeat(np.concatenate([[0.0], acumulado])[inicios], contagem)
+        self._qtd = acumulado - base
+        self._custo = None
+        self._realizado = None
+
+    def __contains__(self, ticker):
+        return ticker_atual(ticker, self._renomear) in self._faixas
+
+    @property
+    def tickers(self):
+        return list(self._faixas)
+
+    def _reproduzir_custos(self):
+        # Custo médio depende da ordem dos eventos: um único passe sobre o livro todo
+        if self._custo is not None: return
+        n = len(self._delta)
+        custo, realizado = [0.0] * n, [0.0] * n
+        delta, preco, tipo = self._delta.tolist(), self._preco.tolist(), self._tipo.tolist()
+        for inicio, fim in self._faixas.values():
+            q = c = r = 0.0
+            for i in range(inicio, fim):
+                d = delta[i]
+                if tipo[i] == 1 and d > 0:
+                    c += d * preco[i]
+                elif tipo[i] >= 2 and d < 0:
+                    medio = c / q if q > 0 else 0.0
+                    c += medio * d
+                    if tipo[i] == 2: r -= d * (preco[i] - medio)
+                q += d
+                if q <= 1e-9: c = 0.0
+                custo[i], realizado[i] = c, r
+        self._custo, self._realizado = np.array(custo), np.array(realizado)
+
+    def _indices(self, ticker, datas_ns):
+        inicio, fim = self._faixas[ticker]
+        return inicio + np.searchsorted(self._datas[inicio:fim], datas_ns, side='right') - 1, inicio
+
+    def _quantidades_ns(self, atual, datas_ns):
+        if atual not in self._faixas:
+            return np.zeros(len(datas_ns))
+        idx, inicio = self._indices(atual, datas_ns)
+        return np.maximum(np.where(idx >= inicio, self._qtd[np.maximum(idx, 0)], 0.0), 0.0)
+
+    def quantidades(self, ticker, datas):
+        """Quantidade no FINAL de cada data (inclusive), nunca negativa."""
+        return self._quantidades_ns(ticker_atual(ticker, self._renomear), _datas_ns(datas))
+
+    def estado(self, ticker, data):
+        """{quantidade, custo_total, preco_medio, realizado} do ticker ao final de 'data'."""
+        self._reproduzir_custos()
+        ticker = ticker_atual(ticker, self._renomear)
+        vazio = {'quantidade': 0.0, 'custo_total': 0.0, 'preco_medio': 0.0, 'realizado': 0.0}
+        if ticker not in self._faixas: return vazio
+        idx, inicio = self._indices(ticker, _datas_ns([data]))
+        i = int(idx[0])
+        if i < inicio: return vazio
+        q, c = float(self._qtd[i]), float(self._custo[i])
+        return {'quantidade': max(q, 0.0), 'custo_total': c, 'preco_medio': c / q if q > 0 else 0.0, 'realizado': float(self._realizado[i])}
+
+    def fotografia(self, data=None):
+        """
+        Posição de todos os tickers ao final de 'data' (padrão: após a última transação).
+        DataFrame [ticker, quantidade, custo_total, preco_medio, realizado].
+        """
+        self._reproduzir_custos()
+        nomes = list(self._faixas)
+        inicios = np.array([self._faixas[t][0] for t in nomes], dtype=int)
+        fins = np.array([self._faixas[t][1] for t in nomes], dtype=int)
+        if data is None:
+            idx = fins - 1
+        else:
+            d = _datas_ns([data])[0]
+            idx = np.array([i + np.searchsorted(self._datas[i:f], d, side='right') - 1 for i, f in zip(inicios, fins)], dtype=int)
+        ok = idx >= inicios
+        sel = np.maximum(idx, 0)
+        q = np.where(ok, self._qtd[sel], 0.0) if len(nomes) else np.zeros(0)
+        c = np.where(ok, self._custo[sel], 0.0) if len(nomes) else np.zeros(0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            medio = np.where(q > 0, c / q, 0.0)
+        return pd.DataFrame({
+            'ticker': nomes, 'quantidade': q, 'custo_total': c, 'preco_medio': medio,
+            'realizado': np.where(ok, self._realizado[sel], 0.0) if len(nomes) else np.zeros(0),
+        })
+
+    def matriz(self, datas, tickers=None):
+        """
+        Quantidade de cada ticker ao final de cada data (DataFrame datas x tickers).
+        Se dois tickers pedidos forem o mesmo ativo (renomeação), a posição fica só
+        numa coluna (a do ticker vigente, se pedida) para não contar em dobro.
+        """
+        datas = pd.DatetimeIndex(datas)
+        datas_ns = _datas_ns(datas)
+        tickers = self.tickers if tickers is None else list(tickers)
+        atuais = [ticker_atual(t, self._renomear) for t in tickers]
+        representante = {}
+        for j, (t, atual) in enumerate(zip(tickers, atuais)):
+            if atual not in representante or str(t).strip().upper() == atual:
+                representante[atual] = j
+        qtd = np.zeros((len(datas), len(tickers)))
+        for atual, j in representante.items():
+            qtd[:, j] = self._quantidades_ns(atual, datas_ns)
+        return pd.DataFrame(qtd, index=datas, columns=tickers)
+
+def construir_posicoes(df_trans, fatores=None):
+    """Livro de posições das transações (ver Livro)."""
+    return Livro(df_trans, fatores)
+
+def quantidades_nas_datas(posicoes, ticker, datas):
+    """
+    Quantidade possuída no FINAL de cada data em 'datas' (inclusive), nunca negativa.
+    Responde o vetor inteiro com um único searchsorted.
+    """
+    return posicoes.quantidades(ticker, datas)
+
+def quantidade_na_data(posicoes, ticker, data_corte):
+    return float(quantidades_nas_datas(posicoes, ticker, [data_corte])[0])
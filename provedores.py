@@ -0,0 +1,333 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from telemetria import medir, contar, registrar_erro
+
+# --- ENDPOINTS (sobrescrevíveis por variável de ambiente, ex: servidor local de teste) ---
+BRAPI_URL = os.environ.get("BRAPI_URL", "https://brapi.dev/api")
+
+# --- LIMITE DE REQUISIÇÕES POR PROVEDOR ---
+class LimitadorTaxa:
+    """
+    Balde de fichas: uma ficha a cada 'intervalo' segundos, até 'rajada' acumuladas.
+    Com rajada=1 é um intervalo mínimo entre chamadas; vale para várias threads.
+    """
+    def __init__(self, intervalo, rajada=1):
+        self.intervalo = intervalo
+        self.rajada = max(1, int(rajada))
+        self._lock = threading.Lock()
+        self._proximo = 0.0
+
+    def aguardar(self):
+        with self._lock:
+            agora = time.monotonic()
+            # Fichas acumuladas: o agendamento pode ficar até (rajada - 1) intervalos no passado
+            inicio = max(self._proximo, agora - (self.rajada - 1) * self.intervalo)
+            espera = inicio - agora
+            self._proximo = inicio + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+# Intervalo mínimo (segundos) entre requisições de cada provedor
+LIMITADORES = {
+    "BRAPI": LimitadorTaxa(float(os.environ.get("BRAPI_INTERVALO", 0.1)), int(os.environ.get("BRAPI_RAJADA", 4))),
+    "YAHOO": LimitadorTaxa(float(os.environ.get("YAHOO_INTERVALO", 0.1))),
+    "CVM": LimitadorTaxa(float(os.environ.get("CVM_INTERVALO", 0.0))),
+    "TESOURO": LimitadorTaxa(float(os.environ.get("TESOURO_INTERVALO", 0.0))),
+}
+
+# --- RETRY COMPARTILHADO (BACKOFF EXPONENCIAL + JITTER) ---
+TENTATIVAS = int(os.environ.get("PROVEDOR_TENTATIVAS", 3))
+BACKOFF = float(os.environ.get("PROVEDOR_BACKOFF", 0.5))
+STATUS_RETRY = {429, 500, 502, 503, 504}
+
+def _pausa_backoff(tentativa, backoff=BACKOFF):
+    # 0.5s, 1s, 2s... multiplicado por um jitter em [1, 2) para não sincronizar threads
+    time.sleep(backoff * (2 ** tentativa) * (1 + random.random()))
+
+class ClienteHTTP:
+    """
+    Cliente de um provedor: uma requests.Session com pool de conexões keep-alive,
+    limitador de taxa do provedor e retry com backoff em erros de rede/5xx/429.
+    """
+    def __init__(self, nome, timeout=10, tentativas=TENTATIVAS, backoff=BACKOFF, pool=16):
+        self.nome = nome
+        self.timeout = timeout
+        self.tentativas = tentativas
+        self.backoff = backoff
+        LIMITADORES.setdefault(nome, LimitadorTaxa(0.0))
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0'
+        adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        self.session.mount('https://', adaptador)
+        self.session.mount('http://', adaptador)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        for tentativa in range(self.tentativas):
+            LIMITADORES[self.nome].aguardar()
+            if tentativa: contar(f"{self.nome}.retry")
+            try:
+                with medir(f"http.{self.nome}"):
+                    resp = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                contar(f"{self.nome}.falha_rede")
+                if tentativa == self.tentativas - 1: raise
+            else:
+                contar(f"{self.nome}.http_{resp.status_code}")
+                if resp.status_code not in STATUS_RETRY or tentativa == self.tentativas - 1:
+                    return resp
+                resp.close()
+            _pausa_backoff(tentativa, self.backoff)
+
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+TIMEOUTS = {"BRAPI": 10, "CVM": 90, "TESOURO": 30}
+
+def cliente(nome):
+    """Cliente HTTP compartilhado (um por provedor e por processo)."""
+    with _clientes_lock:
+        if nome not in _clientes:
+            _clientes[nome] = ClienteHTTP(nome, timeout=TIMEOUTS.get(nome, 30))
+        return _clientes[nome]
+
+def executar(nome, funcao, *args, tentativas=TENTATIVAS, **kwargs):
+    """
+    Mesma política (limitador + retry com backoff) para provedores acessados por
+    bibliotecas com sessão própria, como o yfinance.
+    """
+    for tentativa in range(tentativas):
+        LIMITADORES[nome].aguardar()
+        if tentativa: contar(f"{nome}.retry")
+        try:
+            with medir(f"chamada.{nome}"):
+                return funcao(*args, **kwargs)
+        except Exception:
+            if tentativa == tentativas - 1: raise
+        _pausa_backoff(tentativa)
+
+# --- BRAPI: COTAÇÕES EM LOTES ADAPTATIVOS ---
+# A BRAPI aceita vários símbolos por requisição (/quote/A,B,C), mas um símbolo
+# inválido derruba o lote inteiro. O tamanho do lote cresce enquanto as respostas
+# chegam rápidas e cai pela metade com lentidão. Só o lote recusado por
+# símbolo (400/404) é dividido ao meio até isolar o símbolo ruim; erro de rede,
+# 5xx ou 429 (já depois dos retries do ClienteHTTP) devolve o lote inteiro para o
+# fim da fila uma vez e depois o abandona; token recusado (401/403) encerra a
+# consulta. Vários lotes correm ao mesmo tempo, dentro do balde de fichas da
+# BRAPI (LIMITADORES).
+BRAPI_LOTE = int(os.environ.get("BRAPI_LOTE", 20))          # tamanho inicial
+BRAPI_LOTE_MAX = int(os.environ.get("BRAPI_LOTE_MAX", 50))
+BRAPI_WORKERS = int(os.environ.get("BRAPI_WORKERS", 4))
+BRAPI_LATENCIA_ALVO = float(os.environ.get("BRAPI_LATENCIA_ALVO", 2.0))  # segundos por lote
+BRAPI_REENVIOS = int(os.environ.get("BRAPI_REENVIOS", 1))  # vezes que um lote com erro volta para a fila
+STATUS_RECUSA = {400, 404}   # algum símbolo do lote não existe
+STATUS_NEGADO = {401, 403}   # token inválido ou sem permissão: nenhum lote vai passar
+
+class TamanhoLote:
+    """Tamanho de lote por aumento aditivo / redução multiplicativa (seguro para threads)."""
+    def __init__(self, inicial=BRAPI_LOTE, minimo=1, maximo=BRAPI_LOTE_MAX, passo=5, latencia_alvo=BRAPI_LATENCIA_ALVO):
+        self.atual = max(minimo, min(inicial, maximo))
+        self.minimo, self.maximo, self.passo, self.latencia_alvo = minimo, maximo, passo, latencia_alvo
+        self._lock = threading.Lock()
+
+    def registrar(self, n, segundos, ok):
+        with self._lock:
+            if not ok or segundos > self.latencia_alvo:
+                self.atual = max(self.minimo, min(self.atual, n) // 2)
+            elif n >= self.atual:
+                # Só cresce quando um lote cheio respondeu dentro do alvo
+                self.atual = min(self.maximo, self.atual + self.passo)
+
+def _lote_brapi(url, lote, params, timeout):
+    """
+    (situação, {SIMBOLO: item de 'results'}, segundos) de uma requisição /quote.
+    Situação: 'ok', 'recusado' (400/404: algum símbolo do lote), 'negado' (401/403:
+    token) ou 'erro' (rede, 5xx, 429 e demais status).
+    """
+    t0 = time.perf_counter()
+    try:
+        resp = cliente("BRAPI").get(f"{url}/quote/{','.join(lote)}", params=params, timeout=timeout)
+        if resp.status_code != 200:
+            contar(f"BRAPI.lote_{resp.status_code}")
+            situacao = 'recusado' if resp.status_code in STATUS_RECUSA else ('negado' if resp.status_code in STATUS_NEGADO else 'erro')
+            return situacao, {}, time.perf_counter() - t0
+        itens = resp.json().get('results') or []
+        return 'ok', {str(item.get('symbol', '')).upper(): item for item in itens}, time.perf_counter() - t0
+    except Exception as e:
+        registrar_erro("BRAPI.lote", e)
+        return 'erro', {}, time.perf_counter() - t0
+
+def cotar_brapi(simbolos, params, url=BRAPI_URL, workers=BRAPI_WORKERS, tamanho=None, timeout=None):
+    """
+    Consulta /quote para todos os 'simbolos' em lotes adaptativos e concorrentes.
+    Retorna ({SIMBOLO: item de 'results'}, relatório com símbolos/s, lotes, falhas,
+    sem_resposta, negado e tamanho final). 'falhas' são os símbolos que a BRAPI recusou;
+    'sem_resposta', os que ficaram sem consulta válida (lote com erro ou token negado).
+    'tamanho' pode trazer um TamanhoLote próprio (ex: lote inicial menor).
+    """
+    tamanho = tamanho or TamanhoLote()
+    fila = deque(dict.fromkeys(str(s).strip().upper() for s in simbolos))
+    n_simbolos = len(fila)
+    metades = deque()  # pedaços de lotes recusados e lotes reenviados; saem antes dos lotes novos
+    reenvios = {}      # lote (tupla) -> vezes que voltou para a fila
+    resultados, falhas, sem_resposta, lotes, negado = {}, [], [], 0, False
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        em_voo = {}
+        while fila or metades or em_voo:
+            while (fila or metades) and len(em_voo) < max(1, workers):
+                lote = metades.popleft() if metades else [fila.popleft() for _ in range(min(tamanho.atual, len(fila)))]
+                em_voo[pool.submit(_lote_brapi, url, lote, params, timeout)] = lote
+            prontos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+            for fut in prontos:
+                lote = em_voo.pop(fut)
+                situacao, itens, segundos = fut.result()
+                lotes += 1
+                # Só a resposta boa mede a carga: recusa (símbolo ruim) e erro (5xx, rede, já com os
+                # retries do ClienteHTTP) não mexem no tamanho, senão os lotes novos encolheriam até 1
+                if situacao == 'ok': tamanho.registrar(len(lote), segundos, True)
+                if situacao == 'ok':
+                    resultados.update(itens)
+                elif situacao == 'negado' or negado:
+                    # Token recusado: o resto da fila teria a mesma resposta (lotes ainda em voo só terminam)
+                    if not negado:
+                        registrar_erro("BRAPI.token", RuntimeError("BRAPI recusou o token (401/403)"))
+                    negado = True
+                    sem_resposta += lote + [s for m in metades for s in m] + list(fila)
+                    metades.clear()
+                    fila.clear()
+                elif situacao == 'erro':
+                    chave = tuple(lote)
+                    if reenvios.get(chave, 0) < BRAPI_REENVIOS:
+                        contar("BRAPI.reenvio")
+                        reenvios[chave] = reenvios.get(chave, 0) + 1
+                        metades.append(lote)
+                    else:
+                        sem_resposta += lote
+                elif len(lote) > 1:
+                    contar("BRAPI.bisseccao")
+                    meio = len(lote) // 2
+                    metades.extend([lote[:meio], lote[meio:]])
+                else:
+                    falhas.append(lote[0])
+    segundos = time.perf_counter() - t0
+    contar("BRAPI.lotes", lotes)
+    contar("BRAPI.simbolos_falhos", len(falhas))
+    contar("BRAPI.sem_resposta", len(sem_resposta))
+    return resultados, {
+        'simbolos': n_simbolos, 'encontrados': len(resultados), 'falhas': falhas, 'lotes': lotes,
+        'sem_resposta': sem_resposta, 'negado': negado,
+        'segundos': segundos, 'simbolos_por_s': n_simbolos / segundos if segundos > 0 else 0.0,
+        'tamanho_final': tamanho.atual,
+    }
+
+# --- YAHOO: PROVENTOS POR SÍMBOLO EXATO ---
+def dividendos_yahoo(symbol, desde=None):
+    """
+    Proventos do Yahoo (índice = Data Ex, sem fuso). Com 'desde', baixa só a cauda
+    a partir dessa data e devolve série vazia se não houver nada novo.
+    Retorna None se o Yahoo não tiver histórico algum. Exceções sobem para quem chama.
+    """
+    import yfinance as yf
+
+    stock = yf.Ticker(symbol)
+    if desde is not None:
+        hist = executar("YAHOO", stock.history, start=desde.strftime('%Y-%m-%d'), actions=True)
+        if 'Dividends' not in hist: return pd.Series(dtype=float)
+        divs = hist.loc[hist['Dividends'] > 0, 'Dividends']
+        divs.index = divs.index.tz_localize(None).normalize()
+        return divs
+    divs = executar("YAHOO", lambda: stock.dividends)
+    if divs.empty: return None
+    divs.index = divs.index.tz_localize(None)
+    return divs
+
+# --- YAHOO: COTAÇÕES EM LOTE ---
+def cotacoes_yahoo(simbolos, tamanho_lote=50):
+    """
+    Último fechamento de vários símbolos com yf.download em lotes (uma requisição
+    por lote). Só os símbolos ausentes ou NaN no lote são consultados um a um.
+    Retorna {SIMBOLO: preço}.
+    """
+    import yfinance as yf
+
+    simbolos = list(dict.fromkeys(simbolos))
+    precos = {}
+    for i in range(0, len(simbolos), tamanho_lote):
+        lote = simbolos[i:i + tamanho_lote]
+        try:
+            # 5d para sobreviver a feriados/fins de semana: usamos o último fechamento válido
+            data = executar("YAHOO", yf.download, lote, period="5d", group_by='ticker', progress=False, threads=True)
+        except Exception as e:
+            print(f"   ⚠️ Erro Yahoo lote {i // tamanho_lote + 1}: {e}")
+            registrar_erro("YAHOO.lote", e)
+            continue
+        for t in lote:
+            try:
+                fechamento = data[t]['Close'] if isinstance(data.columns, pd.MultiIndex) else data['Close']
+                fechamento = fechamento.dropna()
+                if not fechamento.empty:
+                    precos[t] = float(fechamento.iloc[-1])
+            except KeyError:
+                continue
+
+    contar("YAHOO.lote_encontrados", len(precos))
+    # Fallback individual apenas para o que faltou no download em lote
+    for t in simbolos:
+        if t in precos: continue
+        contar("YAHOO.individual")
+        try:
+            ticker_obj = yf.Ticker(t)
+            hist = executar("YAHOO", ticker_obj.history, period="1d")
+            fechamento = hist['Close'].dropna() if not hist.empty else hist
+            if not fechamento.empty:
+                precos[t] = float(fechamento.iloc[-1])
+            elif t.endswith('BRL=X'):
+                info = ticker_obj.fast_info
+                if hasattr(info, 'last_price'):
+                    precos[t] = float(info.last_price)
+        except Exception as e:
+            registrar_erro("YAHOO.individual", e)
+            continue
+    return precos
+
+# --- YAHOO: HISTÓRICO DE FECHAMENTOS (BACKFILL) ---
+def historico_yahoo(simbolos, inicio, fim=None, tamanho_lote=50):
+    """
+    Fechamentos diários de vários símbolos entre 'inicio' e 'fim' com yf.download
+    em lotes. Retorna DataFrame longo [simbolo, data, close] (datas sem fuso).
+    """
+    import yfinance as yf
+
+    simbolos = list(dict.fromkeys(simbolos))
+    partes = []
+    for i in range(0, len(simbolos), tamanho_lote):
+        lote = simbolos[i:i + tamanho_lote]
+        try:
+            # Sem auto_adjust: o patrimônio usa o preço de tela, proventos entram à parte
+            data = executar("YAHOO", yf.download, lote, start=inicio, end=fim, group_by='ticker',
+                            auto_adjust=False, progress=False, threads=True)
+        except Exception as e:
+            print(f"   ⚠️ Erro Yahoo histórico lote {i // tamanho_lote + 1}: {e}")
+            registrar_erro("YAHOO.historico", e)
+            continue
+        for t in lote:
+            try:
+                fechamento = data[t]['Close'] if isinstance(data.columns, pd.MultiIndex) else data['Close']
+            except KeyError:
+                continue
+            fechamento = fechamento.dropna()
+            if fechamento.empty: continue
+            datas = pd.DatetimeIndex(fechamento.index)
+            if datas.tz is not None: datas = datas.tz_localize(None)
+            partes.append(pd.DataFrame({'simbolo': t, 'data': datas.normalize(), 'close': fechamento.values.astype(float)}))
+    if not partes:
+        return pd.DataFrame(columns=['simbolo', 'data', 'close'])
+    return pd.concat(partes, ignore_index=True)
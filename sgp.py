@@ -0,0 +1,113 @@
+import os
+import time
+import argparse
+from agendador import Etapa, executar_etapas, relatorio_etapas
+from telemetria import execucao
+
+# --- PIPELINE ÚNICO: python -m sgp run prices,funds,dividends ---
+# Os scripts update_* viram estágios de um só processo: uma Sessao (uma
+# autenticação, cada aba de entrada lida uma vez) e os clientes HTTP/limitadores
+# de provedores.py compartilhados. Leituras e estágios formam um DAG no agendador:
+# cada estágio começa assim que as abas de que precisa estão em memória, e os
+# independentes rodam em paralelo. No final, uma única escrita por aba de saída
+# (a market_data é mesclada por ticker, ver planilhas.Sessao).
+# Os estágios e a Sessao são importados só quando rodam: 'list' e erros de
+# argumento respondem sem carregar pandas, gspread ou yfinance.
+
+def _prices(sessao, opcoes):
+    from update_market_data import update_prices
+    update_prices(backfill=opcoes.get('backfill'), refresh=opcoes.get('refresh', False), sessao=sessao)
+
+def _yahoo(sessao, opcoes):
+    from update_prices import update_portfolio_prices
+    update_portfolio_prices(sessao=sessao)
+
+def _funds(sessao, opcoes):
+    from update_funds import update_portfolio_funds
+    update_portfolio_funds(sessao=sessao)
+
+def _dividends(sessao, opcoes):
+    from update_dividends import update_dividends
+    update_dividends(sessao=sessao)
+
+def _history(sessao, opcoes):
+    import update_dividend_history as udh
+    udh.main(workers=opcoes.get('workers') or udh.MAX_WORKERS, refresh=opcoes.get('refresh', False),
+             completo=opcoes.get('completo', False), sessao=sessao)
+
+# Leituras (nós do DAG): aba -> função da sessão que a deixa em memória
+LEITURAS = {
+    'assets': lambda sessao: sessao.tabela('assets'),
+    'transactions': lambda sessao: sessao.tabela('transactions'),
+    'market_data': lambda sessao: sessao.valores('market_data'),
+}
+
+# estágio -> (função, abas lidas, prazo em segundos; sobrescreva com PRAZO_<ESTÁGIO>, ex: PRAZO_HISTORY)
+ESTAGIOS = {
+    'prices': (_prices, ['assets', 'market_data'], 900),
+    'funds': (_funds, ['assets', 'market_data'], 600),
+    'yahoo': (_yahoo, ['transactions', 'assets', 'market_data'], 600),
+    'dividends': (_dividends, ['assets'], 900),
+    'history': (_history, ['transactions', 'assets'], 1800),
+}
+PRAZO_LEITURA = 120
+
+def prazo_estagio(nome):
+    padrao = ESTAGIOS[nome][2] if nome in ESTAGIOS else PRAZO_LEITURA
+    return float(os.environ.get(f"PRAZO_{nome.upper()}", padrao))
+
+def selecionar(texto):
+    """Lista de estágios a partir de 'prices,funds' (ou 'all'), na ordem de ESTAGIOS."""
+    pedidos = [p.strip().lower() for p in str(texto).split(',') if p.strip()]
+    if 'all' in pedidos: return list(ESTAGIOS)
+    desconhecidos = [p for p in pedidos if p not in ESTAGIOS]
+    if desconhecidos: raise ValueError(f"Estágios desconhecidos: {', '.join(desconhecidos)} (disponíveis: {', '.join(ESTAGIOS)})")
+    return [e for e in ESTAGIOS if e in pedidos]
+
+def montar_etapas(estagios, sessao, opcoes=None):
+    """Etapas do agendador: as leituras que os estágios pedem e os estágios, dependendo delas."""
+    opcoes = opcoes or {}
+    abas = list(dict.fromkeys(a for e in estagios for a in ESTAGIOS[e][1]))
+    etapas = [Etapa(a, lambda _, a=a: len(LEITURAS[a](sessao)), prazo_estagio(a)) for a in abas]
+    for e in estagios:
+        funcao, depende, _ = ESTAGIOS[e]
+        etapas.append(Etapa(e, lambda _, f=funcao: f(sessao, opcoes), prazo_estagio(e), depende=depende))
+    return etapas
+
+def run(estagios, sessao=None, **opcoes):
+    """Roda os estágios (DAG com leituras compartilhadas) e grava cada aba de saída uma vez."""
+    if sessao is None:
+        from planilhas import Sessao
+        sessao = Sessao()
+    print(f"--- 🚀 Pipeline SGP: {', '.join(estagios)} ---")
+    t0 = time.perf_counter()
+    resultados = executar_etapas(montar_etapas(estagios, sessao, opcoes))
+    relatorio_etapas(resultados, time.perf_counter() - t0,
+                     {nome: r['valor'] for nome, r in resultados.items() if nome in LEITURAS and r['valor'] is not None})
+    print("--- 💾 Gravação consolidada ---")
+    sessao.gravar()
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m sgp", description="Pipeline de atualização do SGP")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_run = sub.add_parser("run", help="Roda os estágios pedidos (ex: prices,funds,dividends ou all)")
+    p_run.add_argument("estagios", help=f"Estágios separados por vírgula: {', '.join(ESTAGIOS)} ou all")
+    p_run.add_argument("--backfill", metavar="AAAA-MM-DD", help="prices: preenche o histórico de preços desde esta data")
+    p_run.add_argument("--refresh", action="store_true", help="prices/history: ignora os caches locais e consulta tudo")
+    p_run.add_argument("--full", action="store_true", help="history: recalcula o histórico de todos os ativos")
+    p_run.add_argument("--workers", type=int, help="history: consultas simultâneas aos provedores")
+    p_run.add_argument("--report", action="store_true", help="Imprime a tabela de telemetria no final")
+    sub.add_parser("list", help="Lista os estágios e as abas que cada um lê")
+    args = parser.parse_args()
+
+    if args.comando == "list":
+        for nome, (_, abas, prazo) in ESTAGIOS.items():
+            print(f"{nome:10s} lê {', '.join(abas):35s} prazo {prazo_estagio(nome):.0f}s")
+    else:
+        try:
+            estagios = selecionar(args.estagios)
+        except ValueError as e:
+            parser.error(str(e))
+        with execucao("sgp", resumo=args.report):
+            run(estagios, backfill=args.backfill, refresh=args.refresh, completo=args.full, workers=args.workers)
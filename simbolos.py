@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import threading
+import pandas as pd
+from posicoes import RENAME_MAP, ticker_atual
+from telemetria import contar, registrar_erro
+
+# --- RESOLVEDOR DE SÍMBOLOS ---
+# Uma tabela por execução, montada a partir da aba assets (type, currency,
+# isin_cnpj) e do RENAME_MAP: para cada ticker, o ticker vigente e o símbolo em
+# cada fonte (BRAPI, Yahoo, CNPJ na CVM, chave do Tesouro). Tickers que não estão
+# no cadastro (ex: só nas transações) caem nas mesmas regras pelo formato do nome.
+# Consultas que a fonte não respondeu ficam em AUSENTES_PATH: depois de
+# MIN_FALHAS execuções seguidas sem resposta o símbolo é dado como morto e só é
+# consultado de novo após REVISAO_AUSENTES.
+
+TIPOS_BR = ['ACAO_BR', 'FII', 'ETF_BR', 'BDR']      # B3: BRAPI e Yahoo com .SA
+TIPOS_EXTERIOR = ['ETF_US', 'ACAO_US', 'STOCK', 'REIT']  # Yahoo com o símbolo como está
+TIPOS_FUNDO = ['FUNDO']
+TIPOS_TESOURO = ['TESOURO']
+MARCAS_MANUAL = ['S', 'SIM', '1', 'TRUE']
+# Nomes que nunca têm cotação de mercado (renda fixa, previdência, ajustes): o
+# prefixo tem de vir inteiro, seguido de separador, número ou fim ('LCA BB 2027',
+# 'CDB2027', 'TD_IPCA'), para não pegar símbolos como LCID ou NANR
+SEM_COTACAO = ['FUNDO', 'LCA', 'LCI', 'CDB', 'FGTS', 'PREVIDENCIA', 'PREV', 'TD', 'UNKNOWN', 'NAN', 'NONE']
+PADRAO_SEM_COTACAO = re.compile(r'^(?:%s)(?![A-Z])' % '|'.join(SEM_COTACAO))
+PADRAO_B3 = re.compile(r'^[A-Z]{4}\d{1,2}$')  # PETR4, TAEE11, AAPL34
+PADRAO_EXTERIOR = re.compile(r'^[A-Z]{1,5}(-[A-Z])?$')  # VOO, AAPL, BRK-B
+
+AUSENTES_PATH = os.environ.get("SGP_SIMBOLOS_AUSENTES", os.path.join("cache", "simbolos_ausentes.json"))
+MIN_FALHAS = int(os.environ.get("SGP_AUSENTE_FALHAS", 3))
+REVISAO_AUSENTES = float(os.environ.get("SGP_AUSENTE_REVISAO_DIAS", 7)) * 86400
+
+def _cnpj(valor):
+    texto = str(valor if valor is not None else '')
+    # ISIN (BRPETRACNOR9) não é CNPJ; número sem os zeros à esquerda é
+    if re.search(r'[A-Za-z]', texto): return None
+    digitos = re.sub(r'\D', '', texto)
+    # Filial + dígitos (0001-91) nunca somem; os zeros à esquerda da raiz, sim
+    return digitos.zfill(14) if 8 <= len(digitos) <= 14 else None
+
+def _inferir_tipo(ticker, moeda=''):
+    if not ticker or PADRAO_SEM_COTACAO.match(ticker): return 'SEM_COTACAO'
+    if ticker.endswith('=X'): return 'CAMBIO'
+    if ticker.endswith('.SA') or PADRAO_B3.match(ticker): return 'ACAO_BR'
+    if (moeda and moeda != 'BRL') or PADRAO_EXTERIOR.match(ticker): return 'ETF_US'
+    return 'SEM_COTACAO'
+
+class Resolvedor:
+    """Tabela ticker -> símbolos por fonte; consultas a tickers fora do cadastro são inferidas e guardadas."""
+    def __init__(self, df_assets=None, renomear=RENAME_MAP):
+        self.renomear = renomear
+        self._linhas = {}
+        self._cadastro = []
+        if df_assets is not None and not df_assets.empty:
+            colunas = {c: c.lower().strip() for c in df_assets.columns}
+            df = df_assets.rename(columns=colunas)
+            for r in df.to_dict('records'):
+                ticker = str(r.get('ticker', '')).strip().upper()
+                if not ticker: continue
+                manual = str(r.get('manual_update', '')).strip().upper() in MARCAS_MANUAL
+                linha = self._montar(ticker, str(r.get('type', '')).strip().upper(),
+                                     str(r.get('currency', '') or '').strip().upper(), r.get('isin_cnpj'), manual)
+                if ticker not in self._linhas: self._cadastro.append(ticker)
+                self._linhas[ticker] = linha
+            self._chaves_tesouro([l for l in self._linhas.values() if l['tipo'] in TIPOS_TESOURO])
+
+    @staticmethod
+    def _chaves_tesouro(linhas):
+        # Uma única passada pelo parser de títulos para todo o cadastro do Tesouro
+        if not linhas: return
+        from tesouro import chaves_titulos
+        chaves = chaves_titulos([l['atual'] for l in linhas])
+        for linha, tipo, ano in zip(linhas, chaves['tipo'], chaves['ano']):
+            if pd.notna(ano): linha['tesouro'] = f"{tipo}:{int(ano)}"
+
+    def _montar(self, ticker, tipo='', moeda='', cnpj=None, manual=False):
+        base = ticker[:-3] if ticker.endswith('.SA') else ticker
+        atual = ticker_atual(base, self.renomear)
+        if tipo not in TIPOS_BR + TIPOS_EXTERIOR + TIPOS_FUNDO + TIPOS_TESOURO:
+            tipo = _inferir_tipo(atual, moeda) if not tipo or tipo == 'NAN' else tipo
+        linha = {'ticker': ticker, 'atual': atual, 'tipo': tipo, 'moeda': moeda, 'manual': manual,
+                 'brapi': None, 'yahoo': None, 'cnpj': _cnpj(cnpj), 'tesouro': None}
+        if tipo in TIPOS_BR:
+            linha['brapi'], linha['yahoo'] = atual, f"{atual}.SA"
+        elif tipo in TIPOS_EXTERIOR or tipo == 'CAMBIO':
+            linha['yahoo'] = atual
+        return linha
+
+    def info(self, ticker):
+        """Linha da tabela do ticker (cadastrado ou inferido pelo nome)."""
+        t = str(ticker).strip().upper()
+        if t not in self._linhas:
+            self._linhas[t] = self._montar(t)
+        return self._linhas[t]
+
+    def atual(self, ticker): return self.info(ticker)['atual']
+    def brapi(self, ticker): return self.info(ticker)['brapi']
+    def yahoo(self, ticker): return self.info(ticker)['yahoo']
+    def cnpj(self, ticker): return self.info(ticker)['cnpj']
+    def tesouro(self, ticker): return self.info(ticker)['tesouro']
+
+    def sem_cotacao(self, ticker):
+        """Renda fixa, previdência e afins: sem cotação de mercado pelo tipo ou pelo nome (SEM_COTACAO)."""
+        linha = self.info(ticker)
+        return linha['tipo'] == 'SEM_COTACAO' or bool(PADRAO_SEM_COTACAO.match(linha['atual']))
+
+    def cadastrados(self, tipos=None, manuais=False):
+        """Tickers do cadastro (na ordem da aba), opcionalmente só dos 'tipos' dados; manuais ficam de fora."""
+        return [t for t in self._cadastro
+                if (tipos is None or self._linhas[t]['tipo'] in tipos) and (manuais or not self._linhas[t]['manual'])]
+
+    def manuais(self):
+        return [t for t in self._cadastro if self._linhas[t]['manual']]
+
+    def tabela(self):
+        return pd.DataFrame(list(self._linhas.values()))
+
+class Ausentes:
+    """Símbolos que a fonte não devolveu, com a contagem de execuções seguidas sem resposta."""
+    def __init__(self, caminho=AUSENTES_PATH, min_falhas=MIN_FALHAS, revisao=REVISAO_AUSENTES):
+        self.caminho, self.min_falhas, self.revisao = caminho, min_falhas, revisao
+        self._lock = threading.Lock()
+        self._dados = {}
+        if caminho and os.path.exists(caminho):
+            try:
+                with open(caminho, encoding="utf-8") as f:
+                    self._dados = json.load(f)
+            except (OSError, ValueError) as e:
+                registrar_erro("simbolos_ausentes.leitura", e)
+
+    def mortos(self, fonte):
+        agora = time.time()
+        with self._lock:
+            return {s for s, (n, ultima) in self._dados.get(fonte, {}).items()
+                    if n >= self.min_falhas and agora - ultima < self.revisao}
+
+    def filtrar(self, fonte, simbolos):
+        """Os 'simbolos' que ainda vale consultar (os mortos são contados e ficam de fora)."""
+        mortos = self.mortos(fonte)
+        vivos = [s for s in simbolos if s not in mortos]
+        contar(f"simbolos.{fonte}.pulados", len(simbolos) - len(vivos))
+        return vivos
+
+    def registrar(self, fonte, consultados, encontrados):
+        """Depois de uma consulta real: zera quem respondeu, soma uma falha para quem não."""
+        # Nenhuma resposta: fonte fora do ar, não é culpa dos símbolos
+        if not encontrados: return
+        agora = time.time()
+        with self._lock:
+            entradas = self._dados.setdefault(fonte, {})
+            for s in consultados:
+                if s in encontrados:
+                    entradas.pop(s, None)
+                else:
+                    entradas[s] = [entradas.get(s, [0, 0])[0] + 1, agora]
+
+    def salvar(self):
+        if not self.caminho: return
+        pasta = os.path.dirname(self.caminho)
+        if pasta: os.makedirs(pasta, exist_ok=True)
+        with self._lock:
+            dados = json.dumps(self._dados, ensure_ascii=False)
+        with open(self.caminho + ".tmp", "w", encoding="utf-8") as f:
+            f.write(dados)
+        os.replace(self.caminho + ".tmp", self.caminho)
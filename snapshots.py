@@ -0,0 +1,98 @@
+import os
+import datetime
+import pandas as pd
+
+# --- SNAPSHOTS LOCAIS (ARROW) ---
+# Os scripts de atualização publicam, além da aba no Sheets, uma cópia colunar de
+# cada tabela em SNAPSHOT_DIR/<aba>/<versao>.arrow. O arquivo LATEST de cada aba
+# aponta para a versão mais recente e é trocado de forma atômica (os.replace),
+# então o leitor nunca pega um arquivo pela metade. Os arquivos são gravados sem
+# compressão para que o app possa abri-los com memory-map.
+
+SNAPSHOT_DIR = os.environ.get("SGP_SNAPSHOTS", os.path.join("cache", "snapshots"))
+MANTER_VERSOES = 5
+
+def valores_para_df(valores):
+    """
+    Converte a matriz crua da aba (cabeçalho + linhas) em DataFrame, como o
+    get_all_records: linhas curtas são completadas com "" e colunas em que todo
+    valor preenchido é número viram numéricas (vazios viram NaN).
+    """
+    if not valores: return pd.DataFrame()
+    cabecalho, linhas = valores[0], valores[1:]
+    largura = len(cabecalho)
+    df = pd.DataFrame([list(r[:largura]) + [""] * (largura - len(r)) for r in linhas], columns=cabecalho, dtype=object)
+    for c in df.columns:
+        preenchidos = df[c][df[c] != ""]
+        if preenchidos.empty: continue
+        num = pd.to_numeric(preenchidos, errors='coerce')
+        if num.notna().all():
+            df[c] = pd.to_numeric(df[c].replace("", None), errors='coerce')
+    return df
+
+def _pasta_aba(aba, pasta):
+    return os.path.join(pasta, aba)
+
+def versao_snapshot(aba, pasta=SNAPSHOT_DIR):
+    """Versão mais recente publicada para 'aba' (None se não houver snapshot)."""
+    try:
+        with open(os.path.join(_pasta_aba(aba, pasta), "LATEST")) as f:
+            versao = f.read().strip()
+    except OSError:
+        return None
+    return versao or None
+
+def publicar_snapshot(aba, valores, versao=None, pasta=SNAPSHOT_DIR, manter=MANTER_VERSOES):
+    """
+    Grava 'valores' (matriz com cabeçalho, como enviada ao Sheets, ou DataFrame) como
+    nova versão de 'aba' e atualiza o LATEST. Retorna a versão, ou None se falhar.
+    """
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        print(f"⚠️ pyarrow não instalado: snapshot de {aba} não publicado.")
+        return None
+
+    df = valores if isinstance(valores, pd.DataFrame) else valores_para_df(valores)
+    df = df.copy()
+    # Colunas mistas (número e texto) viram texto: o Arrow exige um tipo por coluna
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].map(lambda v: "" if v is None else str(v))
+    df.columns = [str(c) for c in df.columns]
+
+    versao = versao or datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    destino = _pasta_aba(aba, pasta)
+    try:
+        os.makedirs(destino, exist_ok=True)
+        arquivo = os.path.join(destino, f"{versao}.arrow")
+        feather.write_feather(df, arquivo + ".tmp", compression='uncompressed')
+        os.replace(arquivo + ".tmp", arquivo)
+        with open(os.path.join(destino, "LATEST.tmp"), "w") as f:
+            f.write(versao)
+        os.replace(os.path.join(destino, "LATEST.tmp"), os.path.join(destino, "LATEST"))
+    except OSError as e:
+        print(f"⚠️ Falha ao publicar snapshot de {aba}: {e}")
+        return None
+
+    # Mantém só as versões mais recentes
+    antigas = sorted((n for n in os.listdir(destino) if n.endswith(".arrow")),
+                     key=lambda n: os.path.getmtime(os.path.join(destino, n)))
+    for nome in antigas[:-manter]:
+        try: os.remove(os.path.join(destino, nome))
+        except OSError: pass
+    return versao
+
+def ler_snapshot(aba, versao=None, pasta=SNAPSHOT_DIR):
+    """DataFrame da versão pedida (ou da mais recente) de 'aba'; None se não existir."""
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return None
+    versao = versao or versao_snapshot(aba, pasta)
+    if not versao: return None
+    try:
+        tabela = feather.read_table(os.path.join(_pasta_aba(aba, pasta), f"{versao}.arrow"), memory_map=True)
+    except (OSError, ValueError):
+        return None
+    return tabela.to_pandas()
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+import contextlib
+from collections import defaultdict
+
+# --- TELEMETRIA DAS EXECUÇÕES ---
+# Trechos cronometrados (etapas, chamadas a provedores), contadores (acertos de
+# cache, fallbacks, retries) e erros engolidos pelos scripts ficam num coletor do
+# processo. execucao() envolve o script inteiro: grava um relatório JSON em
+# TELEMETRIA_DIR e, com --report, imprime a tabela-resumo no final.
+# SGP_PERFIL=cprofile (ou pyinstrument) liga também o profiler na execução.
+
+TELEMETRIA_DIR = os.environ.get("SGP_TELEMETRIA", os.path.join("cache", "telemetria"))
+PERFIL = os.environ.get("SGP_PERFIL", "").strip().lower()
+MAX_ERROS = 200  # só os primeiros vão para o relatório; a contagem é sempre completa
+
+class Coletor:
+    """Acumula trechos, contadores e erros; seguro para várias threads."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.trechos = defaultdict(lambda: {'n': 0, 'segundos': 0.0, 'max': 0.0, 'erros': 0})
+        self.contadores = defaultdict(int)
+        self.erros = []
+
+    def trecho(self, nome, segundos, erro=False):
+        with self._lock:
+            t = self.trechos[nome]
+            t['n'] += 1
+            t['segundos'] += segundos
+            t['max'] = max(t['max'], segundos)
+            t['erros'] += int(erro)
+
+    def contar(self, nome, n=1):
+        with self._lock:
+            self.contadores[nome] += n
+
+    def erro(self, onde, e):
+        with self._lock:
+            self.contadores[f"erro.{onde}"] += 1
+            if len(self.erros) < MAX_ERROS:
+                self.erros.append({'onde': onde, 'tipo': type(e).__name__, 'mensagem': str(e)[:300]})
+
+_coletor = Coletor()
+
+def coletor():
+    return _coletor
+
+@contextlib.contextmanager
+def medir(nome):
+    """Cronometra o bloco sob 'nome' (chamadas repetidas são somadas). Exceções sobem."""
+    t0 = time.perf_counter()
+    erro = False
+    try:
+        yield
+    except BaseException:
+        erro = True
+        raise
+    finally:
+        _coletor.trecho(nome, time.perf_counter() - t0, erro)
+
+def contar(nome, n=1):
+    _coletor.contar(nome, n)
+
+def registrar_erro(onde, e):
+    """Para os 'except' que seguem em frente: o erro não some, vai para o relatório."""
+    _coletor.erro(onde, e)
+
+# cProfile e pyinstrument só enxergam a thread que os ligou, e o trabalho pesado
+# roda nas threads das etapas (agendador) e dos pools dos provedores. Com
+# cProfile, threading.setprofile liga um profiler próprio em cada thread criada
+# durante a execução e no final as estatísticas são somadas num único .prof.
+# O pyinstrument amostra por thread e precisa ser parado na mesma thread: cada
+# etapa do agendador abre o seu (perfil_thread) e as sessões são combinadas.
+_perfis_threads = None  # sessões de pyinstrument das etapas enquanto _perfil está ativo
+_perfis_lock = threading.Lock()
+
+@contextlib.contextmanager
+def perfil_thread():
+    """Amostra a thread atual com pyinstrument se o perfil da execução for pyinstrument."""
+    if _perfis_threads is None:
+        yield
+        return
+    from pyinstrument import Profiler
+    profiler = Profiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        sessao = profiler.stop()
+        with _perfis_lock:
+            if _perfis_threads is not None:
+                _perfis_threads.append(sessao)
+
+@contextlib.contextmanager
+def _perfil(script, pasta):
+    global _perfis_threads
+    if PERFIL not in ("cprofile", "pyinstrument"):
+        yield None
+        return
+    os.makedirs(pasta, exist_ok=True)
+    base = os.path.join(pasta, f"{script}-{datetime.datetime.now().strftime('%Y%m%dT%H%M%S')}")
+    if PERFIL == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+            from pyinstrument.session import Session
+            from pyinstrument.renderers import HTMLRenderer
+        except ImportError:
+            print("   ⚠️ pyinstrument não instalado; usando cProfile.")
+        else:
+            profiler = Profiler()
+            _perfis_threads = []
+            profiler.start()
+            try:
+                yield base + ".html"
+            finally:
+                sessao = profiler.stop()
+                with _perfis_lock:
+                    sessoes, _perfis_threads = _perfis_threads, None
+                for outra in sessoes:
+                    sessao = Session.combine(sessao, outra)
+                with open(base + ".html", "w", encoding="utf-8") as f:
+                    f.write(HTMLRenderer().render(sessao))
+            return
+    import cProfile
+    import pstats
+    perfis = []  # (thread, profiler) de cada thread iniciada durante a execução
+
+    def _ligar_na_thread(*_):
+        # Primeiro evento da thread nova: troca este gancho por um profiler dela
+        profiler = cProfile.Profile()
+        with _perfis_lock:
+            perfis.append((threading.current_thread(), profiler))
+        profiler.enable()
+
+    profiler = cProfile.Profile()
+    threading.setprofile(_ligar_na_thread)
+    profiler.enable()
+    try:
+        yield base + ".prof"
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+        estatisticas = pstats.Stats(profiler)
+        with _perfis_lock:
+            encerradas = [p for t, p in perfis if not t.is_alive()]
+        # Threads ainda vivas (etapas fora do prazo) seguem mexendo no próprio profiler
+        for p in encerradas:
+            p.create_stats()
+            if p.stats:
+                estatisticas.add(p)
+        estatisticas.dump_stats(base + ".prof")
+
+def relatorio(script, segundos, status, perfil=None):
+    """Dicionário serializável com o estado atual do coletor."""
+    with _coletor._lock:
+        trechos = {k: dict(v, segundos=round(v['segundos'], 4), max=round(v['max'], 4)) for k, v in _coletor.trechos.items()}
+        return {
+            'script': script,
+            'inicio': (datetime.datetime.now() - datetime.timedelta(seconds=segundos)).isoformat(timespec='seconds'),
+            'segundos': round(segundos, 3),
+            'status': status,
+            'argv': sys.argv[1:],
+            'perfil': perfil,
+            'trechos': trechos,
+            'contadores': dict(sorted(_coletor.contadores.items())),
+            'erros': list(_coletor.erros),
+        }
+
+def gravar_relatorio(dados, pasta=TELEMETRIA_DIR):
+    """Grava <script>-<instante>.json e ultimo-<script>.json. Retorna o caminho do primeiro."""
+    os.makedirs(pasta, exist_ok=True)
+    instante = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    caminho = os.path.join(pasta, f"{dados['script']}-{instante}.json")
+    for destino in (caminho, os.path.join(pasta, f"ultimo-{dados['script']}.json")):
+        with open(destino + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False, indent=1)
+        os.replace(destino + ".tmp", destino)
+    return caminho
+
+def imprimir_relatorio(dados):
+    """Tabela-resumo: trechos por tempo total, contadores e erros agrupados."""
+    print(f"--- 📊 Relatório: {dados['script']} ({dados['status']}, {dados['segundos']:.1f}s) ---")
+    if dados['trechos']:
+        print(f"   {'trecho':32s} {'n':>6s} {'total':>9s} {'médio':>9s} {'máx':>9s} {'erros':>6s}")
+        for nome, t in sorted(dados['trechos'].items(), key=lambda kv: -kv[1]['segundos']):
+            medio = t['segundos'] / t['n'] if t['n'] else 0.0
+            print(f"   {nome[:32]:32s} {t['n']:6d} {t['segundos']:8.2f}s {medio:8.3f}s {t['max']:8.3f}s {t['erros']:6d}")
+    contadores = {k: v for k, v in dados['contadores'].items() if not k.startswith('erro.')}
+    if contadores:
+        print("   Contadores: " + " · ".join(f"{k} {v}" for k, v in contadores.items()))
+    erros = {k[5:]: v for k, v in dados['contadores'].items() if k.startswith('erro.')}
+    if erros:
+        print("   ⚠️ Erros tratados: " + " · ".join(f"{k} {v}" for k, v in sorted(erros.items(), key=lambda kv: -kv[1])))
+    if dados.get('perfil'):
+        print(f"   Perfil: {dados['perfil']}")
+
+@contextlib.contextmanager
+def execucao(script, resumo=False, pasta=TELEMETRIA_DIR):
+    """
+    Envolve a execução de um script: perfil opcional (SGP_PERFIL), relatório JSON
+    gravado mesmo se o script falhar e, com 'resumo', a tabela impressa no final.
+    """
+    t0 = time.perf_counter()
+    status = 'erro'
+    perfil = None
+    try:
+        with _perfil(script, pasta) as perfil, medir(script):
+            yield _coletor
+        status = 'ok'
+    finally:
+        dados = relatorio(script, time.perf_counter() - t0, status, perfil)
+        try:
+            caminho = gravar_relatorio(dados, pasta)
+        except OSError as e:
+            caminho = None
+            print(f"   ⚠️ Relatório de telemetria não gravado: {e}")
+        if resumo:
+            imprimir_relatorio(dados)
+            if caminho: print(f"   JSON: {caminho}")
+
+if __name__ == "__main__":
+    # python telemetria.py [arquivo.json | script]: reimprime um relatório gravado
+    alvo = sys.argv[1] if len(sys.argv) > 1 else "update_market_data"
+    if not alvo.endswith(".json"):
+        alvo = os.path.join(TELEMETRIA_DIR, f"ultimo-{alvo}.json")
+    with open(alvo, encoding="utf-8") as f:
+        imprimir_relatorio(json.load(f))
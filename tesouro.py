@@ -0,0 +1,172 @@
+import os
+import io
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import requests
+from provedores import cliente
+from telemetria import contar, registrar_erro
+
+# --- TESOURO DIRETO: ÍNDICE LOCAL DE PREÇOS ---
+# O CSV de preços/taxas do Tesouro traz todo o histórico desde 2002. Ele só é
+# baixado de novo quando o servidor diz que mudou (If-Modified-Since/ETag) e é
+# guardado num SQLite local em duas tabelas: o histórico de PU por título e uma
+# tabela compacta com o PU da última Data Base, chaveada por (tipo, ano de vencimento),
+# que é como os ativos TESOURO são nomeados no cadastro (ex: IPCA35, SELIC29).
+
+TESOURO_INDEX_PATH = os.environ.get("TESOURO_INDEX", os.path.join("cache", "tesouro.sqlite"))
+CKAN_URL = "https://www.tesourotransparente.gov.br/ckan/api/3/action/package_show?id=taxas-do-tesouro-direto"
+CSV_PADRAO = "https://www.tesourotransparente.gov.br/ckan/dataset/df56aa42-484a-4a59-8184-7676580c81e3/resource/796d2059-14e9-44e3-80c9-2d9e30b405c1/download/precotaxatesourodireto.csv"
+TTL_URL = 7 * 24 * 3600  # a URL do recurso no CKAN quase nunca muda
+COLUNAS = ['Tipo Titulo', 'Data Vencimento', 'Data Base', 'PU Base Manha']
+
+def _conectar(caminho):
+    pasta = os.path.dirname(caminho)
+    if pasta: os.makedirs(pasta, exist_ok=True)
+    conn = sqlite3.connect(caminho)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT);
+        CREATE TABLE IF NOT EXISTS precos (
+            titulo TEXT, vencimento TEXT, data_base TEXT, pu REAL,
+            PRIMARY KEY (titulo, vencimento, data_base)
+        );
+        CREATE TABLE IF NOT EXISTS ultimos (
+            tipo TEXT, ano INTEGER, titulo TEXT, vencimento TEXT, data_base TEXT, pu REAL,
+            PRIMARY KEY (tipo, ano)
+        );
+    """)
+    return conn
+
+def _meta(conn, chave):
+    linha = conn.execute("SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+    return linha[0] if linha else None
+
+def _tipo(titulos):
+    # Mesmas categorias dos tickers do cadastro; títulos de outros tipos ficam de fora
+    t = pd.Series(titulos).astype(str).str.upper()
+    return pd.Series(np.select([t.str.contains('IPCA'), t.str.contains('SELIC'), t.str.contains('PREFIXADO')],
+                               ['IPCA', 'SELIC', 'PREFIXADO'], default=None), index=t.index)
+
+def chaves_titulos(tickers):
+    """DataFrame [ticker, tipo, ano] a partir dos tickers do cadastro (ex: 'IPCA35' -> IPCA, 2035)."""
+    t = pd.Series(list(tickers), dtype=str).str.strip().str.upper()
+    digitos = t.str.replace(r'\D', '', regex=True)
+    digitos = digitos.where(digitos.str.len() != 2, "20" + digitos)
+    tipo = pd.Series('PREFIXADO', index=t.index).mask(t.str.contains('SELIC'), 'SELIC').mask(t.str.contains('IPCA'), 'IPCA')
+    return pd.DataFrame({'ticker': t, 'tipo': tipo, 'ano': pd.to_numeric(digitos, errors='coerce').astype('Int64')})
+
+def _chaves(titulos):
+    # {ticker: 'TIPO:ANO'} já resolvido (Resolvedor) ou lista de tickers (chave pelo nome)
+    if not isinstance(titulos, dict):
+        return chaves_titulos(titulos).dropna(subset=['ano'])
+    pares = [(t, *str(c).split(':')) for t, c in titulos.items() if c]
+    return pd.DataFrame({'ticker': [p[0] for p in pares], 'tipo': [p[1] for p in pares],
+                         'ano': pd.array([int(p[2]) for p in pares], dtype='Int64')})
+
+def get_tesouro_url(conn=None):
+    """URL do CSV pelo CKAN, guardada no índice por TTL_URL (fallback: URL conhecida)."""
+    if conn is not None:
+        url, em = _meta(conn, 'url'), _meta(conn, 'url_em')
+        if url and em and time.time() - float(em) < TTL_URL: return url
+    try:
+        resources = cliente("TESOURO").get(CKAN_URL).json()['result']['resources']
+        for res in resources:
+            if "PrecoTaxa" in res['name'] or ("Preco" in res['name'] and res['format'].lower() == "csv"):
+                if conn is not None:
+                    with conn:
+                        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                         [('url', res['url']), ('url_em', str(time.time()))])
+                return res['url']
+    except Exception as e:
+        registrar_erro("TESOURO.ckan", e)
+    contar("TESOURO.url_padrao")
+    return CSV_PADRAO
+
+def ler_csv_tesouro(conteudo):
+    """Só as colunas usadas, com datas e PU já convertidos."""
+    df = pd.read_csv(io.BytesIO(conteudo), sep=';', decimal=',', encoding='latin1', usecols=COLUNAS)
+    return pd.DataFrame({
+        'titulo': df['Tipo Titulo'].astype(str),
+        'vencimento': pd.to_datetime(df['Data Vencimento'], format='%d/%m/%Y', errors='coerce'),
+        'data_base': pd.to_datetime(df['Data Base'], format='%d/%m/%Y', errors='coerce'),
+        'pu': pd.to_numeric(df['PU Base Manha'], errors='coerce'),
+    }).dropna()
+
+def _gravar_indice(conn, df, etag, last_modified):
+    # Última Data Base: primeiro título do CSV para cada (tipo, ano), como no filtro antigo
+    ultimo = df[df['data_base'] == df['data_base'].max()].assign(tipo=lambda d: _tipo(d['titulo']), ano=lambda d: d['vencimento'].dt.year)
+    ultimo = ultimo.dropna(subset=['tipo']).drop_duplicates(['tipo', 'ano'], keep='first')
+    dia = lambda s: s.values.astype('datetime64[D]').astype(str)  # ISO sem strftime linha a linha
+    with conn:
+        conn.execute("DELETE FROM precos")
+        conn.executemany("INSERT OR REPLACE INTO precos VALUES (?, ?, ?, ?)",
+                         zip(df['titulo'].tolist(), dia(df['vencimento']).tolist(), dia(df['data_base']).tolist(), df['pu'].astype(float).tolist()))
+        conn.execute("DELETE FROM ultimos")
+        conn.executemany("INSERT OR REPLACE INTO ultimos VALUES (?, ?, ?, ?, ?, ?)",
+                         zip(ultimo['tipo'], ultimo['ano'].astype(int), ultimo['titulo'], dia(ultimo['vencimento']),
+                             dia(ultimo['data_base']), ultimo['pu'].astype(float)))
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         [('etag', etag or ''), ('last_modified', last_modified or '')])
+
+def atualizar_indice(url=None, timeout=60, caminho=TESOURO_INDEX_PATH):
+    """
+    Baixa o CSV só se mudou desde o último download. Retorna 'novo', 'inalterado'
+    (304) ou 'offline' (falha de rede com índice existente); sem índice, a falha sobe.
+    """
+    conn = _conectar(caminho)
+    try:
+        tem_indice = conn.execute("SELECT 1 FROM ultimos LIMIT 1").fetchone() is not None
+        headers = {}
+        if tem_indice:
+            if _meta(conn, 'etag'): headers['If-None-Match'] = _meta(conn, 'etag')
+            if _meta(conn, 'last_modified'): headers['If-Modified-Since'] = _meta(conn, 'last_modified')
+        try:
+            resp = cliente("TESOURO").get(url or get_tesouro_url(conn), headers=headers, timeout=timeout)
+        except requests.RequestException:
+            if tem_indice: return 'offline'
+            raise
+        if resp.status_code == 304 and tem_indice:
+            return 'inalterado'
+        resp.raise_for_status()
+        _gravar_indice(conn, ler_csv_tesouro(resp.content), resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        return 'novo'
+    finally:
+        conn.close()
+
+def ultimos_pus(tickers, caminho=TESOURO_INDEX_PATH):
+    """
+    DataFrame [ticker, pu, data_base] da última Data Base, num único merge por (tipo, ano).
+    'tickers' pode ser {ticker: 'TIPO:ANO'} (chave do Resolvedor) ou só os tickers.
+    """
+    conn = _conectar(caminho)
+    try:
+        ultimos = pd.read_sql_query("SELECT tipo, ano, pu, data_base FROM ultimos", conn)
+    finally:
+        conn.close()
+    chaves = _chaves(tickers)
+    ultimos['ano'] = ultimos['ano'].astype('Int64')
+    df = chaves.merge(ultimos, on=['tipo', 'ano'], how='inner')
+    df['data_base'] = pd.to_datetime(df['data_base'])
+    return df[['ticker', 'pu', 'data_base']].drop_duplicates('ticker').reset_index(drop=True)
+
+def historico_pu(tickers, inicio=None, caminho=TESOURO_INDEX_PATH):
+    """
+    Histórico longo [ticker, data, close] do PU de cada ticker TESOURO, usando o mesmo
+    título escolhido para a cotação atual (tabela 'ultimos'). 'tickers' como em ultimos_pus.
+    """
+    conn = _conectar(caminho)
+    try:
+        consulta = """SELECT u.tipo, u.ano, p.data_base AS data, p.pu AS close
+                      FROM ultimos u JOIN precos p ON p.titulo = u.titulo AND p.vencimento = u.vencimento"""
+        params = []
+        if inicio is not None:
+            consulta += " WHERE p.data_base >= ?"
+            params.append(pd.Timestamp(inicio).strftime('%Y-%m-%d'))
+        hist = pd.read_sql_query(consulta, conn, params=params)
+    finally:
+        conn.close()
+    hist['ano'] = hist['ano'].astype('Int64')
+    df = _chaves(tickers).drop_duplicates('ticker').merge(hist, on=['tipo', 'ano'])
+    df['data'] = pd.to_datetime(df['data'])
+    return df[['ticker', 'data', 'close']].sort_values(['ticker', 'data'], ignore_index=True)
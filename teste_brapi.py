@@ -1,6 +1,6 @@
-import requests
 import os
 import json
+from provedores import BRAPI_URL, cliente
 
 def diagnostico_itub4():
     token = os.environ.get('BRAPI_TOKEN')
@@ -13,11 +13,12 @@ def diagnostico_itub4():
         return
 
     # Testando o endpoint exato da documentação para um único ativo
-    url = f"https://brapi.dev/api/quote/{ticker}?token={token}&fundamental=true&dividends=true"
+    url = f"{BRAPI_URL}/quote/{ticker}"
+    params = {'token': token, 'fundamental': 'true', 'dividends': 'true'}
     
     try:
-        print(f"📡 Enviando requisição para: {url.replace(token, 'REDACTED')}")
-        response = requests.get(url, timeout=30)
+        print(f"📡 Enviando requisição para: {url}?fundamental=true&dividends=true&token=REDACTED")
+        response = cliente("BRAPI").get(url, params=params, timeout=30)
         
         print(f"📊 Status Code: {response.status_code}")
         
@@ -1,26 +1,19 @@
 import pandas as pd
-import yfinance as yf
-import gspread
-from google.oauth2.service_account import Credentials
 import os
-import json
-import time
-import requests
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import timedelta, datetime
+from posicoes import construir_posicoes, quantidades_nas_datas, tickers_atuais
+from simbolos import Resolvedor
+from provedores import BRAPI_URL, cliente, dividendos_yahoo
+from cache_dividendos import CacheDividendos
+from historico_dividendos import EstadoHistorico
+from planilhas import Sessao, agora_gmt3
+from telemetria import execucao, medir, contar, registrar_erro
 
 # --- CONFIGURAÇÃO ---
-SHEET_ID = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8"
-
-def get_google_sheet_client():
-    creds_json_str = os.environ.get("GOOGLE_SHEETS_CREDS")
-    if not creds_json_str:
-        raise ValueError("A secret GOOGLE_SHEETS_CREDS não foi encontrada.")
-    try:
-        creds_json = json.loads(creds_json_str)
-        creds = Credentials.from_service_account_info(creds_json, scopes=['https://www.googleapis.com/auth/spreadsheets'])
-        return gspread.authorize(creds)
-    except Exception as e:
-        raise ValueError(f"Erro ao carregar credenciais JSON: {e}")
+MAX_WORKERS = int(os.environ.get("DIVIDEND_WORKERS", 8))
 
 def clean_float(val):
     if isinstance(val, (int, float)): return float(val)
@@ -33,34 +26,24 @@ def clean_float(val):
         return float(clean)
     except: return 0.0
 
-def calcular_posicao_na_data(df_trans, ticker, data_corte):
-    # data_corte deve ser timestamp
-    mask = (df_trans['ticker'] == ticker) & (df_trans['date'] <= data_corte)
-    transacoes = df_trans[mask]
-    
-    qtd = 0.0
-    for _, row in transacoes.iterrows():
-        q = clean_float(row['quantity'])
-        t = str(row['type']).upper()
-        
-        if t in ['COMPRA', 'BONIFICACAO', 'DESDOBRAMENTO', 'BUY', 'ENTRADA']:
-            qtd += q
-        elif t in ['VENDA', 'AGRUPAMENTO', 'SELL', 'SAIDA']:
-            qtd -= q
-            
-    return max(0.0, qtd)
-
 # --- BRAPI (Melhor para dados históricos BR, inclusive alguns deslistados) ---
-def get_dividends_brapi(ticker):
-    token = os.environ.get("BRAPI_TOKEN")
-    if not token: return None
+def _brapi_range(desde):
+    # Menor janela da BRAPI que cobre o período desde a última data em cache
+    if desde is None: return 'max'
+    dias = (datetime.now() - desde).days
+    for limite, janela in [(28, '1mo'), (90, '3mo'), (180, '6mo'), (365, '1y'), (730, '2y'), (1825, '5y'), (3650, '10y')]:
+        if dias < limite: return janela
+    return 'max'
 
-    # BRAPI não usa .SA
-    symbol = ticker.replace(".SA", "").strip().upper()
+def get_dividends_brapi(ticker, desde=None, resolvedor=None):
+    token = os.environ.get("BRAPI_TOKEN")
+    # Só ativos da B3 estão na BRAPI (sem .SA)
+    symbol = (resolvedor or RESOLVEDOR).brapi(ticker)
+    if not token or not symbol: return None
     
-    url = f"https://brapi.dev/api/quote/{symbol}"
+    url = f"{BRAPI_URL}/quote/{symbol}"
     params = {
-        'range': 'max',
+        'range': _brapi_range(desde),
         'interval': '1d',
         'fundamental': 'false', 
         'dividends': 'true',
@@ -68,7 +51,7 @@ def get_dividends_brapi(ticker):
     }
     
     try:
-        resp = requests.get(url, params=params, timeout=10)
+        resp = cliente("BRAPI").get(url, params=params)
         if resp.status_code != 200: return None
         
         data = resp.json()
@@ -92,75 +75,73 @@ def get_dividends_brapi(ticker):
                     div_dict[dt_obj] = val
                     
         return pd.Series(div_dict).sort_index()
-    except:
+    except Exception as e:
+        registrar_erro("BRAPI.dividendos", e)
         return None
 
 # --- YAHOO (Fallback para internacionais ou falha BRAPI) ---
-def get_dividends_yahoo(ticker):
-    # Yahoo precisa de .SA para BR
-    symbol = ticker.strip().upper()
-    if len(symbol) >= 4 and not symbol.endswith('.SA') and not symbol.endswith('34'):
-         # Regra simples: tem número e não é BDR (34), adiciona .SA
-         if any(char.isdigit() for char in symbol): 
-             symbol += ".SA"
-             
+# Sem a aba assets, o tipo de cada ticker é inferido pelo formato do nome (ver simbolos.py)
+RESOLVEDOR = Resolvedor()
+
+def simbolo_yahoo(ticker, resolvedor=None):
+    # Yahoo precisa de .SA para BR (inclusive BDRs)
+    return (resolvedor or RESOLVEDOR).yahoo(ticker) or str(ticker).strip().upper()
+
+def get_dividends_yahoo(ticker, desde=None, resolvedor=None):
     try:
         # Tenta silenciar warnings de deslistagem capturando stderr se necessário,
         # mas yfinance imprime direto. O try/except segura o crash.
-        stock = yf.Ticker(symbol)
-        divs = stock.dividends
-        if divs.empty: return None
-        divs.index = divs.index.tz_localize(None)
-        return divs
-    except: return None
-
-def main():
-    print("--- 🚀 INICIANDO AUDITORIA DE DIVIDENDOS (FIX DATAS + HÍBRIDO) ---")
-    
-    try:
-        gc = get_google_sheet_client()
-        sh = gc.open_by_key(SHEET_ID)
-        
-        ws_trans = sh.worksheet("transactions")
-        dados = ws_trans.get_all_records()
-        df = pd.DataFrame(dados)
-        
-        # --- CORREÇÃO DE DATA ---
-        # dayfirst=False pois o formato do CSV é YYYY-MM-DD
-        df['date'] = pd.to_datetime(df['date'], dayfirst=False, errors='coerce')
-        
-        # Limpar colunas e tickers
-        df.columns = [c.lower().strip() for c in df.columns]
-        tickers = df['ticker'].unique()
-        print(f"✅ Conectado. {len(tickers)} ativos na carteira.")
-        
+        return dividendos_yahoo(simbolo_yahoo(ticker, resolvedor), desde)
     except Exception as e:
-        print(f"❌ Erro Google Sheets: {e}")
-        return
+        registrar_erro("YAHOO.dividendos", e)
+        return None
 
-    historico_final = []
+# --- BUSCA CONCORRENTE (BRAPI -> YAHOO) ---
+def consultar_dividendos(source, ticker, cache=None, refresh=False, resolvedor=None):
+    """Proventos de um ticker num provedor, passando pelo cache local quando houver."""
+    if source == "BRAPI":
+        simbolo, buscar = (resolvedor or RESOLVEDOR).brapi(ticker), lambda desde: get_dividends_brapi(ticker, desde, resolvedor)
+        # Ativo fora da B3: direto para o Yahoo, sem requisição nem entrada no cache
+        if not simbolo: return None
+    else:
+        simbolo, buscar = simbolo_yahoo(ticker, resolvedor), lambda desde: get_dividends_yahoo(ticker, desde, resolvedor)
+    if cache is None: return buscar(None)
+    return cache.obter(source, simbolo, buscar, refresh=refresh)
 
-    for ticker in tickers:
-        # Filtros de lixo
-        if not ticker or str(ticker) in ["UNKNOWN", "nan", "", "None", "USDBRL=X"]: continue
-        if "FUNDO" in str(ticker) or "LCA" in str(ticker) or "CDB" in str(ticker): continue
+def buscar_dividendos(tickers, workers=MAX_WORKERS, cache=None, refresh=False, resolvedor=None):
+    """
+    Consulta os proventos de vários tickers em paralelo (pool limitado a 'workers').
+    O fallback no Yahoo é agendado assim que a resposta da BRAPI de cada ticker chega.
+    Símbolos de cada fonte vêm do 'resolvedor' (padrão: inferidos pelo nome do ticker).
+    Retorna {ticker: (divs, fonte)}; a ordem de saída é decidida por quem chama.
+    """
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pendentes = {pool.submit(consultar_dividendos, "BRAPI", t, cache, refresh, resolvedor): (t, "BRAPI") for t in tickers}
+        while pendentes:
+            prontos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+            for fut in prontos:
+                ticker, source = pendentes.pop(fut)
+                divs = fut.result()
+                if source == "BRAPI" and (divs is None or divs.empty):
+                    contar("dividendos.fallback_yahoo")
+                    pendentes[pool.submit(consultar_dividendos, "YAHOO", ticker, cache, refresh, resolvedor)] = (ticker, "YAHOO")
+                else:
+                    resultados[ticker] = (divs, source)
+    return resultados
 
-        ticker_clean = str(ticker).strip().upper().replace(".SA", "")
-        
-        # Data mínima para otimizar busca
-        min_date = df[df['ticker'] == ticker]['date'].min()
+def montar_historico(df, posicoes, alvos, resultados):
+    """Cruza os proventos encontrados com a posição na data com, na ordem de 'alvos'."""
+    historico_final = []
+    # Data mínima para otimizar busca
+    datas_minimas = df.groupby('ticker')['date'].min()
+
+    for ticker, ticker_clean in alvos:
+        min_date = datas_minimas.get(ticker)
         if pd.isnull(min_date): min_date = datetime(2008, 1, 1)
         
         print(f"🔍 {ticker_clean}: ", end="")
-        
-        # 1. Tentar BRAPI (Prioridade)
-        divs = get_dividends_brapi(ticker_clean)
-        source = "BRAPI"
-        
-        # 2. Se vazio, Tentar Yahoo (Fallback)
-        if divs is None or divs.empty:
-            divs = get_dividends_yahoo(ticker_clean)
-            source = "YAHOO"
+        divs, source = resultados.get(ticker_clean, (None, "YAHOO"))
             
         if divs is None or divs.empty:
             print(f"Sem proventos (Ativo pode estar deslistado ou ser recente).")
@@ -174,16 +155,14 @@ def main():
             continue
 
         print(f"Encontrados via {source}.")
+        marca = divs.index.max().strftime('%Y-%m-%d')
         
-        for data_ref, valor in divs.items():
-            # Unificar lógica de Data Com
-            data_com = data_ref
-            if source == "YAHOO":
-                # Yahoo usa Data EX no índice. Com = Ex - 1 dia útil (aprox)
-                data_com = data_ref - timedelta(days=1)
-            
-            qtd = calcular_posicao_na_data(df, ticker, data_com)
-            
+        # Unificar lógica de Data Com
+        # Yahoo usa Data EX no índice. Com = Ex - 1 dia útil (aprox)
+        datas_com = divs.index - timedelta(days=1) if source == "YAHOO" else divs.index
+        qtds = quantidades_nas_datas(posicoes, ticker, datas_com)
+
+        for data_com, valor, qtd in zip(datas_com, divs.values, qtds):
             if qtd > 0:
                 total = qtd * valor
                 pagto = data_com + timedelta(days=15) # Estimativa
@@ -195,29 +174,122 @@ def main():
                     float(f"{valor:.8f}"),
                     float(f"{qtd:.4f}"),
                     float(f"{total:.2f}"),
-                    f"{datetime.now().strftime('%Y-%m-%d')} ({source})"
+                    # Data do provento mais recente visto na fonte (não a da execução):
+                    # a linha guardada no estado é igual à de um recálculo em outro dia
+                    f"{marca} ({source})"
                 ])
-        
-        time.sleep(0.1) 
+    return historico_final
 
-    # 3. Salvar
-    print(f"💾 Salvando {len(historico_final)} registros...")
+def assinaturas_transacoes(df):
+    """{ticker: hash das transações que mexem na quantidade} (preço editado não muda a saída)."""
+    colunas = [c for c in ('date', 'type', 'quantity') if c in df.columns]
+    hashes = pd.util.hash_pandas_object(df[colunas].astype(str), index=False)
+    return {t: hashlib.sha1(h.values.tobytes()).hexdigest() for t, h in hashes.groupby(df['ticker'].values, sort=False)}
+
+def marca_proventos(resultado):
+    """(última data com vista no provedor, fonte) de um item de buscar_dividendos."""
+    divs, source = resultado if resultado else (None, "YAHOO")
+    if divs is None or divs.empty: return '', source
+    return divs.index.max().strftime('%Y-%m-%d'), source
+
+def atualizar_historico(df, posicoes, alvos, resultados, estado, completo=False):
+    """
+    Linhas do dividend_history (mesma ordem de montar_historico sobre todos os alvos).
+    Recalcula só os tickers com transações ou marca de proventos diferentes das
+    guardadas em 'estado'; 'completo' (ou estado vazio) recalcula tudo. Provedor sem
+    resposta para um ticker de transações inalteradas mantém as linhas guardadas.
+    Retorna (linhas, tickers recalculados).
+    """
+    assinaturas = assinaturas_transacoes(df)
+    anteriores = {} if completo else estado.marcas()
+    completo = completo or not anteriores
+    entradas = {}
+    for ticker, ticker_clean in alvos:
+        atual = (assinaturas.get(ticker, ''),) + marca_proventos(resultados.get(ticker_clean))
+        anterior = anteriores.get(ticker)
+        if not completo and not atual[1] and anterior and anterior[1] and anterior[0] == atual[0]:
+            # Falha temporária em BRAPI e Yahoo não apaga o histórico já calculado
+            registrar_erro("historico.sem_proventos", LookupError(f"{ticker_clean}: provedores sem proventos, linhas anteriores mantidas"))
+            continue
+        if completo or anterior != atual:
+            entradas[ticker] = atual + (montar_historico(df, posicoes, [(ticker, ticker_clean)], resultados),)
+    estado.atualizar(entradas, manter=[t for t, _ in alvos], limpar=completo)
+    historico = estado.linhas([t for t, _ in alvos])
+    historico.sort(key=lambda x: x[1]) # Ordenar por data
+    return historico, list(entradas)
+
+def main(workers=MAX_WORKERS, refresh=False, completo=False, sessao=None):
+    """Auditoria do dividend_history; com 'sessao' (pipeline) a escrita fica para sessao.gravar()."""
+    print("--- 🚀 INICIANDO AUDITORIA DE DIVIDENDOS (FIX DATAS + HÍBRIDO) ---")
+    propria = sessao is None
+    sessao = sessao or Sessao()
+    
     try:
-        try:
-            ws_hist = sh.worksheet("dividend_history")
-            ws_hist.clear()
-        except:
-            ws_hist = sh.add_worksheet(title="dividend_history", rows=2000, cols=10)
+        df = sessao.tabela("transactions")
         
-        ws_hist.append_row(["Ticker", "Data Ref", "Data Pagamento", "Valor Unitario", "Qtd na Epoca", "Total Recebido", "Fonte/Data"])
+        # --- CORREÇÃO DE DATA ---
+        # dayfirst=False pois o formato do CSV é YYYY-MM-DD
+        df['date'] = pd.to_datetime(df['date'], dayfirst=False, errors='coerce')
+        
+        # Limpar colunas e tickers
+        df.columns = [c.lower().strip() for c in df.columns]
+        # Ticker vigente (RENAME_MAP): proventos antes e depois da troca caem na mesma posição
+        df['ticker'] = tickers_atuais(df['ticker'])
+        tickers = df['ticker'].unique()
+        # Máquina do tempo: saldo acumulado por ticker calculado uma única vez
+        posicoes = construir_posicoes(df)
+        print(f"✅ Conectado. {len(tickers)} ativos na carteira.")
+
+        # Tipo e moeda do cadastro decidem o símbolo de cada fonte
+        resolvedor = Resolvedor(sessao.tabela("assets"))
         
-        if historico_final:
-            historico_final.sort(key=lambda x: x[1]) # Ordenar por data
-            ws_hist.append_rows(historico_final)
-            
-        print("✅ Sucesso!")
     except Exception as e:
-        print(f"❌ Erro ao salvar: {e}")
+        print(f"❌ Erro Google Sheets: {e}")
+        registrar_erro("planilha.leitura", e)
+        return
+
+    alvos = []
+    for ticker in tickers:
+        # Só o que tem cotação em bolsa (fundos, renda fixa, câmbio e lixo ficam de fora)
+        info = resolvedor.info(ticker)
+        if not (info['brapi'] or info['yahoo']) or info['tipo'] == 'CAMBIO': continue
+        alvos.append((ticker, info['atual']))
+
+    # 1. BRAPI (Prioridade) + 2. Yahoo (Fallback), em paralelo
+    print(f"📡 Consultando {len(alvos)} ativos ({workers} workers{', cache ignorado' if refresh else ''})...")
+    cache = CacheDividendos()
+    with medir("buscar_dividendos"):
+        resultados = buscar_dividendos(list(dict.fromkeys(t for _, t in alvos)), workers, cache, refresh, resolvedor)
+    removidos = cache.despejar()
+    if removidos: print(f"🧹 Cache: {removidos} símbolos sem consulta recente removidos.")
+    # Só os tickers com transações editadas ou proventos novos (--full, --refresh ou sem estado: todos)
+    estado = EstadoHistorico()
+    try:
+        with medir("montar_historico"):
+            historico_final, recalculados = atualizar_historico(df, posicoes, alvos, resultados, estado, completo or refresh)
+    finally:
+        estado.fechar()
+    contar("historico.recalculados", len(recalculados))
+    print(f"♻️ {len(recalculados)} de {len(alvos)} ativos recalculados ({len(alvos) - len(recalculados)} reaproveitados).")
+
+    # 3. Salvar
+    # Escrita delta: só as linhas que mudaram (cria a aba se ainda não existir).
+    # H2 leva o horário da execução: é o sinal que o dashboard observa (app.SINAIS),
+    # a única célula que muda em toda gravação sem reescrever as demais linhas
+    cabecalho = ["Ticker", "Data Ref", "Data Pagamento", "Valor Unitario", "Qtd na Epoca", "Total Recebido", "Fonte/Data", "Atualizado em"]
+    linhas = [list(r) + [''] for r in historico_final]
+    if linhas: linhas[0][-1] = agora_gmt3()
+    sessao.escrever("dividend_history", [cabecalho] + linhas)
+    if propria:
+        print(f"💾 Salvando {len(historico_final)} registros...")
+        if "dividend_history" in sessao.gravar(): print("✅ Sucesso!")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Auditoria do histórico de dividendos")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Consultas simultâneas aos provedores")
+    parser.add_argument("--refresh", action="store_true", help="Ignora o cache local e baixa o histórico completo")
+    parser.add_argument("--full", action="store_true", help="Recalcula o histórico de todos os ativos (ignora o estado incremental)")
+    parser.add_argument("--report", action="store_true", help="Imprime a tabela de telemetria no final")
+    args = parser.parse_args()
+    with execucao("update_dividend_history", resumo=args.report):
+        main(workers=args.workers, refresh=args.refresh, completo=args.full)
@@ -1,43 +1,34 @@
-import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
-import os
-import json
 import datetime
 import numpy as np
+import argparse
+from cvm import cotas_cvm, ultimas_cotas
+from planilhas import Sessao, CABECALHO_PRECOS, PRIORIDADE_PRECOS, agora_gmt3
+from simbolos import Resolvedor
+from telemetria import execucao, contar, registrar_erro
 
-def update_portfolio_funds():
-    ID_PLANILHA = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8"
+def update_portfolio_funds(sessao=None):
+    """Cotas dos fundos (CVM) na market_data; com 'sessao' a escrita fica para sessao.gravar()."""
+    propria = sessao is None
+    sessao = sessao or Sessao()
     
     # 1. Autenticação
     try:
-        info = json.loads(os.environ['GOOGLE_SHEETS_CREDS'])
-        creds = Credentials.from_service_account_info(info, scopes=[
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ])
-        client = gspread.authorize(creds)
-        sh = client.open_by_key(ID_PLANILHA)
+        sessao.planilha
     except Exception as e:
         print(f"❌ Erro na autenticação: {e}")
         return
 
     # 2. Mapear CNPJs da aba 'assets'
     try:
-        ws_assets = sh.worksheet("assets")
-        df_assets = pd.DataFrame(ws_assets.get_all_records())
-        df_assets.columns = [c.lower().strip() for c in df_assets.columns]
+        df_assets = sessao.tabela("assets")
         
-        # Cria dicionário {ticker: cnpj} filtrando apenas onde isin_cnpj tem 14 dígitos
+        # Cria dicionário {ticker: cnpj} com os CNPJs que o resolvedor reconhece em isin_cnpj
+        resolvedor = Resolvedor(df_assets)
         mapa_fundos = {}
-        for _, row in df_assets.iterrows():
-            ticker = str(row['ticker']).strip()
-            # Limpa o CNPJ (deixa apenas números)
-            cnpj_raw = str(row.get('isin_cnpj', '')).strip()
-            cnpj_limpo = ''.join(filter(str.isdigit, cnpj_raw))
-            
-            if len(cnpj_limpo) == 14:
-                mapa_fundos[ticker] = cnpj_limpo
+        for t in df_assets['ticker']:
+            ticker = str(t).strip()
+            if ticker and resolvedor.cnpj(ticker):
+                mapa_fundos[ticker] = resolvedor.cnpj(ticker)
 
         print(f"Fundos mapeados para consulta: {list(mapa_fundos.keys())}")
     except Exception as e:
@@ -53,10 +44,13 @@ def update_portfolio_funds():
         url = f"https://dados.cvm.gov.br/dados/FIE/MED/DIARIO/DADOS/inf_diario_fie_{mes}.zip"
         try:
             print(f"🔍 Tentando base CVM: {mes}...")
-            df_cvm = pd.read_csv(url, sep=';', compression='zip', encoding='latin1')
+            # Mesmo motor do update_market_data: streaming, só CNPJ/data/cota dos fundos mapeados
+            df_cvm = cotas_cvm(url, mapa_fundos.values())
+            if df_cvm is None: continue
             print(f"✅ Dados de {mes} carregados!")
             break
-        except:
+        except Exception as e:
+            registrar_erro("CVM.mes", e)
             continue
 
     if df_cvm is None:
@@ -65,37 +59,43 @@ def update_portfolio_funds():
 
     # 4. Processar Preços
     # Pega apenas a cota mais recente disponível
-    df_cvm = df_cvm.sort_values('DT_COMPTC').drop_duplicates('CNPJ_FUNDO', keep='last')
-    # Limpa CNPJs da base CVM para comparação
-    df_cvm['cnpj_key'] = df_cvm['CNPJ_FUNDO'].str.replace(r'\D', '', regex=True)
-    price_dict = df_cvm.set_index('cnpj_key')['VL_QUOTA'].to_dict()
+    price_dict = ultimas_cotas(df_cvm)
 
     # 5. Atualizar aba 'market_data'
+    # Só as linhas dos fundos: o resto da aba (ações do outro script) e a coluna
+    # last_update são preservados na mesclagem da sessão
     try:
-        ws_market = sh.worksheet("market_data")
-        market_rows = ws_market.get_all_records()
-        # Preserva o que já está lá (ações do outro script)
-        final_data = {str(r['ticker']).strip(): r['close_price'] for r in market_rows}
+        existentes = {str(r[0]).strip() for r in sessao.valores("market_data")[1:] if r}
+        agora = agora_gmt3()
+        linhas = []
+        reservas = []
         
         for ticker, cnpj in mapa_fundos.items():
             preco = price_dict.get(cnpj)
             if preco:
-                final_data[ticker] = float(preco)
+                linhas.append([ticker, float(preco), agora])
                 print(f"💰 {ticker} atualizado: R$ {preco:.6f}")
             else:
                 # Se não achar na CVM, mas o ativo é um fundo, garante que não fique 0
-                if ticker not in final_data:
-                    final_data[ticker] = 1.0
+                if ticker not in existentes:
+                    linhas.append([ticker, 1.0, agora])
+                    reservas.append(ticker)
+                    contar("preco.sem_preco")
+                else:
+                    contar("preco.preservado")
 
-        # Preparar dados para salvar
-        updates = [[t, float(p) if pd.notnull(p) else 0.0] for t, p in final_data.items()]
-        
-        ws_market.clear()
-        ws_market.update(values=[['ticker', 'close_price']] + updates, range_name='A1')
-        print("🚀 Planilha atualizada com sucesso!")
+        sessao.mesclar("market_data", CABECALHO_PRECOS, linhas, PRIORIDADE_PRECOS['update_funds'], reservas=reservas)
+        if propria:
+            sessao.gravar()
+            print("🚀 Planilha atualizada com sucesso!")
         
     except Exception as e:
         print(f"❌ Erro ao gravar: {e}")
+        registrar_erro("planilha.escrita", e)
 
 if __name__ == "__main__":
-    update_portfolio_funds()
+    parser = argparse.ArgumentParser(description="Cotas dos fundos via CVM (market_data)")
+    parser.add_argument("--report", action="store_true", help="Imprime a tabela de telemetria no final")
+    args = parser.parse_args()
+    with execucao("update_funds", resumo=args.report):
+        update_portfolio_funds()
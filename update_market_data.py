@@ -1,95 +1,173 @@
-import yfinance as yf
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 import os
-import json
 import datetime
-import requests
-import io
 import time
-
-# --- MAPEAMENTO DE MUDANÇAS DE TICKER ---
-RENAME_MAP = {
-    "CESP6": "AURE3",
-    "BTOW3": "AMER3",
-    "ENAT3": "BRAV3",
-    "LCAM3": "RENT3",
-    "BKBR3": "ZAMP3",
-    "IGTA3": "IGTI11",
-    "BRDT3": "VBBR3",
-    "JPSA3": "ALOS3",
-    "SULA11": "RDOR3",
-    "TRPL4": "ISAE4"
-}
-
-def get_tesouro_url():
-    api_url = "https://www.tesourotransparente.gov.br/ckan/api/3/action/package_show?id=taxas-do-tesouro-direto"
-    try:
-        response = requests.get(api_url, timeout=30)
-        data = response.json()
-        resources = data['result']['resources']
-        for res in resources:
-            if "PrecoTaxa" in res['name'] or ("Preco" in res['name'] and res['format'].lower() == "csv"):
-                return res['url']
-    except: pass
-    return "https://www.tesourotransparente.gov.br/ckan/dataset/df56aa42-484a-4a59-8184-7676580c81e3/resource/796d2059-14e9-44e3-80c9-2d9e30b405c1/download/precotaxatesourodireto.csv"
+import argparse
+from collections import Counter
+from cvm import cotas_cvm, ultimas_cotas
+from provedores import BRAPI_URL, cotar_brapi, cotacoes_yahoo, historico_yahoo
+from planilhas import Sessao, CABECALHO_PRECOS, PRIORIDADE_PRECOS
+from historico_precos import anexar_precos, compactar
+from cambio import simbolo_cambio, moedas_estrangeiras
+from agendador import Etapa, executar_etapas, relatorio_etapas
+from tesouro import atualizar_indice, ultimos_pus, historico_pu
+from telemetria import execucao, medir, contar, registrar_erro
+from simbolos import Resolvedor, Ausentes, TIPOS_BR, TIPOS_EXTERIOR, TIPOS_FUNDO, TIPOS_TESOURO, AUSENTES_PATH
+from cache_cotacoes import CacheCotacoes, COTACOES_CACHE_PATH
 
 # --- BRAPI (COTAÇÃO) ---
-def get_prices_brapi(tickers):
+def get_prices_brapi(tickers, sem_resposta=None):
     """
-    Busca preços em lote na BRAPI.
-    Retorna dicionário {TICKER: PRECO}
+    Busca preços em lote na BRAPI (lotes adaptativos e concorrentes, ver provedores.cotar_brapi).
+    Retorna dicionário {TICKER: PRECO}; a lista 'sem_resposta', se dada, recebe os
+    tickers que a BRAPI não chegou a responder (erro no lote ou token recusado).
     """
     token = os.environ.get("BRAPI_TOKEN")
     if not token or not tickers: return {}
 
-    chunk_size = 20
-    precos_encontrados = {}
-    
     # Limpar .SA para BRAPI
     tickers_clean = [t.replace(".SA", "").strip().upper() for t in tickers]
-    
-    # Processar em lotes
-    for i in range(0, len(tickers_clean), chunk_size):
-        batch = tickers_clean[i:i+chunk_size]
+    itens, rel = cotar_brapi(tickers_clean, {'token': token, 'fundamental': 'false'}, url=BRAPI_URL)
+    print(f"   BRAPI: {rel['encontrados']}/{rel['simbolos']} em {rel['segundos']:.1f}s ({rel['simbolos_por_s']:.0f} símbolos/s, "
+          f"{rel['lotes']} lotes, lote final {rel['tamanho_final']}, {len(rel['falhas'])} símbolos recusados)")
+    if rel['negado']: print("   ❌ BRAPI recusou o token (401/403): consulta interrompida")
+    elif rel['sem_resposta']: print(f"   ⚠️ BRAPI: {len(rel['sem_resposta'])} símbolos sem resposta (erro no lote)")
+    if sem_resposta is not None: sem_resposta.extend(rel['sem_resposta'])
+
+    precos_encontrados = {}
+    for sym, item in itens.items():
+        price = item.get('regularMarketPrice')
+        if price:
+            precos_encontrados[sym] = float(price)
+    return precos_encontrados
+
+# --- ETAPAS (FONTES INDEPENDENTES, RODAM EM PARALELO) ---
+# Prazo de cada etapa em segundos (sobrescreva com PRAZO_BRAPI, PRAZO_YAHOO, ...)
+PRAZOS = {'BRAPI': 60, 'Yahoo': 120, 'CVM': 200, 'Tesouro': 90}
+
+def prazo_etapa(nome):
+    return float(os.environ.get(f"PRAZO_{nome.upper()}", PRAZOS[nome]))
+
+def _precos_brapi(lista_brapi, ausentes=None):
+    sem_resposta = []
+    dict_brapi = get_prices_brapi(lista_brapi, sem_resposta)
+    precos = {}
+    for t in lista_brapi:
+        price = dict_brapi.get(t) or dict_brapi.get(f"{t}.SA")
+        if price: precos[t] = price
+    # Quem ficou sem resposta não conta como ausente na BRAPI
+    sem_resposta = set(sem_resposta)
+    consultados = [t for t in lista_brapi if t.replace(".SA", "").strip().upper() not in sem_resposta]
+    if ausentes is not None: ausentes.registrar('BRAPI', consultados, precos)
+    return precos
+
+# Com 'cache' (ver cache_cotacoes.py), cada etapa só consulta a fonte para o que não estiver fresco;
+# com 'ausentes' (ver simbolos.py), símbolos que a fonte não conhece há várias execuções nem são pedidos
+def etapa_brapi(lista_brapi, cache=None, ausentes=None):
+    if ausentes is not None: lista_brapi = ausentes.filtrar('BRAPI', lista_brapi)
+    if cache is None: return _precos_brapi(lista_brapi, ausentes)
+    return cache.obter('BRAPI', lista_brapi, lambda lista: _precos_brapi(lista, ausentes))
+
+def _buscar_yahoo(simbolos, ausentes=None):
+    precos = cotacoes_yahoo(simbolos)
+    if ausentes is not None: ausentes.registrar('YAHOO', simbolos, precos)
+    return precos
+
+def _cotacoes_yahoo(simbolos, cache=None, ausentes=None):
+    if cache is None: return _buscar_yahoo(simbolos, ausentes)
+    # Câmbio tem TTL próprio; o resto do Yahoo segue o das cotações
+    cambio = [s for s in simbolos if s.endswith('=X')]
+    outros = [s for s in simbolos if not s.endswith('=X')]
+    precos = cache.obter('CAMBIO', cambio, lambda lista: _buscar_yahoo(lista, ausentes)) if cambio else {}
+    if outros: precos.update(cache.obter('YAHOO', outros, lambda lista: _buscar_yahoo(lista, ausentes)))
+    return precos
+
+def etapa_yahoo(simbolos, cache=None, ausentes=None):
+    """{chave: preço} a partir de {símbolo Yahoo: chave} (internacional, câmbio e o que a BRAPI não achou)."""
+    pendentes = list(simbolos)
+    if ausentes is not None: pendentes = ausentes.filtrar('YAHOO', pendentes)
+    print(f"   Yahoo Finance: {len(pendentes)} ativos")
+    # Download em lote (incluindo os pares de câmbio); consulta individual só para o que faltar
+    dict_yahoo = _cotacoes_yahoo(pendentes, cache, ausentes)
+    precos = {}
+    for s in pendentes:
+        if s in dict_yahoo: precos.setdefault(simbolos[s], dict_yahoo[s])
+    return precos
+
+def etapa_cvm(mapa_cnpjs, cache=None):
+    """({ticker: cota mais recente}, [DataFrames cnpj/data/quota do mês]) dos fundos."""
+    if cache is None or not mapa_cnpjs: return _baixar_cvm(mapa_cnpjs)
+    series = []  # só vem série quando a CVM é consultada de fato
+    def buscar(tickers):
+        precos, novas = _baixar_cvm({c: t for c, t in mapa_cnpjs.items() if t in set(tickers)})
+        series.extend(novas)
+        return precos
+    # Sem revalidação em segundo plano: a série do mês baixada depois do retorno se perderia
+    return cache.obter('CVM', list(mapa_cnpjs.values()), buscar, revalidar=False), series
+
+def _baixar_cvm(mapa_cnpjs):
+    precos, series = {}, []
+    if not mapa_cnpjs: return precos, series
+    for i in range(2): # Tenta mês atual e anterior
+        mes = (datetime.date.today() - datetime.timedelta(days=i*28)).strftime('%Y%m')
+        url = f"https://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_{mes}.zip"
+        print(f"   Baixando dados CVM: {mes}...")
         try:
-            url = f"https://brapi.dev/api/quote/{','.join(batch)}"
-            params = {'token': token, 'fundamental': 'false'}
+            # Streaming + apenas CNPJ/data/cota dos fundos da carteira (com índice local do mês)
+            df_cvm = cotas_cvm(url, mapa_cnpjs.keys(), timeout=90)
+            cvm_dict = ultimas_cotas(df_cvm)
+            if df_cvm is not None: series.append(df_cvm)
             
-            resp = requests.get(url, params=params, timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                if 'results' in data:
-                    for item in data['results']:
-                        sym = item['symbol'].upper()
-                        price = item.get('regularMarketPrice')
-                        if price:
-                            precos_encontrados[sym] = float(price)
-            time.sleep(0.5) # Respeitar rate limit
-        except Exception as e:
-            print(f"   ⚠️ Erro BRAPI batch: {e}")
+            for cnpj, ticker in mapa_cnpjs.items():
+                if cnpj in cvm_dict and ticker not in precos: 
+                    precos[ticker] = float(cvm_dict[cnpj])
             
-    return precos_encontrados
+            if len(precos) >= len(mapa_cnpjs) * 0.8:
+                break 
+        except Exception as e: 
+            print(f"   Erro CVM {mes}: {e}")
+            registrar_erro("CVM.mes", e)
+            continue
+    print(f"   Fundos atualizados via CVM: {len(precos)} encontrados.")
+    return precos, series
 
-def update_prices():
-    ID_PLANILHA = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8"
+def etapa_tesouro(chaves, cache=None):
+    """
+    ({ticker: PU}, {ticker: Data Base}) dos títulos do Tesouro Direto (índice local, ver
+    tesouro.py). 'chaves' = {ticker: 'TIPO:ANO'}, a chave do título no Resolvedor.
+    """
+    if not chaves: return {}, {}
+    if cache is not None:
+        def buscar(tickers):
+            pus, datas = _ler_tesouro({t: chaves[t] for t in tickers})
+            return {t: [pu, pd.Timestamp(datas[t]).strftime('%Y-%m-%d')] for t, pu in pus.items()}
+        guardados = cache.obter('TESOURO', list(chaves), buscar)
+        return ({t: v[0] for t, v in guardados.items()}, {t: pd.Timestamp(v[1]) for t, v in guardados.items()})
+    return _ler_tesouro(chaves)
+
+def _ler_tesouro(chaves):
+    situacao = atualizar_indice()
+    contar(f"TESOURO.indice_{situacao}")
+    print(f"   Tesouro: índice local {situacao}.")
+    df = ultimos_pus(chaves)
+    return dict(zip(df['ticker'], df['pu'])), dict(zip(df['ticker'], df['data_base']))
+
+def update_prices(backfill=None, refresh=False, sessao=None):
+    """
+    Cotações de todos os ativos do cadastro na market_data. Com 'sessao' (pipeline, ver
+    sgp.py) a escrita fica para sessao.gravar(); sozinho, abre a sessão e grava no final.
+    """
+    propria = sessao is None
+    sessao = sessao or Sessao()
     try:
-        creds_str = os.environ.get("GOOGLE_SHEETS_CREDS")
-        if not creds_str: raise Exception("Secret GOOGLE_SHEETS_CREDS não encontrada")
-        
-        info = json.loads(creds_str)
-        creds = Credentials.from_service_account_info(info, scopes=['https://www.googleapis.com/auth/spreadsheets','https://www.googleapis.com/auth/drive'])
-        client = gspread.authorize(creds)
-        sh = client.open_by_key(ID_PLANILHA)
+        sessao.planilha
     except Exception as e:
         print(f"❌ Erro Autenticação: {e}")
+        registrar_erro("autenticacao", e)
         return
 
     # 1. Carrega Assets
-    ws_assets = sh.worksheet("assets")
-    df_assets = pd.DataFrame(ws_assets.get_all_records())
-    df_assets.columns = [c.lower().strip() for c in df_assets.columns]
+    df_assets = sessao.tabela("assets")
     
     def clean_val(val):
         if val is None or val == "" or val == "close_price": return 0.0
@@ -101,177 +179,198 @@ def update_prices():
     # Backup Google Finance
     precos_google_backup = {str(r['ticker']).strip(): clean_val(r.get('price_google', 0)) for _, r in df_assets.iterrows()}
     
-    tickers_manuais = df_assets[df_assets['manual_update'].astype(str).str.upper().isin(['S', 'SIM', '1', 'TRUE'])]['ticker'].unique().tolist()
+    # Tabela de símbolos da execução: ticker vigente e símbolo em cada fonte (ver simbolos.py)
+    resolvedor = Resolvedor(df_assets)
+    ausentes = Ausentes(AUSENTES_PATH)
+    tickers_manuais = resolvedor.manuais()
     
     # --- CORREÇÃO DO FUSO HORÁRIO (GMT -3) ---
     fuso_gmt3 = datetime.timezone(datetime.timedelta(hours=-3))
     agora = datetime.datetime.now(fuso_gmt3).strftime('%d/%m/%Y %H:%M:%S')
+    hoje = datetime.datetime.now(fuso_gmt3).date()
     # ----------------------------------------
 
-    ws_market = sh.worksheet("market_data")
-    dados_market_atuais = ws_market.get_all_values()
+    # Valores não formatados: servem para preservar preços e para a escrita delta no final
+    dados_market_atuais = sessao.valores("market_data")
     # Preserva valores anteriores caso a atualização falhe
     precos_preservados = {str(row[0]).strip(): clean_val(row[1]) for row in dados_market_atuais[1:]} if len(dados_market_atuais) > 1 else {}
     
-    precos_finais = {}
-    
     # Separação de Ativos
-    lista_brapi = []
-    lista_yahoo_only = []
-    
-    tipos_br = ['ACAO_BR', 'FII', 'ETF_BR', 'BDR']
+    # Câmbio: USD sempre, mais toda moeda estrangeira que aparecer no cadastro
+    moedas = moedas_estrangeiras(df_assets['currency']) if 'currency' in df_assets.columns else []
+    pares_cambio = list(dict.fromkeys(['USDBRL=X'] + [simbolo_cambio(m) for m in moedas]))
 
-    for _, row in df_assets.iterrows():
-        t_orig = str(row['ticker']).strip().upper()
-        if not t_orig or t_orig in tickers_manuais: continue
-        
-        # Verifica se ticker mudou
-        if t_orig in RENAME_MAP:
-            print(f"   ℹ️ Redirecionando {t_orig} -> {RENAME_MAP[t_orig]}")
-            t_orig = RENAME_MAP[t_orig]
-        
-        if row['type'] in tipos_br:
-            lista_brapi.append(t_orig)
-        elif row['type'] == 'ETF_US':
-            lista_yahoo_only.append(t_orig)
-            
-    # Remover duplicatas
-    lista_brapi = list(set(lista_brapi))
-    lista_yahoo_only = list(set(lista_yahoo_only))
+    for t in resolvedor.cadastrados():
+        if resolvedor.atual(t) != t: print(f"   ℹ️ Redirecionando {t} -> {resolvedor.atual(t)}")
+    # Preços ficam chaveados pelo ticker vigente (o símbolo BRAPI, para os ativos da B3)
+    lista_brapi = list(dict.fromkeys(resolvedor.brapi(t) for t in resolvedor.cadastrados(TIPOS_BR)))
+    yahoo_brapi = {resolvedor.yahoo(t): resolvedor.atual(t) for t in resolvedor.cadastrados(TIPOS_BR)}
+    yahoo_only = {resolvedor.yahoo(t): resolvedor.atual(t) for t in resolvedor.cadastrados(TIPOS_EXTERIOR)}
+    yahoo_only.update({par: par for par in pares_cambio})
 
-    # --- 1. BRAPI (Prioridade B3) ---
-    print(f"--- 🔍 BRAPI ({len(lista_brapi)} ativos) ---")
-    dict_brapi = get_prices_brapi(lista_brapi)
-    
-    for t in lista_brapi:
-        price = dict_brapi.get(t) or dict_brapi.get(f"{t}.SA")
-        if price:
-            precos_finais[t] = price
-        else:
-            lista_yahoo_only.append(f"{t}.SA" if not t.endswith(".SA") else t)
+    def simbolos_yahoo(precos_brapi):
+        # Internacional + câmbio + tudo que a BRAPI não achou (ou todos, se a BRAPI falhou)
+        return {**yahoo_only, **{s: t for s, t in yahoo_brapi.items() if t not in precos_brapi}}
 
-    # --- 2. YAHOO FINANCE (Fallback + Internacional) ---
-    print(f"--- 🔍 Yahoo Finance ({len(lista_yahoo_only)} ativos) ---")
-    if 'USDBRL=X' not in lista_yahoo_only: lista_yahoo_only.append('USDBRL=X')
-    
-    for t in lista_yahoo_only:
-        t_clean = t.replace(".SA", "")
-        if t_clean in precos_finais: continue
+    fundos = resolvedor.cadastrados(TIPOS_FUNDO)
+    mapa_cnpjs = {resolvedor.cnpj(t): str(df_assets['ticker'][i]).strip()
+                  for i, t in zip(df_assets.index, df_assets['ticker'].astype(str).str.strip().str.upper())
+                  if t in fundos and resolvedor.cnpj(t)}
+    # Chave (tipo, vencimento) de cada título, resolvida uma vez no Resolvedor
+    chaves_td = {t: resolvedor.tesouro(t) for t in resolvedor.cadastrados(TIPOS_TESOURO) if resolvedor.tesouro(t)}
 
-        try:
-            ticker_obj = yf.Ticker(t)
-            hist = ticker_obj.history(period="1d")
-            if not hist.empty:
-                val = float(hist['Close'].iloc[-1])
-                precos_finais[t_clean] = val
-            else:
-                if t == 'USDBRL=X':
-                     info = ticker_obj.fast_info
-                     if hasattr(info, 'last_price'):
-                         precos_finais['USDBRL=X'] = float(info.last_price)
-        except: pass
-            
-    # --- 3. REDUNDÂNCIA (Google Finance) ---
+    # --- 1-4. FONTES EM PARALELO ---
+    # BRAPI -> Yahoo (fallback depende das falhas da BRAPI) corre junto com CVM e Tesouro
+    print(f"--- 🔍 Fontes em paralelo: BRAPI ({len(lista_brapi)}), Yahoo, CVM ({len(mapa_cnpjs)}), Tesouro ({len(chaves_td)}) ---")
+    t0 = time.perf_counter()
+    cache = CacheCotacoes(COTACOES_CACHE_PATH, desligado=refresh)
+    resultados = executar_etapas([
+        Etapa('BRAPI', lambda _: etapa_brapi(lista_brapi, cache, ausentes), prazo_etapa('BRAPI')),
+        Etapa('Yahoo', lambda r: etapa_yahoo(simbolos_yahoo(r['BRAPI'] or {}), cache, ausentes),
+              prazo_etapa('Yahoo'), depende=['BRAPI']),
+        Etapa('CVM', lambda _: etapa_cvm(mapa_cnpjs, cache), prazo_etapa('CVM')),
+        Etapa('Tesouro', lambda _: etapa_tesouro(chaves_td, cache), prazo_etapa('Tesouro')),
+    ])
+    valor = {nome: r['valor'] for nome, r in resultados.items()}
+    precos_cvm, series_cvm = valor['CVM'] or ({}, [])
+    precos_tesouro, datas_preco = valor['Tesouro'] or ({}, {})
+
+    # --- MESCLAGEM POR PRIORIDADE: BRAPI > Yahoo > Google (backup) > CVM > Tesouro > preservado ---
+    precos_finais = {}
+    fontes = {}  # ticker -> etapa que achou o preço (para o histórico e o resumo)
+    for fonte, precos in [('BRAPI', valor['BRAPI']), ('YAHOO', valor['Yahoo'])]:
+        for t, p in (precos or {}).items():
+            if t not in precos_finais:
+                precos_finais[t] = p
+                fontes[t] = fonte
+
+    # Redundância (Google Finance) para o que BRAPI e Yahoo não trouxeram
     for t in df_assets['ticker'].unique():
         ts = str(t).strip()
-        ts_lookup = RENAME_MAP.get(ts, ts)
+        ts_lookup = resolvedor.atual(ts)
         
-        if ts_lookup not in precos_finais and ts not in tickers_manuais and ts != 'USDBRL=X':
+        if ts_lookup not in precos_finais and ts.upper() not in tickers_manuais and ts not in pares_cambio:
             val_backup = precos_google_backup.get(ts, 0)
             if val_backup > 0:
                 precos_finais[ts] = val_backup
+                fontes[ts] = 'GOOGLE'
                 print(f"⚠️ {ts}: Usando backup do Google Finance")
 
-    # --- 4. CVM (FUNDOS) ---
-    print("--- 🔍 CVM (Fundos) ---")
-    df_fundos = df_assets[(df_assets['type'] == 'FUNDO') & (~df_assets['ticker'].isin(tickers_manuais))]
-    mapa_cnpjs = {str(r['isin_cnpj']).replace('.','').replace('-','').replace('/','').zfill(14): str(r['ticker']).strip() for _, r in df_fundos.iterrows() if r.get('isin_cnpj')}
-    
-    fundos_encontrados = 0
-    if mapa_cnpjs:
-        for i in range(2): # Tenta mês atual e anterior
-            mes = (datetime.date.today() - datetime.timedelta(days=i*28)).strftime('%Y%m')
-            url = f"https://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_{mes}.zip"
-            print(f"   Baixando dados CVM: {mes}...")
-            try:
-                resp = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=90)
-                if resp.status_code == 200:
-                    if len(resp.content) < 1000:
-                        print(f"   Arquivo CVM {mes} muito pequeno. Ignorando.")
-                        continue
-                        
-                    # Lê com low_memory=False para garantir precisão e tipos corretos
-                    with io.BytesIO(resp.content) as zip_buffer:
-                         df_cvm = pd.read_csv(zip_buffer, sep=';', compression='zip', encoding='latin1', low_memory=False)
-                    
-                    # Correção para nome dinâmico da coluna
-                    col_cnpj = 'CNPJ_FUNDO'
-                    if 'CNPJ_FUNDO_CLASSE' in df_cvm.columns:
-                        col_cnpj = 'CNPJ_FUNDO_CLASSE'
-                    elif 'CNPJ_FUNDO' not in df_cvm.columns:
-                         print(f"   Erro: Coluna de CNPJ não encontrada em {mes}.")
-                         continue
-
-                    df_cvm['cnpj_key'] = df_cvm[col_cnpj].str.replace(r'\D', '', regex=True).str.zfill(14)
-                    df_cvm = df_cvm.drop_duplicates('cnpj_key', keep='last')
-                    
-                    cvm_dict = df_cvm.set_index('cnpj_key')['VL_QUOTA'].to_dict()
-                    
-                    for cnpj, ticker in mapa_cnpjs.items():
-                        if cnpj in cvm_dict and ticker not in precos_finais: 
-                            val_cota = float(cvm_dict[cnpj])
-                            precos_finais[ticker] = val_cota
-                            fundos_encontrados += 1
-                    
-                    if fundos_encontrados >= len(mapa_cnpjs) * 0.8:
-                        break 
-            except Exception as e: 
-                print(f"   Erro CVM {mes}: {e}")
-                continue
-    print(f"   Fundos atualizados via CVM: {fundos_encontrados} encontrados.")
-
-    # --- 5. TESOURO DIRETO ---
-    print("--- 🔍 Tesouro Direto ---")
-    df_td_assets = df_assets[(df_assets['type'] == 'TESOURO') & (~df_assets['ticker'].isin(tickers_manuais))]
-    if not df_td_assets.empty:
-        try:
-            resp_td = requests.get(get_tesouro_url(), timeout=30)
-            df_td = pd.read_csv(io.BytesIO(resp_td.content), sep=';', decimal=',', encoding='latin1')
-            df_td['Data Base'] = pd.to_datetime(df_td['Data Base'], dayfirst=True)
-            df_hoje = df_td[df_td['Data Base'] == df_td['Data Base'].max()]
-            for _, row in df_td_assets.iterrows():
-                t_td = str(row['ticker']).strip().upper()
-                if t_td in precos_finais: continue
-                
-                ano = "".join(filter(str.isdigit, t_td))
-                if len(ano) == 2: ano = "20" + ano
-                tipo = "IPCA" if "IPCA" in t_td else "SELIC" if "SELIC" in t_td else "PREFIXADO"
-                mask = (df_hoje['Tipo Titulo'].str.upper().str.contains(tipo)) & (pd.to_datetime(df_hoje['Data Vencimento'], dayfirst=True).dt.year == int(ano))
-                if not df_hoje[mask].empty: precos_finais[t_td] = float(df_hoje[mask].iloc[0]['PU Base Manha'])
-        except: pass
+    for fonte, precos in [('CVM', precos_cvm), ('TESOURO', precos_tesouro)]:
+        for t, p in precos.items():
+            if t not in precos_finais:
+                precos_finais[t] = p
+                fontes[t] = fonte
+
+    relatorio_etapas(resultados, time.perf_counter() - t0,
+                     {nome: len(v[0] if isinstance(v, tuple) else v) for nome, v in valor.items() if v is not None})
+    print(f"   Cache de cotações (fresco/velho/consultado): {cache.resumo()}")
 
     # --- GRAVAÇÃO ---
-    print("--- 💾 Salvando no Google Sheets ---")
     output = []
+    origem = Counter()
+    reservas = []  # tickers gravados sem cotação desta execução (preservado ou 1.0)
     # Garante que usamos a chave original da planilha asset
     for t in df_assets['ticker'].unique():
         ts = str(t).strip()
         if not ts: continue
         
         # Procura preço usando o ticker original ou o novo mapeado
-        ts_mapped = RENAME_MAP.get(ts, ts)
+        ts_mapped = resolvedor.atual(ts)
         
         v = precos_finais.get(ts_mapped, precos_finais.get(ts, precos_preservados.get(ts, 1.0)))
         output.append([ts, float(v), agora])
+        if ts_mapped in precos_finais: origem[fontes[ts_mapped]] += 1
+        elif ts in precos_finais: origem[fontes[ts]] += 1
+        elif ts in precos_preservados:
+            origem['PRESERVADO'] += 1
+            reservas.append(ts)
+        else:
+            origem['SEM PREÇO'] += 1
+            reservas.append(ts)
     
-    # Adiciona dolar
-    if 'USDBRL=X' in precos_finais: 
-        output.append(['USDBRL=X', float(precos_finais['USDBRL=X']), agora])
+    # Adiciona câmbio (dólar e demais moedas do cadastro)
+    for par in pares_cambio:
+        if par in precos_finais:
+            output.append([par, float(precos_finais[par]), agora])
 
-    ws_market.clear()
-    # USER_ENTERED garante que o Google Sheets interprete o número com precisão total
-    ws_market.update(values=[['ticker', 'close_price', 'last_update']] + output, range_name='A1', value_input_option='USER_ENTERED')
+    # Tabela completa: define as linhas da market_data; cotações de outros estágios
+    # (fundos, Yahoo) substituem as linhas reservas e completam o resto
+    sessao.mesclar("market_data", CABECALHO_PRECOS, output, PRIORIDADE_PRECOS['update_market_data'],
+                   completo=True, reservas=reservas)
+    print(f"📋 Resumo: {sum(origem.values())} ativos | " + " · ".join(f"{k} {v}" for k, v in origem.most_common()))
+    # PRESERVADO = preço da execução anterior; SEM PREÇO = gravado com o padrão 1.0
+    for k, v in origem.items(): contar(f"preco.{k.lower().replace(' ', '_')}", v)
+
+    # --- HISTÓRICO DE PREÇOS (append-only) ---
+    historico = []
+    for ts in list(dict.fromkeys(list(df_assets['ticker'].unique()) + pares_cambio)):
+        ts = str(ts).strip()
+        chave = resolvedor.atual(ts) if resolvedor.atual(ts) in precos_finais else ts
+        if ts and chave in precos_finais:
+            historico.append({'ticker': ts, 'data': datas_preco.get(chave, hoje), 'close': precos_finais[chave], 'fonte': fontes.get(chave, '')})
+        elif ts.upper() in tickers_manuais and precos_preservados.get(ts):
+            # Ativos de preço manual: vale o que está na planilha hoje
+            historico.append({'ticker': ts, 'data': hoje, 'close': precos_preservados[ts], 'fonte': 'MANUAL'})
+    df_historico = pd.DataFrame(historico, columns=['ticker', 'data', 'close', 'fonte'])
+    # Fundos: o mês inteiro de cotas da CVM já está em mãos, entra tudo no histórico
+    for df_cvm in series_cvm:
+        df_cvm = df_cvm[df_cvm['cnpj'].isin(mapa_cnpjs.keys())]
+        df_historico = pd.concat([df_historico, pd.DataFrame({
+            'ticker': df_cvm['cnpj'].map(mapa_cnpjs), 'data': df_cvm['data'], 'close': df_cvm['quota'], 'fonte': 'CVM'})],
+            ignore_index=True)
+    if backfill:
+        df_historico = pd.concat([backfill_yahoo(df_assets, resolvedor, backfill, pares_cambio),
+                                  backfill_tesouro(df_assets, resolvedor, backfill), df_historico], ignore_index=True)
+    try:
+        with medir("historico_precos"):
+            gravados = anexar_precos(df_historico)
+            compactados = compactar()
+        print(f"   Histórico de preços: {gravados} registros anexados ({compactados} lotes compactados).")
+    except Exception as e:
+        print(f"   ⚠️ Erro ao gravar histórico de preços: {e}")
+        registrar_erro("historico_precos", e)
+    try:
+        # Revalidações em segundo plano têm até o maior prazo das etapas para terminar
+        cache.salvar(espera=max(prazo_etapa(n) for n in PRAZOS))
+        ausentes.salvar()
+    except OSError as e:
+        print(f"   ⚠️ Cache de cotações não gravado: {e}")
+        registrar_erro("cache_cotacoes.escrita", e)
+    if propria:
+        # Escrita delta da market_data (e snapshot local para o dashboard)
+        print("--- 💾 Salvando no Google Sheets ---")
+        sessao.gravar()
     print(f"✅ Atualização de preços concluída: {agora}")
 
+def backfill_tesouro(df_assets, resolvedor, inicio):
+    """PU diário (desde 'inicio') dos títulos do Tesouro, a partir do índice local."""
+    titulos = set(resolvedor.cadastrados(TIPOS_TESOURO))
+    # Ticker como está na aba assets; a chave do título vem do Resolvedor
+    originais = {str(t).strip().upper(): str(t).strip() for t in df_assets['ticker'] if str(t).strip().upper() in titulos}
+    chaves = {t: resolvedor.tesouro(t) for t in originais if resolvedor.tesouro(t)}
+    if not chaves: return pd.DataFrame(columns=['ticker', 'data', 'close', 'fonte'])
+    df = historico_pu(chaves, inicio)
+    print(f"--- ⏪ Backfill Tesouro desde {inicio} ({df['ticker'].nunique()} títulos) ---")
+    return pd.DataFrame({'ticker': df['ticker'].map(originais), 'data': df['data'], 'close': df['close'], 'fonte': 'TESOURO'})
+
+def backfill_yahoo(df_assets, resolvedor, inicio, pares_cambio=('USDBRL=X',)):
+    """Fechamentos históricos (desde 'inicio') dos ativos cotados no Yahoo, para o histórico de preços."""
+    cotados = set(resolvedor.cadastrados(TIPOS_BR + TIPOS_EXTERIOR))
+    simbolos = {}
+    for t in df_assets['ticker']:
+        ts = str(t).strip()
+        if ts.upper() in cotados: simbolos[resolvedor.yahoo(ts)] = ts
+    for par in pares_cambio: simbolos[par] = par
+    print(f"--- ⏪ Backfill Yahoo desde {inicio} ({len(simbolos)} símbolos) ---")
+    df = historico_yahoo(list(simbolos), inicio)
+    return pd.DataFrame({'ticker': df['simbolo'].map(simbolos), 'data': df['data'], 'close': df['close'], 'fonte': 'YAHOO'})
+
 if __name__ == "__main__":
-    update_prices()
+    parser = argparse.ArgumentParser(description="Atualização de cotações (market_data)")
+    parser.add_argument("--backfill", metavar="AAAA-MM-DD", help="Preenche o histórico de preços com o Yahoo desde esta data")
+    parser.add_argument("--refresh", action="store_true", help="Ignora o cache de cotações e consulta todas as fontes")
+    parser.add_argument("--report", action="store_true", help="Imprime a tabela de telemetria no final")
+    args = parser.parse_args()
+    with execucao("update_market_data", resumo=args.report):
+        update_prices(backfill=args.backfill, refresh=args.refresh)
@@ -1,36 +1,32 @@
-import yfinance as yf
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
-import os
-import json
 import numpy as np
+import argparse
+from provedores import executar
+from planilhas import Sessao, CABECALHO_PRECOS, PRIORIDADE_PRECOS, agora_gmt3
+from simbolos import Resolvedor
+from telemetria import execucao, contar, registrar_erro
 
-def update_portfolio_prices():
-    ID_PLANILHA = "1agsg85drPHHQQHPgUdBKiNQ9_riqV3ZvNxbaZ3upSx8"
+def update_portfolio_prices(sessao=None):
+    """Cotações Yahoo dos tickers das transações; com 'sessao' a escrita fica para sessao.gravar()."""
+    propria = sessao is None
+    sessao = sessao or Sessao()
     
     # 1. Autenticação
     try:
-        info = json.loads(os.environ['GOOGLE_SHEETS_CREDS'])
-        creds = Credentials.from_service_account_info(info, scopes=[
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ])
-        client = gspread.authorize(creds)
-        sh = client.open_by_key(ID_PLANILHA)
+        sessao.planilha
     except Exception as e:
         print(f"Erro na autenticação: {e}")
         return
 
     # 2. Obter Tickers
-    ws_trans = sh.worksheet("transactions")
-    df_trans = pd.DataFrame(ws_trans.get_all_records())
-    df_trans.columns = [c.lower().strip() for c in df_trans.columns]
+    df_trans = sessao.tabela("transactions")
     
     all_tickers = [str(t).strip() for t in df_trans['ticker'].unique() if str(t).strip() != ""]
     
-    # Filtra apenas o que o Yahoo provavelmente conhece
-    tickers_to_fetch = [t for t in all_tickers if ".SA" in t or len(t) <= 6]
+    # Símbolo Yahoo de cada ticker pelo cadastro (renda fixa e fundos não têm)
+    resolvedor = Resolvedor(sessao.tabela("assets"))
+    simbolos = {t: resolvedor.yahoo(t) for t in all_tickers if resolvedor.yahoo(t)}
+    tickers_to_fetch = list(dict.fromkeys(simbolos.values()))
     
     # 3. Buscar Preços
     print(f"Buscando preços para {len(tickers_to_fetch)} ativos...")
@@ -38,13 +34,14 @@ def update_portfolio_prices():
     
     if tickers_to_fetch:
         try:
+            import yfinance as yf
             # Baixando dados
-            data = yf.download(tickers_to_fetch, period="1d", group_by='ticker', progress=False)
+            data = executar("YAHOO", yf.download, tickers_to_fetch, period="1d", group_by='ticker', progress=False)
             
-            for t in tickers_to_fetch:
+            for t, s in simbolos.items():
                 try:
                     if len(tickers_to_fetch) > 1:
-                        val = data[t]['Close'].iloc[-1]
+                        val = data[s]['Close'].iloc[-1]
                     else:
                         val = data['Close'].iloc[-1]
                     
@@ -53,36 +50,45 @@ def update_portfolio_prices():
                         price_dict[t] = 0.0
                     else:
                         price_dict[t] = float(val)
-                except:
+                except Exception as e:
+                    registrar_erro("YAHOO.ticker", e)
                     price_dict[t] = 0.0
         except Exception as e:
             print(f"Erro no download: {e}")
+            registrar_erro("YAHOO.download", e)
 
     # 4. Preparar lista Final (Limpando qualquer valor inválido para JSON)
+    agora = agora_gmt3()
     updates = []
+    reservas = []  # sem cotação do Yahoo: perdem para o preço de qualquer outro estágio
     for t in all_tickers:
         price = price_dict.get(t, 0.0)
         
         # Se for renda fixa que o Yahoo não achou, colocamos 1.0 para manter o saldo
         if price == 0.0:
-            if any(x in t.upper() for x in ["LCA", "FGTS", "PREV", "TD_"]):
+            reservas.append(t)
+            if resolvedor.sem_cotacao(t):
                 price = 1.0
+                contar("preco.padrao_1")
+            else:
+                contar("preco.zero")
         
-        updates.append([t, price])
+        updates.append([t, price, agora])
     
     # 5. Escrever na market_data
     try:
-        ws_market = sh.worksheet("market_data")
-        ws_market.clear()
-        
-        # Cabeçalho + Dados
-        final_values = [['ticker', 'close_price']] + updates
-        
-        # Usando a sintaxe que não gera erro de JSON
-        ws_market.update(values=final_values, range_name='A1')
-        print(f"Sucesso! {len(updates)} tickers atualizados.")
+        # Mesclado por ticker no formato da market_data: as demais linhas e o last_update ficam
+        sessao.mesclar("market_data", CABECALHO_PRECOS, updates, PRIORIDADE_PRECOS['update_prices'], reservas=reservas)
+        if propria:
+            sessao.gravar()
+            print(f"Sucesso! {len(updates)} tickers atualizados.")
     except Exception as e:
         print(f"Erro ao gravar: {e}")
+        registrar_erro("planilha.escrita", e)
 
 if __name__ == "__main__":
-    update_portfolio_prices()
+    parser = argparse.ArgumentParser(description="Cotações das transações via Yahoo (market_data)")
+    parser.add_argument("--report", action="store_true", help="Imprime a tabela de telemetria no final")
+    args = parser.parse_args()
+    with execucao("update_prices", resumo=args.report):
+        update_portfolio_prices()